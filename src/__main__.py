@@ -0,0 +1,210 @@
+"""
+Command line entry point: python -m src <command>.
+Commands import their modules when they run, so that converting one file in a shell loop or a Make rule
+does not pay for numpy, tqdm or the batch machinery.
+"""
+import argparse
+import contextlib
+import json
+import pathlib
+import sys
+from typing import Dict, List, Optional
+
+
+def _read_json(path: str) -> Dict:
+    if path == "-":
+        return json.load(sys.stdin)
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _select_entry(data: Dict, hooktheoryid: Optional[str]) -> Dict:
+    """_select_entry.
+    Get an entry from a json file holding either a single entry or a dataset
+
+    Args:
+        data (Dict): content of the json file
+        hooktheoryid (Optional[str]): id of the entry in a dataset, may be omitted if it holds a single entry
+
+    Returns:
+        Dict: json_data of the entry
+    """
+    if "annotations" in data:
+        return data
+    if hooktheoryid is not None:
+        if hooktheoryid not in data:
+            raise SystemExit(f"{hooktheoryid} is not in the dataset")
+        return data[hooktheoryid]
+    if len(data) != 1:
+        raise SystemExit(f"The dataset holds {len(data)} entries, select one with --id")
+    return next(iter(data.values()))
+
+
+def convert_command(args: argparse.Namespace):
+    entry = _select_entry(_read_json(args.input), args.id)
+    # the warnings of the conversion must not end up in the converted file
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.format == "midi":
+            from src.midi import convert_to_midi
+
+            content = convert_to_midi(entry)
+        else:
+            from src.converter import convert
+
+            content = convert(
+                entry,
+                tempo=args.tempo,
+                timing=args.timing,
+                start_beat=args.start_beat,
+                end_beat=args.end_beat,
+            ).encode("utf-8")
+    if args.output is None:
+        sys.stdout.buffer.write(content)
+        if args.format == "kern":
+            sys.stdout.buffer.write(b"\n")
+    else:
+        with open(args.output, "wb") as f:
+            f.write(content)
+
+
+def dataset_stats(data: Dict[str, Dict]) -> Dict:
+    """dataset_stats.
+    Summary of a dataset without converting it
+
+    Args:
+        data (Dict[str, Dict]): hooktheory dataset, mapping hooktheoryids to json entries
+
+    Returns:
+        Dict: counts of entries, notes, chords and changes, reason codes of the prefilter and predicted conversion time
+    """
+    from src.costmodel import CostModel, features
+    from src.prefilter import classify_dataset
+
+    model = CostModel()
+    out = {
+        "entries": len(data),
+        "notes": 0,
+        "chords": 0,
+        "key_changes": 0,
+        "meter_changes": 0,
+        "rejected": {},
+        "predicted_seconds": 0.0,
+    }
+    rejected = classify_dataset(data)
+    for k, v in data.items():
+        values = features(v)
+        out["notes"] += values[0]
+        out["chords"] += values[1]
+        out["key_changes"] += values[2]
+        out["meter_changes"] += values[3]
+        if k not in rejected:
+            out["predicted_seconds"] += model.estimate(values)
+    for reason in rejected.values():
+        out["rejected"][reason] = out["rejected"].get(reason, 0) + 1
+    out["rejected"] = dict(sorted(out["rejected"].items()))
+    return out
+
+
+def stats_command(args: argparse.Namespace):
+    data = _read_json(args.input)
+    if "annotations" in data:
+        data = {data["hooktheory"]["id"]: data}
+    print(json.dumps(dataset_stats(data), indent=1))
+
+
+def _kern_files(paths: List[pathlib.Path]) -> List[pathlib.Path]:
+    out = []
+    for path in paths:
+        out += sorted(path.glob("*.krn")) if path.is_dir() else [path]
+    return out
+
+
+def validate_command(args: argparse.Namespace):
+    from src.validate import validate_kern
+
+    num_invalid = 0
+    files = _kern_files(args.files)
+    for path in files:
+        with open(path, "r") as f:
+            problems = validate_kern(f.read())
+        if problems:
+            num_invalid += 1
+        for problem in problems:
+            print(f"{path}: {problem}")
+    print(f"{num_invalid} of {len(files)} files have problems.")
+    if num_invalid > 0:
+        raise SystemExit(1)
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    # the batch runner has its own options
+    if len(argv) > 0 and argv[0] == "batch":
+        from src.batch import main as batch_main
+
+        return batch_main(argv[1:])
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src",
+        description="Convert Hooktheory json annotations to **kern or MIDI files.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = commands.add_parser(
+        "convert", help="convert one entry, written to the standard output by default"
+    )
+    convert_parser.add_argument(
+        "input",
+        nargs="?",
+        default="-",
+        help="json file holding an entry or a dataset, - for the standard input",
+    )
+    convert_parser.add_argument("-o", "--output", type=pathlib.Path, default=None)
+    convert_parser.add_argument(
+        "--id", default=None, help="hooktheoryid of the entry when the input is a dataset"
+    )
+    convert_parser.add_argument("--format", choices=["kern", "midi"], default="kern")
+    convert_parser.add_argument(
+        "--tempo", action="store_true", help="write tempo records from the beat alignment"
+    )
+    convert_parser.add_argument(
+        "--timing", action="store_true", help="add a **time spine with event times in seconds"
+    )
+    convert_parser.add_argument(
+        "--start-beat", type=float, default=None, help="start of the excerpt to convert"
+    )
+    convert_parser.add_argument(
+        "--end-beat", type=float, default=None, help="end of the excerpt to convert"
+    )
+    convert_parser.set_defaults(func=convert_command)
+
+    commands.add_parser(
+        "batch", help="convert a whole dataset, see python -m src batch -h", add_help=False
+    )
+
+    stats_parser = commands.add_parser(
+        "stats", help="print the size of a dataset and the entries the prefilter rejects"
+    )
+    stats_parser.add_argument("input", help="json file, - for the standard input")
+    stats_parser.set_defaults(func=stats_command)
+
+    validate_parser = commands.add_parser(
+        "validate", help="check the structure of .krn files"
+    )
+    validate_parser.add_argument(
+        "files", type=pathlib.Path, nargs="+", help=".krn files or folders containing them"
+    )
+    validate_parser.set_defaults(func=validate_command)
+
+    args = parser.parse_args(argv)
+    if (
+        args.command == "convert"
+        and args.end_beat is not None
+        and args.end_beat <= (args.start_beat or 0)
+    ):
+        convert_parser.error("--end-beat must be after --start-beat")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
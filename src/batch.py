@@ -0,0 +1,487 @@
+"""
+Batch conversion of the hooktheory dataset, optionally spread over several processes.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import pathlib
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tqdm import tqdm
+
+from src.converter import convert, make_spines
+from src.costmodel import CostModel, features, longest_first
+from src.dedup import find_duplicates, relabel_kern
+from src.measurecache import measure_cache_info
+from src.metrics import BatchMetrics
+from src.midi import convert_to_midi
+from src.prefilter import classify_dataset
+from src.search import SearchIndex, Sequences, kern_spines, song_sequences
+from src.shards import parse_shard, select_shard, write_manifest
+from src.sharedcorpus import SharedCorpus, Spec
+
+# Skipping a few complex files to process other easy ones
+SKIP = ["pJkmZNKkmqn", "RZwxKnNjged", "-kwxANXDoKG"]
+
+FORMAT_EXTENSIONS = {
+    "kern": ".krn",
+    "midi": ".mid",
+}
+
+# state of a worker process, set once by _init_worker
+_worker = {}
+
+
+def export_entry(json_data: Dict, fmt: str = "kern", **options) -> bytes:
+    """export_entry.
+    Convert a single json entry to the requested output format
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+        fmt (str): output format, one of FORMAT_EXTENSIONS
+        options: keyword arguments of `convert` for the kern format
+
+    Returns:
+        bytes: content of the output file
+    """
+    match fmt:
+        case "kern":
+            return convert(json_data, **options).encode("utf-8")
+        case "midi":
+            return convert_to_midi(json_data)
+        case _:
+            raise ValueError(f"Unknown output format {fmt}")
+
+
+def _index_entry(json_data: Dict, content: bytes, fmt: str) -> Sequences:
+    """_index_entry.
+    Extract the sequences of src.search from an exported entry. The spines of a .krn file are read back
+    from its content, a MIDI file has none so they are made once from the annotations.
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+        content (bytes): content of the output file
+        fmt (str): output format, one of FORMAT_EXTENSIONS
+
+    Returns:
+        Sequences: (tokens, bar numbers) for each kind
+    """
+    if fmt == "kern":
+        melody, harmony = kern_spines(content.decode("utf-8"))
+    else:
+        melody, harmony = make_spines(json_data)
+    return song_sequences(json_data, melody, harmony)
+
+
+def _process_entry(
+    task: Tuple[str, Dict, str, pathlib.Path, Dict, bool]
+) -> Tuple[str, Optional[str], float, int, Optional[Sequences], Optional[str]]:
+    """_process_entry.
+    Convert one entry and write the result, errors are returned instead of raised so that a single
+    failing song does not stop the whole batch.
+
+    Args:
+        task (Tuple[str, Dict, str, pathlib.Path, Dict, bool]): (hooktheoryid, json_data, fmt, outpath, options, index),
+            index being a flag to extract the sequences of src.search
+
+    Returns:
+        Tuple[str, Optional[str], float, int, Optional[Sequences], Optional[str]]: (hooktheoryid, error message or None,
+        elapsed time in seconds, bytes written, sequences to index or None, indexing error message or None)
+    """
+    key, json_data, fmt, outpath, options, index = task
+    start = time.perf_counter()
+    try:
+        content = export_entry(json_data, fmt, **options)
+    except Exception as e:
+        return key, f"{type(e).__name__}: {e}", time.perf_counter() - start, 0, None, None
+    with open(outpath / f"{key}{FORMAT_EXTENSIONS[fmt]}", "wb") as f:
+        f.write(content)
+    # the file is written at this point, a failure to index it does not make the conversion fail
+    sequences, index_error = None, None
+    if index and len(content) > 0:
+        try:
+            sequences = _index_entry(json_data, content, fmt)
+        except Exception as e:
+            index_error = f"{type(e).__name__}: {e}"
+    return key, None, time.perf_counter() - start, len(content), sequences, index_error
+
+
+def _init_worker(
+    spec: Spec, fmt: str, outpath: pathlib.Path, options: Dict, index: bool
+):
+    """Attach the shared corpus and keep the arguments common to every task of the run"""
+    _worker["corpus"] = SharedCorpus.attach_worker(spec)
+    _worker["args"] = (fmt, outpath, options, index)
+
+
+def _process_shared(
+    i: int,
+) -> Tuple[str, Optional[str], float, int, Optional[Sequences], Optional[str]]:
+    """_process_shared.
+    Process the i-th entry of the shared corpus, only the index is sent to the worker
+
+    Args:
+        i (int): index of the entry in the shared corpus
+
+    Returns:
+        Tuple[str, Optional[str], float, int, Optional[Sequences], Optional[str]]: same as _process_entry
+    """
+    corpus = _worker["corpus"]
+    return _process_entry((corpus.hooktheoryid(i), corpus.entry(i), *_worker["args"]))
+
+
+def _copy_output(
+    source: Tuple[str, Dict],
+    target: Tuple[str, Dict],
+    fmt: str,
+    outpath: pathlib.Path,
+) -> int:
+    """_copy_output.
+    Write the output of an exact duplicate from the output of the converted entry
+
+    Args:
+        source (Tuple[str, Dict]): (hooktheoryid, json_data) of the converted entry
+        target (Tuple[str, Dict]): (hooktheoryid, json_data) of the duplicate
+        fmt (str): output format, one of FORMAT_EXTENSIONS
+        outpath (pathlib.Path): output folder
+
+    Returns:
+        int: bytes written
+    """
+    extension = FORMAT_EXTENSIONS[fmt]
+    with open(outpath / f"{source[0]}{extension}", "rb") as f:
+        content = f.read()
+    if fmt == "kern":
+        content = relabel_kern(content.decode("utf-8"), source[1], target[1])
+        content = content.encode("utf-8")
+    with open(outpath / f"{target[0]}{extension}", "wb") as f:
+        f.write(content)
+    return len(content)
+
+
+def run_batch(
+    data: Dict[str, Dict],
+    outpath: pathlib.Path,
+    fmt: str = "kern",
+    num_workers: int = 1,
+    skip: Iterable[str] = SKIP,
+    overwrite: bool = False,
+    options: Optional[Dict] = None,
+    prefilter: bool = False,
+    metrics: Optional[BatchMetrics] = None,
+    dedup: bool = False,
+    index: Optional[SearchIndex] = None,
+    cost_model: Optional[CostModel] = None,
+) -> Dict:
+    """run_batch.
+    Convert every entry of the dataset and write one file per entry in outpath.
+    Already converted files are skipped unless overwrite is set.
+
+    Args:
+        data (Dict[str, Dict]): hooktheory dataset, mapping hooktheoryids to json entries
+        outpath (pathlib.Path): output folder
+        fmt (str): output format, one of FORMAT_EXTENSIONS
+        num_workers (int): number of processes to use, 1 converts in the current process.
+            Workers read the entries from a src.sharedcorpus.SharedCorpus.
+        skip (Iterable[str]): hooktheoryids to ignore
+        overwrite (bool): flag to convert entries that already have an output file
+        options (Optional[Dict]): keyword arguments of `convert` for the kern format
+        prefilter (bool): flag to set aside the entries that src.prefilter predicts to fail
+        metrics (Optional[BatchMetrics]): metrics updated after each entry
+        dedup (bool): flag to convert exact duplicates once, see src.dedup
+        index (Optional[SearchIndex]): index to which converted entries are added
+        cost_model (Optional[CostModel]): model used to convert the most expensive entries first, see src.costmodel
+
+    Returns:
+        Dict: manifest of the run, with the hooktheoryids that were "converted", "skipped",
+        already "existing", the "errors" messages of the ones that could not be converted and
+        the reason codes of the "rejected" ones. With an index, "index_errors" gives the messages of the converted
+        entries that could not be indexed. With dedup, "duplicates" maps the ids that were copied
+        to the id that was converted and "near_duplicates" lists the groups of near duplicates.
+        With a cost model, "costs" gives the features, predicted and actual cost of each processed entry.
+    """
+    outpath = pathlib.Path(outpath)
+    outpath.mkdir(parents=True, exist_ok=True)
+    manifest = {
+        "format": fmt,
+        "converted": [],
+        "skipped": [],
+        "existing": [],
+        "errors": {},
+        "rejected": {},
+    }
+    if index is not None:
+        manifest["index_errors"] = {}
+    options = options or {}
+    skip = set(skip)
+    tasks = []
+    for k, v in data.items():
+        if k in skip:
+            manifest["skipped"].append(k)
+        elif not overwrite and (outpath / f"{k}{FORMAT_EXTENSIONS[fmt]}").exists():
+            manifest["existing"].append(k)
+        else:
+            tasks.append((k, v, fmt, outpath, options, index is not None))
+    if prefilter:
+        manifest["rejected"] = classify_dataset({t[0]: t[1] for t in tasks})
+        tasks = [t for t in tasks if t[0] not in manifest["rejected"]]
+    duplicates = {}
+    if dedup:
+        # the tempo comes from the alignment, which is not part of the annotations
+        with_alignment = fmt == "midi" or any(
+            options.get(o, False) for o in ["tempo", "timing"]
+        )
+        groups, near = find_duplicates({t[0]: t[1] for t in tasks}, with_alignment)
+        duplicates = {i: rep for rep, ids in groups.items() for i in ids}
+        manifest["duplicates"] = duplicates
+        manifest["near_duplicates"] = near
+        entries = {t[0]: t[1] for t in tasks}
+        tasks = [t for t in tasks if t[0] not in duplicates]
+    chunksize = 16
+    if cost_model is not None:
+        task_features = {t[0]: features(t[1]) for t in tasks}
+        predicted = {k: cost_model.estimate(f) for k, f in task_features.items()}
+        order = {k: i for i, k in enumerate(longest_first(predicted))}
+        tasks.sort(key=lambda t: order[t[0]])
+        # chunks would group the longest entries on the same worker
+        chunksize = 1
+        manifest["costs"] = {}
+    # sequences of the converted entries that have duplicates
+    representatives = set(duplicates.values())
+    indexed = {}
+    with contextlib.ExitStack() as stack:
+        if num_workers > 1:
+            # the pool is terminated then the corpus unlinked, also when the loop raises
+            corpus = stack.enter_context(
+                SharedCorpus.create({t[0]: t[1] for t in tasks})
+            )
+            pool = stack.enter_context(
+                multiprocessing.Pool(
+                    num_workers,
+                    initializer=_init_worker,
+                    initargs=(corpus.spec, fmt, outpath, options, index is not None),
+                )
+            )
+            results = pool.imap_unordered(
+                _process_shared, range(len(tasks)), chunksize=chunksize
+            )
+        else:
+            pool = None
+            results = map(_process_entry, tasks)
+        for key, error, elapsed, nbytes, sequences, index_error in (
+            pbar := tqdm(results, total=len(tasks))
+        ):
+            pbar.set_description(f"Processing id: {key}")
+            if error is None:
+                manifest["converted"].append(key)
+            else:
+                manifest["errors"][key] = error
+            if cost_model is not None:
+                manifest["costs"][key] = {
+                    "features": task_features[key],
+                    "predicted": predicted[key],
+                    "actual": elapsed,
+                }
+            if index_error is not None:
+                manifest["index_errors"][key] = index_error
+            if sequences is not None:
+                index.add(key, sequences)
+                if key in representatives:
+                    indexed[key] = sequences
+            if metrics is not None:
+                metrics.record(elapsed, nbytes, error)
+                metrics.maybe_write()
+        if pool is not None:
+            # let the workers exit and close their view of the corpus before it is unlinked
+            pool.close()
+            pool.join()
+    for key, rep in duplicates.items():
+        start = time.perf_counter()
+        if rep in manifest["errors"]:
+            manifest["errors"][key] = manifest["errors"][rep]
+            nbytes = 0
+        else:
+            nbytes = _copy_output(
+                (rep, entries[rep]), (key, entries[key]), fmt, outpath
+            )
+            manifest["converted"].append(key)
+            if rep in indexed:
+                index.add(key, indexed[rep])
+            elif rep in manifest.get("index_errors", {}):
+                manifest["index_errors"][key] = manifest["index_errors"][rep]
+        if metrics is not None:
+            metrics.record(
+                time.perf_counter() - start,
+                nbytes,
+                manifest["errors"].get(key),
+                duplicate=True,
+            )
+    if metrics is not None:
+        metrics.write()
+    return manifest
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Convert the hooktheory dataset to **kern or MIDI files."
+    )
+    parser.add_argument(
+        "input", type=pathlib.Path, help="path to the Hooktheory.json file"
+    )
+    parser.add_argument("output", type=pathlib.Path, help="output folder")
+    parser.add_argument(
+        "--format", choices=list(FORMAT_EXTENSIONS), default="kern"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes used for the conversion",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="convert again entries that already have an output file",
+    )
+    parser.add_argument(
+        "--tempo",
+        action="store_true",
+        help="write tempo records from the beat alignment in .krn files",
+    )
+    parser.add_argument(
+        "--timing",
+        action="store_true",
+        help="add a **time spine with event times in seconds to .krn files",
+    )
+    parser.add_argument(
+        "--measure-cache",
+        action="store_true",
+        help="reuse the tokens of passages already converted in the same process",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="convert entries with identical annotations once and copy the result to the other ids",
+    )
+    parser.add_argument(
+        "--index",
+        type=pathlib.Path,
+        default=None,
+        help="folder of the n-gram index of chords and melodic intervals to update with the converted entries, see src.search",
+    )
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="do not convert entries that are predicted to fail, list them with a reason code in the manifest",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=pathlib.Path,
+        default=None,
+        help="file refreshed during the run with throughput, latency and failure metrics, in Prometheus format if it ends with .prom, JSON otherwise",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=10.0,
+        help="seconds between two refreshes of the metrics file",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        metavar="i/N",
+        help="only convert the i-th of N shards (0 <= i < N), see src.shards",
+    )
+    parser.add_argument(
+        "--schedule",
+        action="store_true",
+        help="convert the entries predicted to be the longest first and record predicted and actual costs in the manifest, see src.costmodel",
+    )
+    parser.add_argument(
+        "--cost-model",
+        type=pathlib.Path,
+        default=None,
+        help="weights fitted by src.costmodel, the default weights are used otherwise",
+    )
+    parser.add_argument(
+        "--balanced-shards",
+        action="store_true",
+        help="assign the entries to the shards by predicted cost instead of by hash, every shard must use this option and the same cost model",
+    )
+    args = parser.parse_args(argv)
+    if args.balanced_shards and args.shard is None:
+        parser.error("--balanced-shards requires --shard")
+
+    with open(args.input, "r") as f:
+        data = json.load(f)
+    print(f"json file was loaded! There are {len(data)} entries.")
+
+    cost_model = None
+    if args.schedule or args.balanced_shards:
+        cost_model = CostModel() if args.cost_model is None else CostModel.load(args.cost_model)
+
+    if args.shard is not None:
+        shard, num_shards = args.shard
+        costs = None
+        if args.balanced_shards:
+            costs = {k: cost_model.predict(v) for k, v in data.items()}
+        data = select_shard(data, shard, num_shards, costs)
+        print(f"Shard {shard}/{num_shards} holds {len(data)} entries.")
+    else:
+        shard, num_shards = 0, 1
+
+    metrics = BatchMetrics(args.metrics, args.metrics_interval)
+    index = None
+    if args.index is not None:
+        index = SearchIndex.load(args.index) if args.index.exists() else SearchIndex()
+    manifest = run_batch(
+        data,
+        args.output,
+        args.format,
+        args.workers,
+        overwrite=args.overwrite,
+        options={
+            "tempo": args.tempo,
+            "timing": args.timing,
+            "measure_cache": args.measure_cache,
+        },
+        prefilter=args.prefilter,
+        metrics=metrics,
+        dedup=args.dedup,
+        index=index,
+        # the model orders the run only when asked, balanced shards use it for the assignment alone
+        cost_model=cost_model if args.schedule else None,
+    )
+    if args.balanced_shards:
+        manifest["sharding"] = "balanced"
+    if index is not None:
+        index.save(args.index)
+        print(f"{len(index)} songs in the index.")
+    write_manifest(manifest, args.output, shard, num_shards)
+    for key, error in manifest["errors"].items():
+        print(f"{key}: {error}")
+    print(f"{len(manifest['errors'])} entries could not be converted.")
+    if args.dedup:
+        print(
+            f"{len(manifest['duplicates'])} duplicates were copied, "
+            f"{len(manifest['near_duplicates'])} groups of near duplicates were found."
+        )
+    print(metrics.summary())
+    if args.schedule and len(manifest["costs"]) > 0:
+        recorded = manifest["costs"].values()
+        print(
+            f"Cost model: {sum(c['predicted'] for c in recorded):.3f}s predicted, "
+            f"{sum(c['actual'] for c in recorded):.3f}s actual."
+        )
+    if args.prefilter:
+        print(f"{len(manifest['rejected'])} entries were rejected by the prefilter.")
+    if args.measure_cache and args.workers == 1:
+        info = measure_cache_info()
+        print(f"Measure cache: {info.hits} hits, {info.misses} misses.")
+
+
+if __name__ == "__main__":
+    main()
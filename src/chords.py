@@ -1,42 +1,112 @@
 import copy
-from typing import Dict, List, Tuple
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
-from src.kernfilebuilder import _get_duration_pitch_from_kern_note
+from src.kernfilebuilder import _beam_template, _get_duration_pitch_from_kern_note
 from src.mode_formulas import PC_TO_NAMES
 from src.util import DURATION_TO_KERN, KERN_TO_DURATION, _count_accidentals
 
+# Chord qualities by intervals between consecutive chord tones in root position:
+# (name, suffix of the displayed chord name)
+CHORD_QUALITIES = {
+    # Power chord
+    (7,): ("power", "5"),
+    # Triads
+    (4, 3): ("major", ""),  # Tonic, major 3rd, perfect 5th
+    (3, 4): ("minor", "m"),  # Tonic, minor 3rd, perfect 5th
+    (3, 3): ("diminished", "dim"),  # Tonic, minor 3rd, diminished 5th
+    (4, 4): ("augmented", "aug"),  # Tonic, major 3rd, augmented 5th
+    (5, 2): ("sus4", "sus4"),  # Tonic, p4th, p5th
+    (2, 5): ("sus2", "sus2"),  # Tonic, M2nd, p5th
+    # Sixths
+    (4, 3, 2): ("sixth", "6"),  # Tonic, major 3rd, P5th, major 6th
+    (3, 4, 2): ("minsixth", "m6"),  # Tonic, minor 3rd, P5th, major 6th
+    # Sevenths
+    (4, 3, 3): ("seventh", "7"),  # Tonic, major 3rd, P5th, minor 7th
+    (3, 4, 3): ("minseventh", "min7"),  # Tonic, minor 3rd, P5th, minor 7th
+    (4, 3, 4): ("majseventh", "maj7"),  # Tonic, major 3rd, P5th, major 7th
+    (3, 3, 4): ("halfdiminished", "min7b5"),  # Tonic, minor 3rd, dim 5th, minor 7th
+    (3, 3, 3): ("dimseventh", "dim7"),  # Tonic, minor 3rd, dim 5th, dim 7th
+    (3, 4, 4): ("minmajseventh", "minmaj7"),  # Tonic, minor 3rd, P5th, major 7th
+    (4, 4, 2): ("augseventh", "aug7"),  # Tonic, major 3rd, aug 5th, minor 7th
+    (4, 4, 3): ("augmajseventh", "augmaj7"),  # Tonic, major 3rd, aug 5th, major 7th
+    (5, 2, 3): ("7sus4", "7sus4"),  # Tonic, p4th, p5th, minor 7th
+    (2, 5, 3): ("7sus2", "7sus2"),  # Tonic, M2nd, p5th, minor 7th
+    # Added tones
+    (4, 3, 7): ("add9", "add9"),  # Tonic, M3rd, p5th, M9th
+    (3, 4, 7): ("madd9", "madd9"),  # Tonic, m3rd, p5th, M9th
+    # Extensions
+    (4, 3, 3, 4): ("ninth", "9"),
+    (3, 4, 3, 4): ("minninth", "min9"),
+    (4, 3, 4, 3): ("majninth", "maj9"),
+    (4, 3, 3, 3): ("seventhflatninth", "7b9"),
+    (4, 3, 3, 5): ("seventhsharpninth", "7#9"),
+    (5, 2, 3, 4): ("9sus4", "9sus4"),
+    (4, 3, 3, 4, 3): ("eleventh", "11"),
+    (3, 4, 3, 4, 3): ("mineleventh", "min11"),
+    (4, 3, 4, 3, 3): ("majeleventh", "maj11"),
+    (4, 3, 3, 4, 3, 4): ("thirteenth", "13"),
+    (3, 4, 3, 4, 3, 4): ("minthirteenth", "min13"),
+    (4, 3, 4, 3, 3, 4): ("majthirteenth", "maj13"),
+}
+
 CHORD_INTERVALS = {
-    "major": [4, 3],  # Tonic, major 3rd, perfect 5th
-    "minor": [3, 4],  # Tonic, minor 3rd, perfect 5th
-    "diminished": [3, 3],  # Tonic, minor 3rd, diminished 5th
-    "sus4": [5, 2],  # Tonic, p4th, p5th
-    "add9": [4, 3, 7],  # Tonic, M3rd, p5th, M9th
-    "madd9": [3, 4, 7],  # Tonic, m3rd, p5th, M9th
-    "7sus4": [5, 2, 3],  # Tonic, p4th, p5th, minor 7th
-    "seventh": [4, 3, 3],  # Tonic, major 3rd, P5th, minor 7th
-    "minseventh": [3, 4, 3],  # Tonic, minor 3rd, P5th, minor 7th
-    "majseventh": [4, 3, 4],  # Tonic, major 3rd, P5th, major 7th
+    name: list(intervals) for intervals, (name, _) in CHORD_QUALITIES.items()
 }
 
+CHORD_SUFFIXES = {name: suffix for name, suffix in CHORD_QUALITIES.values()}
+
 CHORD_DISPLAY_NAMES = {
-    "major": lambda x: x.upper(),
-    "minor": lambda x: x.upper() + "m",
-    "diminished": lambda x: x.upper() + "dim",
-    "sus4": lambda x: x.upper() + "sus4",
-    "add9": lambda x: x.upper() + "add9",
-    "madd9": lambda x: x.upper() + "madd9",
-    "7sus4": lambda x: x.upper() + "7sus4",
-    "seventh": lambda x: x.upper() + "7",
-    "minseventh": lambda x: x.upper() + "min7",
-    "majseventh": lambda x: x.upper() + "maj7",
+    name: (lambda x, suffix=suffix: x.upper() + suffix)
+    for name, suffix in CHORD_SUFFIXES.items()
 }
 
 
+def get_chord_quality(intervals: List[int]) -> str:
+    """get_chord_quality.
+    Identify the quality of a chord from its intervals in root position
+
+    Args:
+        intervals (List[int]): root_position_intervals of the chord from hooktheory
+
+    Returns:
+        str: chord quality, a key of CHORD_INTERVALS
+    """
+    try:
+        return CHORD_QUALITIES[tuple(intervals)][0]
+    except KeyError:
+        raise ValueError(f"Unknown chord nature with intervals {intervals}")
+
+
+def chord_bass(root_pitch_class: int, intervals: List[int], inversion: int) -> int:
+    """chord_bass.
+    Pitch class of the bass of an inverted chord, the n-th inversion has the n-th chord tone above the root in the bass
+
+    Args:
+        root_pitch_class (int): pitch class of the root
+        intervals (List[int]): intervals between consecutive chord tones in root position
+        inversion (int): inversion number
+
+    Returns:
+        int: pitch class of the bass
+    """
+    if not 0 <= inversion <= len(intervals):
+        raise ValueError(
+            f"Currently unsupported inversion {inversion} for chord with intervals {intervals}"
+        )
+    return (root_pitch_class + sum(intervals[:inversion])) % 12
+
+
+def _note_name(pitch_class: int, use_sharps: bool) -> str:
+    sharp_name, flat_name = PC_TO_NAMES[pitch_class]
+    return sharp_name if use_sharps else flat_name
+
+
 def _invert_chord(
     chord: Dict, token: str, inversion: int, use_sharps: bool = True
 ) -> str:
     """_invert_chord.
-    Define common possible inversions, that affect the displayed name of the chord 
+    Add the bass note of an inverted chord to its displayed name
 
     Args:
         chord (Dict): chord json representation from hooktheory
@@ -47,48 +117,42 @@ def _invert_chord(
     Returns:
         str: token representing the inverted chord
     """
-    out = token
-    match inversion:
-        case 1:
-            # Get pitch class of third to add correct bass note
-            root = chord["root_pitch_class"]
-            third = (root + chord["root_position_intervals"][0]) % 12
-            sharp_3, flat_3 = PC_TO_NAMES[third]
-            bass = sharp_3 if use_sharps else flat_3
-            out += f"/{bass}"
-        case 2:
-            # Get pitch class of fifth to add correct bass note
-            root = chord["root_pitch_class"]
-            fifth = (
-                root
-                + chord["root_position_intervals"][0]
-                + chord["root_position_intervals"][1]
-            ) % 12
-            sharp_5, flat_5 = PC_TO_NAMES[fifth]
-            bass = sharp_5 if use_sharps else flat_5
-            out += f"/{bass}"
-        case 3:
-            # Get pitch class of seventh to add correct bass note
-            root = chord["root_pitch_class"]
-            seventh = (
-                root
-                + chord["root_position_intervals"][0]
-                + chord["root_position_intervals"][1]
-                + chord["root_position_intervals"][2]
-            ) % 12
-            sharp_7, flat_7 = PC_TO_NAMES[seventh]
-            bass = sharp_7 if use_sharps else flat_7
-            out += f"/{bass}"
-        case _:
-            raise ValueError(
-                f"Currently unsupported inversion {inversion} for chord {chord}"
-            )
-    return out
+    bass = chord_bass(
+        chord["root_pitch_class"], chord["root_position_intervals"], inversion
+    )
+    return token + f"/{_note_name(bass, use_sharps)}"
+
+
+@lru_cache(maxsize=None)
+def chord_token(
+    root_pitch_class: int, quality: str, inversion: int, use_sharps: bool = True
+) -> str:
+    """chord_token.
+    Displayed name of a chord, computed once for each combination of its arguments
+
+    Args:
+        root_pitch_class (int): pitch class of the root
+        quality (str): chord quality, a key of CHORD_INTERVALS
+        inversion (int): inversion number
+        use_sharps (bool): flag to favour enharmonic notes with sharps
+
+    Returns:
+        str: chord token
+    """
+    # Note names are already capitalized, flats stay lowercase
+    token = _note_name(root_pitch_class, use_sharps) + CHORD_SUFFIXES[quality]
+    if inversion != 0:
+        bass = chord_bass(root_pitch_class, CHORD_INTERVALS[quality], inversion)
+        token += f"/{_note_name(bass, use_sharps)}"
+    return token
 
 
-def harmony_list_prep():
+def harmony_list_prep(first_bar: int = 1):
     """harmony_list_prep.
     Create headers for **kern notation of chords
+
+    Args:
+        first_bar (int): number of the first measure
     """
     # Define basic text score
     out = ["**text"]
@@ -97,7 +161,7 @@ def harmony_list_prep():
     out.append("*")
     out.append("*")
     # Start first measure
-    out.append("=1")
+    out.append(f"={first_bar}")
     return out
 
 
@@ -112,38 +176,87 @@ def make_chord_kern(chord: Dict, use_sharps: bool = True) -> str:
     Returns:
         str: chord token
     """
-    # Get chord root name
-    sharp_root, flat_root = PC_TO_NAMES[chord["root_pitch_class"]]
-    root = sharp_root if use_sharps else flat_root
-    # Identify chord nature
-    intervals = chord["root_position_intervals"]
-    nature = None
-    for nat, intrv in CHORD_INTERVALS.items():
-        if intervals == intrv:
-            nature = nat
-            break
-    if nature is None:
-        raise ValueError(f"Unknown chord nature with intervals {intervals}")
-    # Prepare chord token
-    token = CHORD_DISPLAY_NAMES[nature](root)
-    ## Make flat lowercase if there was any
-    if len(root) > 1 and root[-1] == "b":
-        assert token[1] == "B"
-        token = token[0] + "b" + token[2:]
-    # Deal with inversion
-    inversion = chord["inversion"]
-    if inversion != 0:
-        token = _invert_chord(chord, token, inversion, use_sharps)
-    return token
+    quality = get_chord_quality(chord["root_position_intervals"])
+    return chord_token(
+        chord["root_pitch_class"], quality, chord["inversion"], use_sharps
+    )
+
 
+def _beam_open_after(token: str, in_beam: bool) -> bool:
+    """_beam_open_after.
+    Update the beam state of the melody with one more token
 
-def _make_tied_notes(note_token: str, end_tie_duration: float) -> List[str]:
+    Args:
+        token (str): melody token
+        in_beam (bool): flag if a beam group is open before the token
+
+    Returns:
+        bool: True if a beam group is open after the token
+    """
+    if token[0] == "=" or "J" in token:
+        return False
+    if "L" in token:
+        return True
+    return in_beam
+
+
+def _beam_split(
+    template: Optional[Tuple[int, ...]],
+    position: float,
+    start_tie_duration: float,
+    end_tie_duration: float,
+) -> bool:
+    """_beam_split.
+    Check if the two tied notes of a split token are beamed together, as _BeamGroups would beam them:
+    both shorter than a quarter note and in the same group of the meter template
+
+    Args:
+        template (Optional[Tuple[int, ...]]): beam template of the meter, see _beam_template
+        position (float): position of the token in the bar in quarter notes
+        start_tie_duration (float): duration of the first tied note
+        end_tie_duration (float): duration of the second tied note
+
+    Returns:
+        bool: True if the tied notes form a beam group
+    """
+    if template is None or start_tie_duration >= 1 or end_tie_duration >= 1:
+        return False
+    first_slot = position * 4
+    end_slot = (position + start_tie_duration + end_tie_duration) * 4
+    if (
+        not float(first_slot).is_integer()
+        or not float(end_slot).is_integer()
+        or end_slot > len(template)
+    ):
+        return False
+    return template[int(first_slot)] == template[int(end_slot) - 1]
+
+
+def _tie_open_after(token: str, in_tie: bool) -> bool:
+    """Update the tie state of the melody with one more token"""
+    if "]" in token:
+        return False
+    if "[" in token:
+        return True
+    return in_tie
+
+
+def _make_tied_notes(
+    note_token: str,
+    end_tie_duration: float,
+    in_beam: bool = False,
+    beam: bool = False,
+    in_tie: bool = False,
+) -> List[str]:
     """_make_tied_notes.
     Split an existing note token in kern representation between two tied-notes
 
     Args:
         note_token (str): note_token to split
         end_tie_duration (float): duration (in quarter notes) of the second tied note
+        in_beam (bool): flag if the token is inside a beam group, the tied notes then keep its beam marks
+        beam (bool): flag to beam the tied notes together when the token is not in a beam group, see _beam_split
+        in_tie (bool): flag if a tie is open before the token, which continues it
 
     Returns:
         List[str]: tied notes tokens
@@ -155,8 +268,23 @@ def _make_tied_notes(note_token: str, end_tie_duration: float) -> List[str]:
     start_tie = DURATION_TO_KERN[start_tie_duration] + pitch
     # Second part of the tied note
     end_tie = DURATION_TO_KERN[end_tie_duration] + pitch
-    out = [f"[{start_tie}L", f"{end_tie}]J"]
-    return out
+    # a token already tied to its neighbours keeps the ties, the tied notes then continue them
+    opens_tie = "[" in note_token
+    closes_tie = "]" in note_token
+    if not in_tie:
+        start_tie = "[" + start_tie
+    if closes_tie or not (in_tie or opens_tie):
+        end_tie += "]"
+    opens_beam = "L" in note_token
+    closes_beam = "J" in note_token
+    if opens_beam or closes_beam or in_beam:
+        return [
+            start_tie + ("L" if opens_beam else ""),
+            end_tie + ("J" if closes_beam else ""),
+        ]
+    if beam:
+        return [start_tie + "L", end_tie + "J"]
+    return [start_tie, end_tie]
 
 
 def make_harmony_list(
@@ -183,14 +311,26 @@ def make_harmony_list(
     # Initialize melody onset tracker
     melody_onset = 0
     # Prepare chord variables
-    current_chord = harmony_json[0]
-    chord_onset = current_chord["onset"]
+    current_chord = harmony_json[0] if len(harmony_json) > 0 else None
+    chord_onset = current_chord["onset"] if current_chord is not None else None
     next_chord_idx = 1
     # Strip melody headers
     melody_headers = []
     melody = copy.deepcopy(melody_tokens)
     while melody[0][0] in ["*", "!", "%", "="]:
         melody_headers.append(melody.pop(0))
+    # Beam template of the current meter, start of the current bar and position of the last note token in its bar
+    template = None
+    for token in melody_headers:
+        if token.startswith("*M") and not token.startswith("*MM"):
+            template = _beam_template(token)
+    bar_start = 0
+    note_template, note_position = template, 0
+    # Beam and tie states after the tokens already read, and before the last note token
+    in_beam = False
+    note_in_beam = False
+    in_tie = False
+    note_in_tie = False
     # Iterate over melody to count time elapsed
     i = 0
     while i < len(melody):
@@ -198,10 +338,14 @@ def make_harmony_list(
         if note_token[0] == "=":
             # it's a bar token, copy it
             out.append(note_token)
+            in_beam = False
+            bar_start = melody_onset
             i += 1
             continue
         elif note_token[0] == "*":
             # can be a new meter or key token
+            if note_token.startswith("*M") and not note_token.startswith("*MM"):
+                template = _beam_template(note_token)
             if note_token[1] == "k":
                 current_key = note_token
                 sharps, flats = _count_accidentals(current_key)
@@ -228,9 +372,20 @@ def make_harmony_list(
                     out.insert(-1, out.pop())
                 melody_left = melody[:split]
                 melody_right = melody[split + 1 :]
+                end_tie_duration = melody_onset - chord_onset
+                split_duration, split_pitch = _get_duration_pitch_from_kern_note(split_token)
+                start_tie_duration = KERN_TO_DURATION[split_duration] - end_tie_duration
+                # rests are not beamed, as in make_notes_from_melody
+                beam = split_pitch != "r" and _beam_split(
+                    note_template, note_position, start_tie_duration, end_tie_duration
+                )
                 new_tokens = _make_tied_notes(
-                    split_token, melody_onset - chord_onset
+                    split_token, end_tie_duration, note_in_beam, beam, note_in_tie
                 )
+                # a following split of the same note starts at the second tied note
+                note_in_beam = _beam_open_after(new_tokens[0], note_in_beam)
+                note_in_tie = _tie_open_after(new_tokens[0], note_in_tie)
+                note_position += start_tie_duration
                 i += 1
                 melody = melody_left + new_tokens + melody_right
             try:
@@ -248,6 +403,11 @@ def make_harmony_list(
         if not entered_while:
             out.append(".")
         duration, _ = _get_duration_pitch_from_kern_note(note_token)
+        note_template, note_position = template, melody_onset - bar_start
         melody_onset += KERN_TO_DURATION[duration]
+        note_in_beam = in_beam
+        in_beam = _beam_open_after(note_token, in_beam)
+        note_in_tie = in_tie
+        in_tie = _tie_open_after(note_token, in_tie)
         i += 1
     return out, melody_headers + melody
@@ -1,44 +1,162 @@
-from typing import Dict
+import bisect
+import math
+from typing import Dict, List, Optional, Tuple
 
 import src.chords as C
 import src.kernfilebuilder as K
+import src.measurecache as M
 import src.util as U
 
 
-def convert(json_data: Dict) -> str:
-    """convert.
-    Process a json dictionary from hooktheory and returns a str with the corresponding notation for a .krn file
+def has_annotations(json_data: Dict) -> bool:
+    """has_annotations.
+    Check that a json entry has both melody and harmony annotations
 
     Args:
         json_data (Dict): json_data representing a song in the hooktheory dataset
 
     Returns:
-        str: output string of the correctly formatted .krn notation
+        bool: True if the entry can be converted
     """
-    # check data validity before processing
-    if (
+    return not (
         json_data["annotations"]["melody"] is None
         or json_data["annotations"]["harmony"] is None
         or len(json_data["annotations"]["melody"]) == 0
         or len(json_data["annotations"]["harmony"]) == 0
-    ):
-        return ""
-    # Prepare metadata
-    title = U.get_title(json_data)
-    artist = U.get_artist(json_data)
-    id = U.get_hooktheoryid(json_data)
-    metadata = K.make_reference_records(artist, title, id)
+    )
+
+
+def _bar_at(
+    melody: List[Dict], meters: List[Tuple[float, str]], beat: float
+) -> Tuple[int, float]:
+    """_bar_at.
+    Find the bar containing a beat, with the bar lines of make_notes_from_melody where a meter change
+    completes the bar in progress with the duration of the new meter
+
+    Args:
+        melody (List[Dict]): melody annotations from hooktheory's json
+        meters (List[Tuple[float, str]]): list of (onset, meter_token) for this song
+        beat (float): position in beats
+
+    Returns:
+        Tuple[int, float]: number of the bar and position of its first beat
+    """
+    bar_lines = M.get_bar_lines(melody, meters, beat)
+    idx = bisect.bisect_right(bar_lines, beat) - 1
+    return idx + 1, bar_lines[idx]
+
+
+def _active(events: List[Dict], beat: float, field: str) -> int:
+    """Index of the last event starting at or before beat, events being sorted by their field"""
+    return max(bisect.bisect_right(events, beat, key=lambda e: e[field]) - 1, 0)
+
+
+def make_excerpt(
+    json_data: Dict, start_beat: float, end_beat: Optional[float] = None
+) -> Tuple[Dict, int]:
+    """make_excerpt.
+    Cut the events between two beats, the excerpt starts on the bar line before start_beat and its positions
+    are relative to that bar line. Notes and chords crossing the window edges are shortened. Chords are cut at
+    the first note from start_beat, or at start_beat if it is on the bar line, and the chord in effect there
+    is carried in, so that the rest leading to that note is not split. The key, meter and tempo in effect at start_beat are carried in. Only the events inside
+    the window are read.
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+        start_beat (float): start of the window in beats
+        end_beat (Optional[float]): end of the window in beats, None for the end of the song
+
+    Returns:
+        Tuple[Dict, int]: json_data of the excerpt and number of its first bar in the song
+
+    Raises:
+        ValueError: if end_beat is not after start_beat
+    """
+    if end_beat is not None and end_beat <= start_beat:
+        raise ValueError(f"End beat {end_beat} is not after start beat {start_beat}")
+    annotations = json_data["annotations"]
+    end_beat = math.inf if end_beat is None else end_beat
+    first_bar, origin = _bar_at(
+        annotations["melody"], U.get_meters(json_data), start_beat
+    )
+
+    def clip(events: List[Dict], start: float) -> List[Dict]:
+        # at most one event before the start overlaps it
+        first = max(bisect.bisect_left(events, start, key=lambda e: e["onset"]) - 1, 0)
+        last = bisect.bisect_left(events, end_beat, key=lambda e: e["onset"])
+        out = []
+        for event in events[first:last]:
+            onset = max(event["onset"], start)
+            offset = min(event["offset"], end_beat)
+            if offset > onset:
+                out.append(dict(event, onset=onset - origin, offset=offset - origin))
+        return out
+
+    def carry(events: List[Dict]) -> List[Dict]:
+        first = _active(events, start_beat, "beat")
+        last = bisect.bisect_left(events, end_beat, key=lambda e: e["beat"])
+        out = [dict(events[first], beat=0)]
+        for event in events[first + 1 : max(last, first + 1)]:
+            out.append(dict(event, beat=event["beat"] - origin))
+        return out
+
+    melody = clip(annotations["melody"], start_beat)
+    harmony_start = start_beat
+    if start_beat > origin and len(melody) > 0:
+        # start_beat itself when it falls on a note
+        harmony_start = origin + melody[0]["onset"]
+    beat_map = U.get_alignment(json_data)
+    if beat_map is not None:
+        beats = beat_map["beats"]
+        # keep the points around the window for the interpolation
+        first = max(bisect.bisect_right(beats, origin) - 1, 0)
+        last = bisect.bisect_left(beats, end_beat) + 1
+        beat_map = {
+            "beats": [b - origin for b in beats[first:last]],
+            "times": beat_map["times"][first:last],
+        }
+    excerpt = dict(
+        json_data,
+        alignment=None if beat_map is None else {"refined": beat_map},
+        annotations=dict(
+            annotations,
+            num_beats=min(annotations.get("num_beats", math.inf), end_beat) - origin,
+            meters=carry(annotations["meters"]),
+            keys=carry(annotations["keys"]),
+            melody=melody,
+            harmony=clip(annotations["harmony"], harmony_start),
+        ),
+    )
+    return excerpt, first_bar
+
+
+def make_spines(
+    json_data: Dict, measure_cache: bool = False, first_bar: int = 1
+) -> Tuple[List[str], List[str]]:
+    """make_spines.
+    Generate the **kern melody spine and the **text harmony spine of a song
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+        measure_cache (bool): flag to reuse the tokens of passages already converted, see src.measurecache
+        first_bar (int): number of the first measure
+
+    Returns:
+        Tuple[List[str], List[str]]: melody and harmony tokens, both lists have the same length
+    """
+    if measure_cache:
+        return M.make_spines_cached(json_data, first_bar)
     # Prepare melody
     keys = U.get_key_signatures(json_data)
     meters = U.get_meters(json_data)
     ## Initialize melody with first key and first meter
-    melody = K.melody_list_prep(keys[0][1], meters[0][1])
+    melody = K.melody_list_prep(keys[0][1], meters[0][1], first_bar)
     ## add actual notes
     melody += K.make_notes_from_melody(
-        json_data["annotations"]["melody"], meters, keys
+        json_data["annotations"]["melody"], meters, keys, first_bar=first_bar
     )
     # Prepare chords
-    harmony = C.harmony_list_prep()
+    harmony = C.harmony_list_prep(first_bar)
     harmony_tokens, melody = C.make_harmony_list(
         json_data["annotations"]["harmony"], melody, keys
     )
@@ -48,8 +166,58 @@ def convert(json_data: Dict) -> str:
     harmony.append("*-")
 
     assert len(melody) == len(harmony)
+    return melody, harmony
+
+
+def convert(
+    json_data: Dict,
+    tempo: bool = False,
+    timing: bool = False,
+    measure_cache: bool = False,
+    start_beat: Optional[float] = None,
+    end_beat: Optional[float] = None,
+) -> str:
+    """convert.
+    Process a json dictionary from hooktheory and returns a str with the corresponding notation for a .krn file
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+        tempo (bool): flag to write *MM tempo records derived from the beat alignment
+        timing (bool): flag to add a **time spine with the time in seconds of each event in the aligned audio
+        measure_cache (bool): flag to reuse the tokens of passages already converted in this process
+        start_beat (Optional[float]): start of the excerpt to convert in beats, see make_excerpt
+        end_beat (Optional[float]): end of the excerpt to convert in beats, None for the end of the song
+
+    Returns:
+        str: output string of the correctly formatted .krn notation
+
+    Raises:
+        ValueError: if end_beat is not after start_beat
+    """
+    if end_beat is not None and end_beat <= (start_beat or 0):
+        raise ValueError(f"End beat {end_beat} is not after start beat {start_beat or 0}")
+    # check data validity before processing
+    if not has_annotations(json_data):
+        return ""
+    # Prepare metadata
+    title = U.get_title(json_data)
+    artist = U.get_artist(json_data)
+    id = U.get_hooktheoryid(json_data)
+    metadata = K.make_reference_records(artist, title, id)
+    first_bar = 1
+    if start_beat is not None or end_beat is not None:
+        json_data, first_bar = make_excerpt(json_data, start_beat or 0, end_beat)
+    melody, harmony = make_spines(json_data, measure_cache, first_bar)
+    spines = [melody, harmony]
+    if tempo or timing:
+        # numpy is only loaded for the options that need it
+        import src.timing as T
+    if tempo:
+        T.add_tempo_records(melody, harmony, T.get_tempo_records(json_data))
+    if timing:
+        spines.append(T.make_timing_spine(melody, T.get_beat_map(json_data)))
     ## Merge Melody and harmony
-    out_list = [melody[i] + "\t" + harmony[i] for i in range(len(melody))]
+    out_list = ["\t".join(line) for line in zip(*spines)]
     ## Convert list to str
     out_str = "\n".join(out_list)
 
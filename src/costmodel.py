@@ -0,0 +1,191 @@
+"""
+Cost model of the conversion of an entry, to schedule the batch runs.
+The cost is a linear function of features that are cheap to read from the json: numbers of notes, chords,
+key and meter changes, and of notes and chords whose duration needs several tied tokens.
+The batch runner converts the most expensive entries first and can balance the shards by predicted cost,
+the manifest records the predicted and actual cost of each entry so that the weights can be fitted again.
+"""
+import argparse
+import heapq
+import json
+import pathlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.util import DURATION_TO_KERN
+
+FEATURES = ["notes", "chords", "key_changes", "meter_changes", "odd_durations"]
+# Seconds per unit of each feature, the intercept is the fixed cost of an entry
+DEFAULT_WEIGHTS = {
+    "intercept": 1.2e-4,
+    "notes": 9e-6,
+    "chords": 4e-6,
+    "key_changes": 5e-5,
+    "meter_changes": 5e-5,
+    "odd_durations": 2e-5,
+}
+
+
+def features(json_data: Dict) -> List[float]:
+    """features.
+    Features of an entry in the order of FEATURES
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+
+    Returns:
+        List[float]: feature values
+    """
+    annotations = json_data["annotations"]
+    melody = annotations["melody"] or []
+    harmony = annotations["harmony"] or []
+    odd_durations = sum(
+        1 for e in melody + harmony if e["offset"] - e["onset"] not in DURATION_TO_KERN
+    )
+    return [
+        len(melody),
+        len(harmony),
+        len(annotations["keys"]) - 1,
+        len(annotations["meters"]) - 1,
+        odd_durations,
+    ]
+
+
+class CostModel:
+    """CostModel.
+    Linear estimate of the conversion time of an entry in seconds.
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        """__init__.
+
+        Args:
+            weights (Optional[Dict[str, float]]): intercept and weight of each feature, DEFAULT_WEIGHTS if None
+        """
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        self._coefficients = np.array([self.weights[f] for f in FEATURES])
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "CostModel":
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    def save(self, path: pathlib.Path):
+        with open(path, "w") as f:
+            json.dump(self.weights, f, indent=1)
+
+    def estimate(self, values: List[float]) -> float:
+        """Cost of an entry from its features"""
+        return float(self.weights["intercept"] + self._coefficients @ values)
+
+    def predict(self, json_data: Dict) -> float:
+        return self.estimate(features(json_data))
+
+    @classmethod
+    def fit(cls, samples: List[Tuple[List[float], float]]) -> "CostModel":
+        """fit.
+        Least squares fit of the weights, negative weights are set to 0 since no feature makes a conversion faster
+
+        Args:
+            samples (List[Tuple[List[float], float]]): (features, actual cost) of converted entries
+
+        Returns:
+            CostModel: fitted model
+        """
+        x = np.array([[1.0] + list(f) for f, _ in samples], dtype=np.float64)
+        y = np.array([cost for _, cost in samples], dtype=np.float64)
+        coefficients, *_ = np.linalg.lstsq(x, y, rcond=None)
+        coefficients = np.maximum(coefficients, 0)
+        return cls(dict(zip(["intercept"] + FEATURES, coefficients.tolist())))
+
+
+def longest_first(costs: Dict[str, float]) -> List[str]:
+    """longest_first.
+    Longest processing time first order, so that the last tasks of a run are short ones
+
+    Args:
+        costs (Dict[str, float]): predicted cost of each id
+
+    Returns:
+        List[str]: ids by decreasing cost, ties broken by id
+    """
+    return sorted(costs, key=lambda k: (-costs[k], k))
+
+
+def balanced_shards(costs: Dict[str, float], num_shards: int) -> Dict[str, int]:
+    """balanced_shards.
+    Greedy assignment of the ids to the least loaded shard by decreasing cost. The result only depends on
+    the costs, so every machine computing them with the same model gets the same assignment.
+
+    Args:
+        costs (Dict[str, float]): predicted cost of each id
+        num_shards (int): number of shards
+
+    Returns:
+        Dict[str, int]: shard index of each id
+    """
+    loads = [(0.0, shard) for shard in range(num_shards)]
+    out = {}
+    for k in longest_first(costs):
+        load, shard = heapq.heappop(loads)
+        out[k] = shard
+        heapq.heappush(loads, (load + costs[k], shard))
+    return out
+
+
+def read_samples(paths: List[pathlib.Path]) -> List[Tuple[List[float], float]]:
+    """read_samples.
+    Read the (features, actual cost) recorded in batch manifests, entries that failed are ignored
+
+    Args:
+        paths (List[pathlib.Path]): manifest files
+
+    Returns:
+        List[Tuple[List[float], float]]: samples for CostModel.fit
+    """
+    samples = []
+    for path in paths:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+        errors = manifest.get("errors", {})
+        for k, cost in manifest.get("costs", {}).items():
+            if k not in errors:
+                samples.append((cost["features"], cost["actual"]))
+    return samples
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Fit the cost model on the costs recorded by src.batch --schedule."
+    )
+    parser.add_argument(
+        "manifests", type=pathlib.Path, nargs="+", help="manifest files of batch runs"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=pathlib.Path,
+        default=pathlib.Path("costmodel.json"),
+        help="path of the fitted weights",
+    )
+    args = parser.parse_args(argv)
+
+    samples = read_samples(args.manifests)
+    if len(samples) == 0:
+        raise SystemExit("No recorded cost in the manifests")
+    actual = np.array([cost for _, cost in samples])
+    default = CostModel()
+    model = CostModel.fit(samples)
+    model.save(args.output)
+    for name, m in [("default", default), ("fitted", model)]:
+        predicted = np.array([m.estimate(f) for f, _ in samples])
+        error = np.mean(np.abs(predicted - actual))
+        print(
+            f"{name} model: mean absolute error {error * 1000:.3f}ms "
+            f"({error / actual.mean():.1%} of the mean cost)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Detection of duplicate entries, to convert each distinct annotation only once.
+Exact duplicates have the same annotations once normalized, their outputs only differ by the reference records.
+Near-duplicates have the same melody rhythm, melodic intervals and chord progression relative to the key,
+possibly transposed or starting at another beat, they are reported but converted separately.
+"""
+import argparse
+import hashlib
+import json
+import pathlib
+from typing import Dict, List, Optional, Tuple
+
+import src.kernfilebuilder as K
+import src.util as U
+from src.converter import has_annotations
+
+ANNOTATION_FIELDS = ["meters", "keys", "melody", "harmony"]
+# Precision of the positions in beats when comparing annotations
+DECIMALS = 6
+
+
+def _normalize(obj):
+    """Make equal numbers compare equal regardless of their int or float type and rounding noise"""
+    if isinstance(obj, dict):
+        return {k: _normalize(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_normalize(v) for v in obj]
+    if isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        return round(float(obj), DECIMALS)
+    return obj
+
+
+def annotation_hash(json_data: Dict, with_alignment: bool = False) -> str:
+    """annotation_hash.
+    Hash of the normalized musical content of an entry
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+        with_alignment (bool): flag to include the beat alignment, needed when the output depends on the tempo
+
+    Returns:
+        str: sha1 hex digest
+    """
+    content = {k: json_data["annotations"][k] for k in ANNOTATION_FIELDS}
+    if with_alignment:
+        content["alignment"] = json_data.get("alignment")
+    canonical = json.dumps(_normalize(content), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def fingerprint(json_data: Dict) -> str:
+    """fingerprint.
+    Transposition and offset invariant hash of an entry made of the duration, the gap with the previous
+    note and the interval with the previous note of every melody note, and of the duration, root relative
+    to the tonic and quality of every chord
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+
+    Returns:
+        str: sha1 hex digest
+    """
+    annotations = json_data["annotations"]
+    melody = annotations["melody"]
+    notes = []
+    for i, note in enumerate(melody):
+        pitch = 12 * note["octave"] + note["pitch_class"]
+        if i == 0:
+            gap, interval = 0, 0
+        else:
+            previous = melody[i - 1]
+            gap = note["onset"] - previous["offset"]
+            interval = pitch - 12 * previous["octave"] - previous["pitch_class"]
+        notes.append((note["offset"] - note["onset"], gap, interval))
+    tonic = annotations["keys"][0]["tonic_pitch_class"]
+    chords = [
+        (
+            chord["offset"] - chord["onset"],
+            (chord["root_pitch_class"] - tonic) % 12,
+            chord["root_position_intervals"],
+            chord["inversion"],
+        )
+        for chord in annotations["harmony"]
+    ]
+    canonical = json.dumps(_normalize([notes, chords]), separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def find_duplicates(
+    data: Dict[str, Dict], with_alignment: bool = False
+) -> Tuple[Dict[str, List[str]], List[List[str]]]:
+    """find_duplicates.
+    Group the entries of a dataset by annotation hash and by fingerprint.
+    Entries without melody or harmony are ignored.
+
+    Args:
+        data (Dict[str, Dict]): hooktheory dataset, mapping hooktheoryids to json entries
+        with_alignment (bool): flag to include the beat alignment in the exact comparison
+
+    Returns:
+        Tuple[Dict[str, List[str]], List[List[str]]]: exact duplicates as {representative: other ids},
+        the representative being the smallest id of its group, and groups of near-duplicate ids
+        that are not all exact duplicates of each other
+    """
+    exact = {}
+    near = {}
+    for k, v in data.items():
+        if not has_annotations(v):
+            continue
+        exact.setdefault(annotation_hash(v, with_alignment), []).append(k)
+        near.setdefault(fingerprint(v), []).append(k)
+    groups = {}
+    representative = {}
+    for ids in exact.values():
+        ids = sorted(ids)
+        for i in ids:
+            representative[i] = ids[0]
+        if len(ids) > 1:
+            groups[ids[0]] = ids[1:]
+    near_groups = []
+    for ids in near.values():
+        if len({representative[i] for i in ids}) > 1:
+            near_groups.append(sorted(ids))
+    return dict(sorted(groups.items())), sorted(near_groups)
+
+
+def relabel_kern(content: str, source: Dict, target: Dict) -> str:
+    """relabel_kern.
+    Adapt the .krn output of an entry to one of its exact duplicates by rewriting the reference records
+
+    Args:
+        content (str): .krn notation converted from source
+        source (Dict): json_data of the converted entry
+        target (Dict): json_data of the duplicate
+
+    Returns:
+        str: .krn notation of target
+    """
+    source_records = K.make_reference_records(
+        U.get_artist(source), U.get_title(source), U.get_hooktheoryid(source)
+    )
+    target_records = K.make_reference_records(
+        U.get_artist(target), U.get_title(target), U.get_hooktheoryid(target)
+    )
+    assert content.startswith(source_records)
+    return target_records + content[len(source_records) :]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Report exact and near duplicates of the hooktheory dataset."
+    )
+    parser.add_argument(
+        "input", type=pathlib.Path, help="path to the Hooktheory.json file"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=pathlib.Path,
+        default=pathlib.Path("duplicates.json"),
+        help="path of the report",
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.input, "r") as f:
+        data = json.load(f)
+    exact, near = find_duplicates(data)
+    with open(args.output, "w") as f:
+        json.dump({"exact": exact, "near": near}, f, indent=1)
+    print(
+        f"{sum(len(ids) for ids in exact.values())} exact duplicates in {len(exact)} groups, "
+        f"{len(near)} groups of near duplicates."
+    )
+
+
+if __name__ == "__main__":
+    main()
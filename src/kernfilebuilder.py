@@ -1,3 +1,5 @@
+import sys
+from functools import lru_cache
 from typing import Dict, List, Tuple
 
 from src.mode_formulas import PC_TO_NAMES
@@ -9,6 +11,13 @@ from src.util import (
 )
 
 
+# Octaves of the precomputed note tokens, hooktheory melodies stay within a few octaves of C4
+TOKEN_OCTAVES = range(-4, 5)
+# Interned tokens filled by _fill_token_tables
+REST_TOKENS: Dict[float, str] = {}
+NOTE_TOKENS: Dict[Tuple[float, int, int, bool], Tuple[str, ...]] = {}
+
+
 def _make_rest(duration: float) -> List[str]:
     """_make_rest.
     make krn token(s) for representing a rest
@@ -19,28 +28,15 @@ def _make_rest(duration: float) -> List[str]:
     Returns:
         List[str]: the text tokens representing the rest note. There can be several tied tokens if the duration calls for it.
     """
-    out = []
+    if not REST_TOKENS:
+        _fill_token_tables()
     try:
-        durations = [DURATION_TO_KERN[duration]]
+        return [REST_TOKENS[duration]]
     except KeyError:
         # weird duration should be represented with tied notes
         print(f"Couldn't find duration {duration} in known durations")
         durations = find_best_durations_combination(duration)
-    for i, dur in enumerate(durations):
-        token = ""
-        if len(durations) == 1:
-            token += dur
-            token += "r"
-            out.append(token)
-        else:
-            if i == 0:
-                token = f"{dur}r"
-            elif i == len(durations) - 1:
-                token = f"{dur}r"
-            else:
-                token = f"{dur}r"
-            out.append(token)
-    return out
+    return [REST_TOKENS[KERN_TO_DURATION[dur]] for dur in durations]
 
 
 def _note_char_from_octave(pitch: str, accidental: str, octave: int) -> str:
@@ -69,6 +65,45 @@ def _note_char_from_octave(pitch: str, accidental: str, octave: int) -> str:
         return (pitch * abs(octave)) + accidental
 
 
+def _note_name(pitch_class: int, octave: int, use_sharps: bool) -> str:
+    """_note_name.
+    Kern name of a note, without duration
+
+    Args:
+        pitch_class (int): pitch_class of the note as a number between 0 and 11
+        octave (int): octave as a positive or negative integer
+        use_sharps (bool): flag to favour enharmonic names with sharps
+
+    Returns:
+        str: kern representation of the pitch, e.g. 'cc#'
+    """
+    pcsharp, pcflat = PC_TO_NAMES[pitch_class]
+    pc_char = pcsharp if use_sharps else pcflat
+    pitch = pc_char[0]
+    accidental = pc_char[1] if len(pc_char) > 1 else ""
+    return _note_char_from_octave(pitch, accidental, octave)
+
+
+def _fill_token_tables():
+    """_fill_token_tables.
+    Precompute the interned tokens of every rest and note that fits in a single token, on first use
+    so that importing the module stays cheap. NOTE_TOKENS maps (duration, pitch_class, octave, use_sharps)
+    to the note token without tie, opening a tie, closing a tie and both, in this order
+    """
+    for duration, dur in DURATION_TO_KERN.items():
+        REST_TOKENS[duration] = sys.intern(f"{dur}r")
+    for pitch_class in range(12):
+        for octave in TOKEN_OCTAVES:
+            for use_sharps in [False, True]:
+                name = _note_name(pitch_class, octave, use_sharps)
+                for duration, dur in DURATION_TO_KERN.items():
+                    token = dur + name
+                    NOTE_TOKENS[(duration, pitch_class, octave, use_sharps)] = tuple(
+                        sys.intern(t)
+                        for t in [token, "[" + token, token + "]", "[" + token + "]"]
+                    )
+
+
 def _kern_note(
     pitch_class: int,
     octave: int,
@@ -93,6 +128,11 @@ def _kern_note(
     Returns:
         List[str]: the text tokens representing the musical note. There can be several tied tokens if the duration calls for it.
     """
+    if not NOTE_TOKENS:
+        _fill_token_tables()
+    tokens = NOTE_TOKENS.get((duration, pitch_class, octave, use_sharps))
+    if tokens is not None:
+        return [tokens[open_tie + 2 * close_tie]]
     out = []
     try:
         durations = [DURATION_TO_KERN[duration]]
@@ -101,11 +141,7 @@ def _kern_note(
         print(f"Couldn't find duration {duration} in known durations")
         durations = find_best_durations_combination(duration)
     # Now determine pitch class name and use octave info
-    pcsharp, pcflat = PC_TO_NAMES[pitch_class]
-    pc_char = pcsharp if use_sharps else pcflat
-    pitch = pc_char[0]
-    accidental = pc_char[1] if len(pc_char) > 1 else ""
-    note_char = _note_char_from_octave(pitch, accidental, octave)
+    note_char = _note_name(pitch_class, octave, use_sharps)
     for i, dur in enumerate(durations):
         token = ""
         token += dur
@@ -139,13 +175,14 @@ def make_reference_records(artist: str, title: str, htid: str) -> str:
     return COM + OTL + RNB
 
 
-def melody_list_prep(key: str, meter: str):
+def melody_list_prep(key: str, meter: str, first_bar: int = 1):
     """melody_list_prep.
     Create headers for **kern notation of the melody 
 
     Args:
         key (str): krn token representing the key signature at the beginning of the melody
         meter (str): krn token representing the meter at the beginning of the melody
+        first_bar (int): number of the first measure
     """
     # Define basic kern score
     out = ["**kern"]
@@ -155,7 +192,7 @@ def melody_list_prep(key: str, meter: str):
     out.append(key)
     out.append(meter)
     # Start first measure
-    out.append("=1")
+    out.append(f"={first_bar}")
     return out
 
 
@@ -177,7 +214,8 @@ def _get_duration_pitch_from_kern_note(note: str) -> Tuple[str, str]:
             break
     duration = duration.lstrip("[")
     pitch = note[i:]
-    pitch = pitch.rstrip("]")
+    # remove beams then ties
+    pitch = pitch.rstrip("LJ").rstrip("]")
     return duration, pitch
 
 
@@ -193,10 +231,105 @@ def _get_bar_duration(kern_meter: str) -> float:
 
 
 
+@lru_cache(maxsize=None)
+def _beam_template(kern_meter: str) -> Tuple[int, ...]:
+    """_beam_template.
+    Beam group of each 16th note of a bar for a meter: one group per beat in simple meters,
+    per dotted quarter in compound meters and per two or three eighths in other x/8 meters
+
+    Args:
+        kern_meter (str): meter token e.g. '*M6/8'
+
+    Returns:
+        Tuple[int, ...]: group index for each 16th of the bar
+    """
+    num_beats, subdivision = (int(x) for x in kern_meter[2:].split("/"))
+    if subdivision == 8 and num_beats % 3 == 0:
+        group_sizes = [6] * (num_beats // 3)
+    elif subdivision == 8 and num_beats > 3:
+        # 5/8 is 2+3, 7/8 is 2+2+3
+        group_sizes = [4] * ((num_beats - 3) // 2) + [4 if num_beats % 2 == 0 else 6]
+    elif subdivision == 8:
+        group_sizes = [2 * num_beats]
+    else:
+        group_sizes = [4] * int(_get_bar_duration(kern_meter))
+    out = []
+    for group, size in enumerate(group_sizes):
+        out += [group] * size
+    # the bar duration is what the bar lines are based on
+    num_slots = int(_get_bar_duration(kern_meter) * 4)
+    out += [len(group_sizes)] * (num_slots - len(out))
+    return tuple(out[:num_slots])
+
+
+class _BeamGroups:
+    """_BeamGroups.
+    Beam group being written in the melody tokens. Runs of consecutive eighths and sixteenths in the
+    same group of the meter template are beamed when they are closed, by another token or explicitly.
+    """
+
+    def __init__(self, out: List[str], kern_meter: str, enabled: bool = True):
+        self.out = out
+        self.enabled = enabled
+        self.template = _beam_template(kern_meter) if enabled else None
+        # index of the first and last token of the current run
+        self.first = None
+        self.last = None
+        self.group = None
+
+    def set_meter(self, kern_meter: str):
+        self.close()
+        if self.enabled:
+            self.template = _beam_template(kern_meter)
+
+    def add(self, tokens: List[str], position: float, duration: float):
+        """add.
+        Write the tokens of a note and extend or start a run
+
+        Args:
+            tokens (List[str]): kern tokens of the note
+            position (float): position of the note in the bar in quarter notes
+            duration (float): duration of the note in quarter notes
+        """
+        index = len(self.out)
+        self.out.extend(tokens)
+        if not self.enabled:
+            return
+        first_slot, end_slot = position * 4, (position + duration) * 4
+        # notes written with several tokens are not beamed
+        if (
+            len(tokens) != 1
+            or duration >= 1
+            or not float(first_slot).is_integer()
+            or not float(end_slot).is_integer()
+            or end_slot > len(self.template)
+        ):
+            self.close()
+            return
+        group = self.template[int(first_slot)]
+        if self.template[int(end_slot) - 1] != group:
+            self.close()
+            return
+        if self.first is not None and self.group == group and self.last == index - 1:
+            self.last = index
+        else:
+            self.close()
+            self.first, self.last, self.group = index, index, group
+
+    def close(self):
+        if self.first is not None and self.last > self.first:
+            self.out[self.first] = sys.intern(self.out[self.first] + "L")
+            self.out[self.last] = sys.intern(self.out[self.last] + "J")
+        self.first = None
+
+
 def make_notes_from_melody(
     melody: List[Dict[str, int]],
     meters: List[Tuple[int, str]],
     keys: List[Tuple[int, str]],
+    beam: bool = True,
+    first_bar: int = 1,
+    final_rest: bool = True,
 ) -> List[str]:
     """make_notes_from_melody.
     Generate the list of krn tokens representing a melody from hooktheory
@@ -205,6 +338,9 @@ def make_notes_from_melody(
         melody (List[Dict[str, int]]): Dictionary representing the melody of a song as taken from hooktheory's json
         meters (List[Tuple[int, str]]): list of (onset, meter_token) for this song
         keys (List[Tuple[int, str]]): list of (onset, key_token) for this song
+        beam (bool): flag to beam eighths and sixteenths according to the meter
+        first_bar (int): number of the first measure, which is already prepared
+        final_rest (bool): flag to complete the last measure with a rest
 
     Returns:
         List[str]: list of krn tokens representing the melody
@@ -215,7 +351,8 @@ def make_notes_from_melody(
     _, current_meter = meters[current_meter_idx]
     bar_duration = _get_bar_duration(current_meter)
     current_bar_duration = 0
-    bar_counter = 1  # first bar is always prepared
+    bar_counter = first_bar  # first bar is always prepared
+    beams = _BeamGroups(out, current_meter, enabled=beam)
     if len(meters) > 1:
         next_meter_onset = meters[current_meter_idx + 1][0]
     else:
@@ -240,6 +377,8 @@ def make_notes_from_melody(
         if next_meter_onset is not None and current_onset >= next_meter_onset:
             current_meter_idx += 1
             _, current_meter = meters[current_meter_idx]
+            # the insertion would move the tokens of the open beam group
+            beams.set_meter(current_meter)
             if out[-1][0] != "=":
                 # last melody token is not a bar but probably a tied note, we need to insert the new meter before that token.
                 out.insert(-1, current_meter)
@@ -257,6 +396,7 @@ def make_notes_from_melody(
             _, current_key = keys[current_key_idx]
             sharps, flats = _count_accidentals(current_key)
             use_sharps = sharps > flats
+            beams.close()
             if out[-1][0] != "=":
                 # last melody token is not a bar but probably a tied note, we need to insert the new key before that token.
                 out.insert(-1, current_key)
@@ -296,50 +436,64 @@ def make_notes_from_melody(
             ## The note overlaps two measures
             first_note_duration = bar_duration - current_bar_duration
             remaining_note_duration = note_duration - first_note_duration
-            out.extend(
+            beams.add(
                 _kern_note(
                     pitch_class,
                     octave,
                     first_note_duration,
                     use_sharps,
                     open_tie=remaining_note_duration > 0,
-                )
+                ),
+                current_bar_duration,
+                first_note_duration,
             )
             bar_counter += 1
             out.append(f"={bar_counter}")
             while remaining_note_duration >= bar_duration:
+                remaining_note_duration -= bar_duration
+                # a note ending on the bar line closes its tie with this full measure
                 out.extend(
-                    _kern_note(pitch_class, octave, bar_duration, use_sharps)
+                    _kern_note(
+                        pitch_class,
+                        octave,
+                        bar_duration,
+                        use_sharps,
+                        close_tie=remaining_note_duration == 0,
+                    )
                 )
-                remaining_note_duration -= bar_duration
                 bar_counter += 1
                 out.append(f"={bar_counter}")
             if remaining_note_duration > 0:
-                out.extend(
+                beams.add(
                     _kern_note(
                         pitch_class,
                         octave,
                         remaining_note_duration,
                         use_sharps,
                         close_tie=True,
-                    )
+                    ),
+                    0,
+                    remaining_note_duration,
                 )
                 current_bar_duration = remaining_note_duration
             else:
                 current_bar_duration = 0
         else:
             ## The note can be added directly in one measure
-            out.extend(
+            beams.add(
                 _kern_note(
                     pitch_class,
                     octave,
                     note_duration,
                     use_sharps,
                     no_tie_constraints=True,
-                )
+                ),
+                current_bar_duration,
+                note_duration,
             )
             current_bar_duration += note_duration
+    beams.close()
     # Add final rest if necessary
-    if current_bar_duration < bar_duration:
+    if final_rest and current_bar_duration < bar_duration:
         out.extend(_make_rest(bar_duration - current_bar_duration))
     return out
@@ -1,38 +1,64 @@
 """
 Main Processing script to convert json notation from hook theory to **kern files.
 """
+import argparse
 import json
 import pathlib
-
-from tqdm import tqdm
+from typing import List, Optional
 
 from src.converter import convert
 
-print("Processing of full Hooktheory dataset starting...")
 
-with open("data/Hooktheory.json", "r") as f:
-    data = json.load(f)
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Convert the hooktheory dataset to **kern files, one entry after the other."
+    )
+    parser.add_argument(
+        "input",
+        type=pathlib.Path,
+        nargs="?",
+        default=pathlib.Path("data/Hooktheory.json"),
+        help="path to the Hooktheory.json file",
+    )
+    parser.add_argument(
+        "output",
+        type=pathlib.Path,
+        nargs="?",
+        default=pathlib.Path("data/kern/"),
+        help="output folder",
+    )
+    args = parser.parse_args(argv)
+
+    from tqdm import tqdm
+
+    from src.batch import SKIP
+
+    print("Processing of full Hooktheory dataset starting...")
+
+    with open(args.input, "r") as f:
+        data = json.load(f)
+
+    print(f"json file was loaded! There are {len(data)} entries.")
 
-print(f"json file was loaded! There are {len(data)} entries.")
+    outpath = args.output
+    outpath.mkdir(exist_ok=True)
 
-OUTPATH = pathlib.Path("data/kern/")
-OUTPATH.mkdir(exist_ok=True)
+    print(
+        f"{len(list(outpath.glob('*.krn')))} files were already processed, they will be skipped automatically."
+    )
 
-print(
-    f"{len(list(OUTPATH.glob('*.krn')))} files were already processed, they will be skipped automatically."
-)
+    for k, v in (pbar := tqdm(data.items())):
+        pbar.set_description(f"Processing id: {k}")
+        if k in SKIP:
+            continue
+        filename = f"{k}.krn"
+        if (outpath / filename).exists():
+            continue
+        s = convert(v)
 
-# Skipping a few complex files to process other easy ones
-SKIP = ["pJkmZNKkmqn", "RZwxKnNjged", "-kwxANXDoKG"]
+        with open(outpath / filename, "w") as f:
+            f.write(s)
 
-for k, v in (pbar := tqdm(data.items())):
-    pbar.set_description(f"Processing id: {k}")
-    if k in SKIP:
-        continue
-    filename = f"{k}.krn"
-    if (OUTPATH / filename).exists():
-        continue
-    s = convert(v)
 
-    with open(OUTPATH / filename, "w") as f:
-        f.write(s)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""
+Conversion of a song segment by segment, with a bounded cache of the serialized segments.
+Songs repeat whole measures, a repeated passage is only converted the first time it is met.
+Segments are cut on the bar lines that no note or chord split crosses, the tokens of a segment
+only depend on its notes and chords relative to its first bar, on the current key and meter and
+on the key and meter changes inside it, which make the cache key.
+"""
+import math
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import src.chords as C
+import src.kernfilebuilder as K
+import src.util as U
+
+MEASURE_CACHE_SIZE = 4096
+# Duration of the note closing a segment so that the chords inside its last token are written
+SENTINEL_DURATION = 0.25
+
+
+class Segment(NamedTuple):
+    """Segment.
+    Bars of a song that can be converted independently of the rest of the song.
+    """
+
+    # index of the first note, index after the last note
+    first_note: int
+    end_note: int
+    # position of the first bar line and of the closing bar line in beats, None for the last segment
+    start: float
+    end: Optional[float]
+    # number of the first bar
+    first_bar: int
+    # indices of the meter and key in effect at the start of the segment
+    meter_idx: int
+    key_idx: int
+    # indices of the meter and key changes written inside the segment
+    meter_changes: Tuple[int, ...]
+    key_changes: Tuple[int, ...]
+
+
+def _change_triggers(
+    melody: List[Dict], changes: List[Tuple[float, str]]
+) -> Dict[int, int]:
+    """_change_triggers.
+    Find the note that writes each meter or key change, as in make_notes_from_melody
+    where a note triggers at most one change.
+
+    Args:
+        melody (List[Dict]): melody annotations from hooktheory's json
+        changes (List[Tuple[float, str]]): list of (onset, token), the first one is the initial one
+
+    Returns:
+        Dict[int, int]: mapping from note index to the index of the change it writes
+    """
+    out = {}
+    idx = 1
+    for j, note in enumerate(melody):
+        if idx == len(changes):
+            break
+        if note["onset"] >= changes[idx][0]:
+            out[j] = idx
+            idx += 1
+    return out
+
+
+def get_segments(
+    melody: List[Dict],
+    meters: List[Tuple[float, str]],
+    keys: List[Tuple[float, str]],
+) -> List[Segment]:
+    """get_segments.
+    Cut a song on the bar lines that are followed by a rest or a note starting a bar and where no
+    key or meter change is written. Bar positions follow the arithmetic of make_notes_from_melody.
+
+    Args:
+        melody (List[Dict]): melody annotations from hooktheory's json
+        meters (List[Tuple[float, str]]): list of (onset, meter_token) for this song
+        keys (List[Tuple[float, str]]): list of (onset, key_token) for this song
+
+    Returns:
+        List[Segment]: segments covering the song in order
+    """
+    meter_triggers = _change_triggers(melody, meters)
+    key_triggers = _change_triggers(melody, keys)
+    triggers = list(meter_triggers) + list(key_triggers)
+    # a change can be written before the last token of the previous note
+    blocked = set(triggers) | {j - 1 for j in triggers}
+    # (first note, position of the first bar line, number of the first bar, meter index, key index)
+    cuts = [(0, 0, 1, 0, 0)]
+    meter_idx, key_idx = 0, 0
+    bar_duration = K._get_bar_duration(meters[0][1])
+    current_bar_duration = 0
+    bar_counter = 1
+    previous_offset = 0
+    for j, note in enumerate(melody):
+        onset = note["onset"]
+        if j in meter_triggers:
+            meter_idx = meter_triggers[j]
+            bar_duration = K._get_bar_duration(meters[meter_idx][1])
+        if j in key_triggers:
+            key_idx = key_triggers[j]
+        # latest bar line between the previous note and this one
+        cut = previous_offset if current_bar_duration == 0 else None
+        if onset > previous_offset:
+            rest_duration = onset - previous_offset
+            if current_bar_duration + rest_duration >= bar_duration:
+                remaining = rest_duration - (bar_duration - current_bar_duration)
+                bar_counter += 1
+                while remaining >= bar_duration:
+                    remaining -= bar_duration
+                    bar_counter += 1
+                current_bar_duration = remaining if remaining > 0 else 0
+                cut = onset - remaining if remaining >= 0 else None
+            else:
+                current_bar_duration += rest_duration
+        if j > 0 and cut is not None and j not in blocked:
+            cuts.append((j, cut, bar_counter, meter_idx, key_idx))
+        note_duration = note["offset"] - onset
+        previous_offset = note["offset"]
+        if current_bar_duration + note_duration >= bar_duration:
+            remaining = note_duration - (bar_duration - current_bar_duration)
+            bar_counter += 1
+            while remaining >= bar_duration:
+                remaining -= bar_duration
+                bar_counter += 1
+            current_bar_duration = remaining if remaining > 0 else 0
+        else:
+            current_bar_duration += note_duration
+
+    out = []
+    for i, (first_note, start, first_bar, meter_idx, key_idx) in enumerate(cuts):
+        if i + 1 < len(cuts):
+            end_note, end = cuts[i + 1][:2]
+        else:
+            end_note, end = len(melody), None
+        out.append(
+            Segment(
+                first_note,
+                end_note,
+                start,
+                end,
+                first_bar,
+                meter_idx,
+                key_idx,
+                tuple(k for j, k in meter_triggers.items() if first_note <= j < end_note),
+                tuple(k for j, k in key_triggers.items() if first_note <= j < end_note),
+            )
+        )
+    return out
+
+
+def get_bar_lines(
+    melody: List[Dict], meters: List[Tuple[float, str]], end: float
+) -> List[float]:
+    """get_bar_lines.
+    Positions of the bar lines written by make_notes_from_melody. A meter change is written by the note
+    that triggers it and the bar in progress is completed with the duration of the new meter.
+    Positions are those of the written tokens, a note overlapping the previous one starts after it.
+
+    Args:
+        melody (List[Dict]): melody annotations from hooktheory's json
+        meters (List[Tuple[float, str]]): list of (onset, meter_token) for this song
+        end (float): position in beats up to which the bar lines are needed
+
+    Returns:
+        List[float]: bar lines from 0 up to the first one after end
+
+    Raises:
+        ValueError: if a meter change makes the bar in progress already complete, which make_notes_from_melody
+            cannot write
+    """
+    out = [0.0]
+    start = 0.0
+    bar_duration = K._get_bar_duration(meters[0][1])
+    triggers = _change_triggers(melody, meters)
+    last_trigger = max(triggers, default=-1)
+    position = 0.0
+    previous_offset = 0
+    for j, note in enumerate(melody[: last_trigger + 1]):
+        if j in triggers:
+            # the meter is written before the rest leading to the note
+            if position > end:
+                break
+            num_bars = math.floor((position - start) / bar_duration)
+            out += [start + bar_duration * k for k in range(1, num_bars + 1)]
+            start += num_bars * bar_duration
+            bar_duration = K._get_bar_duration(meters[triggers[j]][1])
+            elapsed = position - start
+            # the first token of the note or of its rest would have a negative or null duration
+            if elapsed > bar_duration or (elapsed == bar_duration and note["onset"] <= previous_offset):
+                raise ValueError(
+                    f"Meter change to {meters[triggers[j]][1]} after {elapsed} beats of a bar"
+                )
+        position += max(note["onset"] - previous_offset, 0) + note["offset"] - note["onset"]
+        previous_offset = note["offset"]
+    num_bars = math.floor((end - start) / bar_duration) + 1
+    out += [start + bar_duration * k for k in range(1, num_bars + 1)]
+    return out
+
+
+@lru_cache(maxsize=MEASURE_CACHE_SIZE)
+def _convert_segment(
+    meter: str,
+    key: str,
+    notes: Tuple[Tuple[float, float, int, int], ...],
+    chords: Tuple[Tuple[float, int, Tuple[int, ...], int], ...],
+    meter_changes: Tuple[Tuple[float, str], ...],
+    key_changes: Tuple[Tuple[float, str], ...],
+    length: Optional[float],
+) -> Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[Tuple[int, int], ...]]:
+    """_convert_segment.
+    Convert the normalized content of a segment, bars are numbered as if the segment started the song
+
+    Args:
+        meter (str): meter token in effect at the start of the segment
+        key (str): key token in effect at the start of the segment
+        notes (Tuple[Tuple[float, float, int, int], ...]): (onset, offset, pitch_class, octave) of the notes
+        chords (Tuple[Tuple[float, int, Tuple[int, ...], int], ...]): (onset, root_pitch_class, root_position_intervals, inversion) of the chords
+        meter_changes (Tuple[Tuple[float, str], ...]): meter changes written inside the segment
+        key_changes (Tuple[Tuple[float, str], ...]): key changes written inside the segment
+        length (Optional[float]): position of the closing bar line, None for the last segment of a song
+
+    Returns:
+        Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[Tuple[int, int], ...]]: melody and harmony tokens,
+        without header nor closing bar line, and (index, number) of the bar lines
+    """
+    melody_json = [
+        {"onset": on, "offset": off, "pitch_class": pc, "octave": octave}
+        for on, off, pc, octave in notes
+    ]
+    if length is not None:
+        melody_json.append(
+            {
+                "onset": length,
+                "offset": length + SENTINEL_DURATION,
+                "pitch_class": 0,
+                "octave": 0,
+            }
+        )
+    harmony_json = [
+        {
+            "onset": on,
+            "root_pitch_class": root,
+            "root_position_intervals": list(intervals),
+            "inversion": inversion,
+        }
+        for on, root, intervals, inversion in chords
+    ]
+    meters = [(0, meter)] + list(meter_changes)
+    keys = [(0, key)] + list(key_changes)
+    header = K.melody_list_prep(key, meter)
+    # the measure of the sentinel note is dropped, it is not completed with a rest
+    melody = header + K.make_notes_from_melody(
+        melody_json, meters, keys, final_rest=length is None
+    )
+    harmony, melody = C.make_harmony_list(harmony_json, melody, keys)
+    melody = melody[len(header) :]
+    assert len(melody) == len(harmony)
+    if length is not None:
+        # drop the closing bar line and what follows it
+        end = max(i for i, token in enumerate(melody) if token[0] == "=")
+        melody, harmony = melody[:end], harmony[:end]
+    bars = tuple((i, int(token[1:])) for i, token in enumerate(melody) if token[0] == "=")
+    return tuple(melody), tuple(harmony), bars
+
+
+def measure_cache_info():
+    """Hits, misses and size of the segment cache of the current process"""
+    return _convert_segment.cache_info()
+
+
+def clear_measure_cache():
+    _convert_segment.cache_clear()
+
+
+def _is_exact(positions: List[float]) -> bool:
+    """Check that all positions are multiples of a 64th note, which floats represent exactly"""
+    return all(float(x * 16).is_integer() for x in positions)
+
+
+def make_spines_cached(
+    json_data: Dict, first_bar: int = 1
+) -> Tuple[List[str], List[str]]:
+    """make_spines_cached.
+    Same output as src.converter.make_spines, assembled from cached segments
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+        first_bar (int): number of the first measure
+
+    Returns:
+        Tuple[List[str], List[str]]: melody and harmony tokens, both lists have the same length
+    """
+    keys = U.get_key_signatures(json_data)
+    meters = U.get_meters(json_data)
+    melody_json = json_data["annotations"]["melody"]
+    harmony_json = json_data["annotations"]["harmony"]
+    chord_onsets = [c["onset"] for c in harmony_json]
+    positions = [n["onset"] for n in melody_json] + [n["offset"] for n in melody_json]
+    if chord_onsets == sorted(chord_onsets) and _is_exact(positions + chord_onsets):
+        segments = get_segments(melody_json, meters, keys)
+    else:
+        # chords are assigned to segments by onset, and moving the notes to the start of their
+        # segment must not change the bar arithmetic
+        segments = [
+            Segment(
+                0,
+                len(melody_json),
+                0,
+                None,
+                1,
+                0,
+                0,
+                tuple(_change_triggers(melody_json, meters).values()),
+                tuple(_change_triggers(melody_json, keys).values()),
+            )
+        ]
+
+    melody = K.melody_list_prep(keys[0][1], meters[0][1], first_bar)
+    harmony = C.harmony_list_prep(first_bar)
+    chord_idx = 0
+    for i, segment in enumerate(segments):
+        start = segment.start
+        notes = tuple(
+            (n["onset"] - start, n["offset"] - start, n["pitch_class"], n["octave"])
+            for n in melody_json[segment.first_note : segment.end_note]
+        )
+        chords = []
+        while chord_idx < len(harmony_json) and (
+            segment.end is None or harmony_json[chord_idx]["onset"] < segment.end
+        ):
+            c = harmony_json[chord_idx]
+            chords.append(
+                (
+                    c["onset"] - start,
+                    c["root_pitch_class"],
+                    tuple(c["root_position_intervals"]),
+                    c["inversion"],
+                )
+            )
+            chord_idx += 1
+        segment_melody, segment_harmony, bars = _convert_segment(
+            meters[segment.meter_idx][1],
+            keys[segment.key_idx][1],
+            notes,
+            tuple(chords),
+            tuple((meters[k][0] - start, meters[k][1]) for k in segment.meter_changes),
+            tuple((keys[k][0] - start, keys[k][1]) for k in segment.key_changes),
+            None if segment.end is None else segment.end - start,
+        )
+        # bars of the segment are numbered from 1
+        offset = segment.first_bar + first_bar - 2
+        base = len(melody)
+        melody += segment_melody
+        harmony += segment_harmony
+        if offset > 0:
+            for idx, number in bars:
+                bar = f"={number + offset}"
+                melody[base + idx] = bar
+                harmony[base + idx] = bar
+        if segment.end is not None:
+            bar = f"={segments[i + 1].first_bar + first_bar - 1}"
+            melody.append(bar)
+            harmony.append(bar)
+    melody.append("*-")
+    harmony.append("*-")
+    assert len(melody) == len(harmony)
+    return melody, harmony
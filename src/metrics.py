@@ -0,0 +1,186 @@
+"""
+Live metrics of a batch run: throughput, per-song latency, failures and bytes written.
+Snapshots are written periodically to a JSON file, or to a Prometheus textfile when the path ends with .prom.
+"""
+import json
+import math
+import os
+import pathlib
+import time
+from typing import Callable, Dict, List, Optional
+
+# Latency percentiles reported in the snapshots
+PERCENTILES = [50, 95, 99]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """percentile.
+    Nearest-rank percentile of a list of values
+
+    Args:
+        values (List[float]): values, in any order
+        q (float): percentile between 0 and 100
+
+    Returns:
+        float: value below which q percent of the values fall, 0 for an empty list
+    """
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    rank = max(math.ceil(q / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+class BatchMetrics:
+    """BatchMetrics.
+    Counters updated by the batch runner after each song.
+    """
+
+    def __init__(
+        self,
+        path: Optional[pathlib.Path] = None,
+        interval: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """__init__.
+
+        Args:
+            path (Optional[pathlib.Path]): snapshot file, nothing is written if None
+            interval (float): minimum time in seconds between two snapshots
+            clock (Callable[[], float]): time source, in seconds
+        """
+        self.path = None if path is None else pathlib.Path(path)
+        self.interval = interval
+        self.clock = clock
+        self.start = clock()
+        self.last_write = None
+        self.converted = 0
+        self.duplicates = 0
+        self.latencies = []
+        self.failures = {}
+        self.bytes_written = 0
+
+    def record(
+        self,
+        elapsed: float,
+        nbytes: int = 0,
+        error: Optional[str] = None,
+        duplicate: bool = False,
+    ):
+        """record.
+        Account for one processed song
+
+        Args:
+            elapsed (float): conversion and writing time of the song in seconds
+            nbytes (int): size of the written file
+            error (Optional[str]): error message "ExceptionType: message" if the song could not be converted
+            duplicate (bool): flag for a song copied from the output of its duplicate, whose time is not a conversion latency
+        """
+        if duplicate:
+            self.duplicates += 1
+        else:
+            self.latencies.append(elapsed)
+        if error is None:
+            self.converted += 1
+            self.bytes_written += nbytes
+        else:
+            error_type = error.split(":", 1)[0]
+            self.failures[error_type] = self.failures.get(error_type, 0) + 1
+
+    def snapshot(self) -> Dict:
+        """snapshot.
+        Current state of the run
+
+        Returns:
+            Dict: counters, throughput in songs per second and latency percentiles in seconds
+        """
+        elapsed = self.clock() - self.start
+        songs = len(self.latencies) + self.duplicates
+        return {
+            "elapsed": elapsed,
+            "songs": songs,
+            "converted": self.converted,
+            "failed": songs - self.converted,
+            "duplicates": self.duplicates,
+            "songs_per_second": songs / elapsed if elapsed > 0 else 0.0,
+            "latency": {
+                f"p{q}": percentile(self.latencies, q) for q in PERCENTILES
+            },
+            "failures": dict(sorted(self.failures.items())),
+            "bytes_written": self.bytes_written,
+        }
+
+    def maybe_write(self):
+        """Write a snapshot if the last one is older than the interval"""
+        if self.path is None:
+            return
+        if self.last_write is None or self.clock() - self.last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        """Write a snapshot, the file is replaced atomically so readers never see a partial one"""
+        if self.path is None:
+            return
+        snapshot = self.snapshot()
+        if self.path.suffix == ".prom":
+            content = to_prometheus(snapshot)
+        else:
+            content = json.dumps(snapshot, indent=1)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            f.write(content)
+        os.replace(tmp, self.path)
+        self.last_write = self.clock()
+
+    def summary(self) -> str:
+        """Human readable summary of the run"""
+        s = self.snapshot()
+        latency = ", ".join(f"{k} {v * 1000:.1f}ms" for k, v in s["latency"].items())
+        lines = [
+            f"{s['songs']} songs in {s['elapsed']:.1f}s ({s['songs_per_second']:.1f} songs/s), "
+            f"{s['converted']} converted, {s['failed']} failed.",
+            f"Latency: {latency}.",
+            f"{s['bytes_written']} bytes written.",
+        ]
+        if s["duplicates"] > 0:
+            # copies are counted as converted songs but have no latency
+            lines.insert(2, f"{s['duplicates']} songs copied from their duplicates.")
+        for error_type, count in s["failures"].items():
+            lines.append(f"{error_type}: {count}")
+        return "\n".join(lines)
+
+
+def to_prometheus(snapshot: Dict) -> str:
+    """to_prometheus.
+    Format a snapshot in the Prometheus text exposition format, for the node exporter textfile collector
+
+    Args:
+        snapshot (Dict): snapshot returned by BatchMetrics.snapshot
+
+    Returns:
+        str: content of the .prom file
+    """
+    lines = [
+        "# TYPE hooktheory_batch_songs_total counter",
+        f"hooktheory_batch_songs_total {snapshot['songs']}",
+        "# TYPE hooktheory_batch_converted_total counter",
+        f"hooktheory_batch_converted_total {snapshot['converted']}",
+        "# TYPE hooktheory_batch_duplicates_total counter",
+        f"hooktheory_batch_duplicates_total {snapshot['duplicates']}",
+        "# TYPE hooktheory_batch_failures_total counter",
+    ]
+    for error_type, count in snapshot["failures"].items():
+        lines.append(f'hooktheory_batch_failures_total{{type="{error_type}"}} {count}')
+    lines += [
+        "# TYPE hooktheory_batch_bytes_written_total counter",
+        f"hooktheory_batch_bytes_written_total {snapshot['bytes_written']}",
+        "# TYPE hooktheory_batch_songs_per_second gauge",
+        f"hooktheory_batch_songs_per_second {snapshot['songs_per_second']}",
+        "# TYPE hooktheory_batch_elapsed_seconds gauge",
+        f"hooktheory_batch_elapsed_seconds {snapshot['elapsed']}",
+        "# TYPE hooktheory_batch_latency_seconds summary",
+    ]
+    for name, value in snapshot["latency"].items():
+        quantile = int(name[1:]) / 100
+        lines.append(f'hooktheory_batch_latency_seconds{{quantile="{quantile}"}} {value}')
+    return "\n".join(lines) + "\n"
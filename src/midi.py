@@ -0,0 +1,231 @@
+"""
+Direct Standard MIDI File export of a hooktheory json entry, without going through **kern.
+"""
+import itertools
+import math
+import struct
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from src.chords import get_chord_quality
+from src.mode_formulas import (
+    MODE_TO_MAJOR_OFFSET,
+    MODES_INTERVALS,
+    get_num_accidentals,
+    identify_mode,
+)
+from src.timing import (
+    TEMPO_TOLERANCE,
+    get_beat_map,
+    get_segment_tempi,
+    get_tempo_change_segments,
+)
+
+TICKS_PER_BEAT = 480
+DEFAULT_TEMPO = 500000  # microseconds per beat, i.e. 120 bpm
+# Largest tempo of a set tempo event, which holds 3 bytes
+MAX_TEMPO = 0xFFFFFF
+MELODY_CHANNEL = 0
+CHORD_CHANNEL = 1
+MELODY_VELOCITY = 100
+CHORD_VELOCITY = 70
+# Hooktheory octave 0 is the octave of C4
+MELODY_BASE_PITCH = 60
+# Chords are voiced starting from the octave of C3
+CHORD_BASE_PITCH = 48
+
+
+def _vlq(value: int) -> bytes:
+    """_vlq.
+    Encode an integer as a MIDI variable-length quantity
+
+    Args:
+        value (int): positive integer to encode
+
+    Returns:
+        bytes: encoded value
+    """
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def _to_ticks(beat: float) -> int:
+    return int(round(beat * TICKS_PER_BEAT))
+
+
+def _meta(meta_type: int, data: bytes) -> bytes:
+    return bytes([0xFF, meta_type]) + _vlq(len(data)) + data
+
+
+def _track_chunk(events: List[Tuple[int, int, bytes]]) -> bytes:
+    """_track_chunk.
+    Build a MTrk chunk from a list of events with absolute times
+
+    Args:
+        events (List[Tuple[int, int, bytes]]): list of (tick, priority, message). Events at the same tick are sorted by priority so that note-offs come before note-ons.
+
+    Returns:
+        bytes: the complete MTrk chunk
+    """
+    chunks = []
+    previous_tick = 0
+    for tick, _, message in sorted(events, key=lambda e: (e[0], e[1])):
+        chunks.append(_vlq(tick - previous_tick) + message)
+        previous_tick = tick
+    chunks.append(_vlq(0) + _meta(0x2F, b""))
+    data = b"".join(chunks)
+    return b"MTrk" + struct.pack(">I", len(data)) + data
+
+
+def _note_events(
+    pitch: int, onset: float, offset: float, channel: int, velocity: int
+) -> List[Tuple[int, int, bytes]]:
+    return [
+        (_to_ticks(onset), 1, bytes([0x90 | channel, pitch, velocity])),
+        (_to_ticks(offset), 0, bytes([0x80 | channel, pitch, 0])),
+    ]
+
+
+def _melody_pitch(note: Dict) -> int:
+    return MELODY_BASE_PITCH + 12 * note["octave"] + note["pitch_class"]
+
+
+def chord_voicing(chord: Dict) -> List[int]:
+    """chord_voicing.
+    Compute the MIDI pitches of a chord in close position, taking its inversion into account
+
+    Args:
+        chord (Dict): chord json representation from hooktheory
+
+    Returns:
+        List[int]: MIDI pitches of the chord from the bass upwards
+    """
+    intervals = chord["root_position_intervals"]
+    get_chord_quality(intervals)
+    pitches = [CHORD_BASE_PITCH + chord["root_pitch_class"]]
+    for interval in intervals:
+        pitches.append(pitches[-1] + interval)
+    inversion = chord["inversion"]
+    if not 0 <= inversion < len(pitches):
+        raise ValueError(
+            f"Currently unsupported inversion {inversion} for chord {chord}"
+        )
+    # Move the notes below the bass to the closest octave above it
+    bass = pitches[inversion]
+    upper = pitches[inversion + 1 :] + [
+        p + 12 * ((bass - p) // 12 + 1) for p in pitches[:inversion]
+    ]
+    return [bass] + sorted(upper)
+
+
+def get_tempo_changes(
+    json_data: Dict, tolerance: float = TEMPO_TOLERANCE
+) -> List[Tuple[float, int]]:
+    """get_tempo_changes.
+    Derive the tempo map of a song from its beat alignment, refined alignment is preferred when available.
+    Tempo changes are written at the same beats as the kern tempo records, see src.timing.get_tempo_records
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+        tolerance (float): minimum tempo variation in bpm
+
+    Returns:
+        List[Tuple[float, int]]: list of (beat, microseconds per beat) at each tempo change
+    """
+    beat_map = get_beat_map(json_data)
+    if beat_map is None:
+        return [(0, DEFAULT_TEMPO)]
+    starts, seconds_per_beat = get_segment_tempi(beat_map)
+    tempi = np.clip(np.round(seconds_per_beat * 1e6), 1, MAX_TEMPO).astype(np.int64)
+    changes = get_tempo_change_segments(seconds_per_beat, tolerance)
+    out = list(zip(starts[changes].tolist(), tempi[changes].tolist()))
+    if len(out) == 0:
+        return [(0, DEFAULT_TEMPO)]
+    # the first tempo applies from the start of the song
+    out[0] = (0, out[0][1])
+    return out
+
+
+def _key_signature(key: Dict) -> bytes:
+    """_key_signature.
+    Data of the key signature meta event of a key. The mode is written as its relative major,
+    or as the relative minor when the third above its tonic is minor in the scale of that major.
+
+    Args:
+        key (Dict): key json representation from hooktheory
+
+    Returns:
+        bytes: number of sharps (positive) or flats (negative), then 0 for major or 1 for minor
+    """
+    sdi = key["scale_degree_intervals"]
+    num_accidentals = get_num_accidentals(key["tonic_pitch_class"], sdi)
+    major_scale = set(itertools.accumulate(MODES_INTERVALS["ionian"], initial=0))
+    # position of the modal tonic in the scale of its relative major
+    degree = -MODE_TO_MAJOR_OFFSET[identify_mode(sdi)]
+    minor = 0 if (degree + 4) % 12 in major_scale else 1
+    return struct.pack(">bB", num_accidentals, minor)
+
+
+def _conductor_events(json_data: Dict) -> List[Tuple[int, int, bytes]]:
+    """_conductor_events.
+    Prepare the tempo, meter and key signature meta events
+    """
+    events = []
+    for beat, tempo in get_tempo_changes(json_data):
+        events.append((_to_ticks(beat), 0, _meta(0x51, tempo.to_bytes(3, "big"))))
+    for meter in json_data["annotations"]["meters"]:
+        numerator = meter["beats_per_bar"]
+        denominator = int(math.log2(meter["beat_unit"]))
+        data = bytes([numerator, denominator, 24, 8])
+        events.append((_to_ticks(meter["beat"]), 0, _meta(0x58, data)))
+    for key in json_data["annotations"]["keys"]:
+        events.append((_to_ticks(key["beat"]), 0, _meta(0x59, _key_signature(key))))
+    return events
+
+
+def convert_to_midi(json_data: Dict) -> bytes:
+    """convert_to_midi.
+    Process a json dictionary from hooktheory and returns the bytes of a two-track Standard MIDI File.
+    The first track holds the melody with the tempo, meter and key signature events, the second one the chords.
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+
+    Returns:
+        bytes: content of the .mid file
+    """
+    # check data validity before processing
+    if (
+        json_data["annotations"]["melody"] is None
+        or json_data["annotations"]["harmony"] is None
+        or len(json_data["annotations"]["melody"]) == 0
+        or len(json_data["annotations"]["harmony"]) == 0
+    ):
+        return b""
+    melody_events = _conductor_events(json_data)
+    melody_events.append((0, 0, _meta(0x03, b"Melody")))
+    for note in json_data["annotations"]["melody"]:
+        melody_events += _note_events(
+            _melody_pitch(note),
+            note["onset"],
+            note["offset"],
+            MELODY_CHANNEL,
+            MELODY_VELOCITY,
+        )
+    chord_events = [(0, 0, _meta(0x03, b"Chords"))]
+    for chord in json_data["annotations"]["harmony"]:
+        for pitch in chord_voicing(chord):
+            chord_events += _note_events(
+                pitch,
+                chord["onset"],
+                chord["offset"],
+                CHORD_CHANNEL,
+                CHORD_VELOCITY,
+            )
+    header = b"MThd" + struct.pack(">IHHH", 6, 1, 2, TICKS_PER_BEAT)
+    return header + _track_chunk(melody_events) + _track_chunk(chord_events)
@@ -0,0 +1,376 @@
+"""
+Cheap checks predicting which entries will fail during conversion, so they can be set aside before doing the work.
+The checks run over the whole dataset at once, on the flat arrays of src.sharedcorpus.pack_corpus.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import src.util as U
+from src.chords import CHORD_QUALITIES
+from src.kernfilebuilder import _get_bar_duration
+from src.measurecache import _change_triggers, get_bar_lines
+from src.mode_formulas import MODES_INTERVALS
+from src.sharedcorpus import (
+    CHORDS,
+    HARMONY_FLAG,
+    KEYS,
+    MELODY_FLAG,
+    METERS,
+    NOTES,
+    pack_corpus,
+)
+from src.util import DURATION_TO_KERN
+
+# Reason codes, in the order the corresponding failures would happen during conversion
+EMPTY = "EMPTY"
+UNKNOWN_MODE = "UNKNOWN_MODE"
+UNKNOWN_CHORD = "UNKNOWN_CHORD"
+UNSUPPORTED_INVERSION = "UNSUPPORTED_INVERSION"
+UNSUPPORTED_CHANGE = "UNSUPPORTED_CHANGE"
+UNSUPPORTED_DURATION = "UNSUPPORTED_DURATION"
+
+KERN_DURATIONS = np.array(sorted(DURATION_TO_KERN), dtype=np.float64)
+# Intervals are encoded as digits in this base, the longest chord has 6 intervals and scales 6 or 7
+CODE_BASE = 16
+MAX_INTERVALS = 8
+
+
+def _is_kern_duration(durations: np.ndarray) -> np.ndarray:
+    return np.isin(durations, KERN_DURATIONS)
+
+
+def _split_duration(duration: float) -> List[float]:
+    """_split_duration.
+    Durations of the tokens used to write an event, like find_best_durations_combination without building strings
+    """
+    out = []
+    for value in KERN_DURATIONS[::-1].tolist():
+        count = int(duration // value)
+        out += [value] * count
+        duration -= count * value
+    return out
+
+
+def _rows(offsets: np.ndarray) -> np.ndarray:
+    """Index of the row owning each element of a flat array, rows being given by their start offsets"""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _interval_codes(intervals: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """_interval_codes.
+    Encode each row of intervals as one integer so that rows can be compared to known ones with np.isin
+
+    Args:
+        intervals (np.ndarray): flat array of the intervals of every row
+        offsets (np.ndarray): start of each row in intervals, followed by the end of the last one
+
+    Returns:
+        np.ndarray: code of each row, -1 for rows that cannot be a known chord or mode
+    """
+    rows = _rows(offsets)
+    lengths = np.diff(offsets)
+    digits = np.arange(len(intervals)) - offsets[:-1][rows]
+    out = lengths * CODE_BASE**MAX_INTERVALS
+    np.add.at(out, rows, intervals * CODE_BASE**np.minimum(digits, MAX_INTERVALS - 1))
+    outside = np.zeros(len(lengths), dtype=bool)
+    np.logical_or.at(outside, rows, (intervals < 0) | (intervals >= CODE_BASE))
+    return np.where(outside | (lengths >= MAX_INTERVALS), -1, out)
+
+
+def _known_codes(rows: Iterable[Tuple[int, ...]]) -> np.ndarray:
+    rows = list(rows)
+    intervals = np.array([i for row in rows for i in row], dtype=np.int64)
+    offsets = np.cumsum([0] + [len(row) for row in rows])
+    return _interval_codes(intervals, offsets)
+
+
+KNOWN_MODES = _known_codes(tuple(sdi) for sdi in MODES_INTERVALS.values())
+KNOWN_CHORDS = _known_codes(CHORD_QUALITIES)
+
+
+def _first_per_row(rows: np.ndarray, flags: np.ndarray, num_rows: int) -> np.ndarray:
+    """Index of the first flagged element of each row, -1 if none is flagged"""
+    out = np.full(num_rows, -1)
+    flagged = np.flatnonzero(flags)
+    firsts, idx = np.unique(rows[flagged], return_index=True)
+    out[firsts] = flagged[idx]
+    return out
+
+
+def _tokens_between(
+    points: np.ndarray, point_entries: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Tokens between consecutive distinct points of each entry, as (starts, ends, entries) sorted by entry"""
+    order = np.lexsort((points, point_entries))
+    points, point_entries = points[order], point_entries[order]
+    unique = np.concatenate(
+        [[True], (points[1:] != points[:-1]) | (point_entries[1:] != point_entries[:-1])]
+    )
+    points, point_entries = points[unique], point_entries[unique]
+    same_entry = point_entries[1:] == point_entries[:-1]
+    return points[:-1][same_entry], points[1:][same_entry], point_entries[:-1][same_entry]
+
+
+def _token_bounds(
+    data: Dict[str, Dict],
+    packed: Dict[str, np.ndarray],
+    selected: np.ndarray,
+    bar_lines: Dict[int, List[float]],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """_token_bounds.
+    Compute the start and end of every note and rest token of the melodies without writing them.
+    Events are cut at bar lines and split into tied durations as make_notes_from_melody does,
+    a note overlapping the previous one is written after it.
+
+    Args:
+        data (Dict[str, Dict]): hooktheory dataset that was packed
+        packed (Dict[str, np.ndarray]): arrays returned by pack_corpus
+        selected (np.ndarray): flag of the entries to process, their melody must not be empty
+        bar_lines (Dict[int, List[float]]): bar lines of the selected entries with meter changes, see get_bar_lines
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (token starts, token ends, entry of each token) in beats,
+            sorted by entry then position
+    """
+    song_offsets = packed["song_offsets"]
+    note_entries = _rows(song_offsets[:, NOTES])
+    keep = selected[note_entries]
+    note_entries = note_entries[keep]
+    onsets, offsets = packed["note_times"][keep].T
+    # overlapping notes push back the following ones
+    new_entry = np.concatenate([[True], note_entries[1:] != note_entries[:-1]])
+    overlaps = np.where(new_entry, 0, np.maximum(np.roll(offsets, 1) - onsets, 0))
+    shifts = np.cumsum(overlaps)
+    shifts -= shifts[np.flatnonzero(new_entry)][np.cumsum(new_entry) - 1]
+    onsets, offsets = onsets + shifts, offsets + shifts
+
+    entries = np.flatnonzero(selected)
+    last_note = np.flatnonzero(np.append(new_entry[1:], True))
+    ends = offsets[last_note]
+    # the song ends with a rest filling the bar of the last offset,
+    # a whole bar of rest if the last note ends on a bar line
+    num_meters = np.diff(song_offsets[:, METERS])[entries]
+    first_meter = packed["meter_values"][song_offsets[entries, METERS]]
+    bar_durations = 4 * first_meter[:, 0] / first_meter[:, 1]
+    num_bars = np.floor(ends / bar_durations).astype(np.int64) + 2
+    bar_entries = np.repeat(entries, num_bars)
+    bar_index = np.arange(len(bar_entries)) - np.repeat(np.cumsum(num_bars) - num_bars, num_bars)
+    barlines = [bar_index * np.repeat(bar_durations, num_bars)]
+    barlines_entries = [bar_entries]
+    for i in np.flatnonzero(num_meters > 1).tolist():
+        lines = bar_lines[entries[i]]
+        barlines[0][bar_entries == entries[i]] = np.nan
+        barlines.append(np.array(lines, dtype=np.float64))
+        barlines_entries.append(np.full(len(lines), entries[i]))
+
+    points = np.concatenate([np.zeros(len(entries)), onsets, offsets] + barlines)
+    point_entries = np.concatenate([entries, note_entries, note_entries] + barlines_entries)
+    valid = ~np.isnan(points)
+    starts, ends, token_entries = _tokens_between(points[valid], point_entries[valid])
+    split = np.flatnonzero(~_is_kern_duration(ends - starts)).tolist()
+    if len(split) == 0:
+        return starts, ends, token_entries
+    # tokens that need several tied durations are cut at the end of each piece
+    pieces = [starts[i] + np.cumsum(_split_duration(ends[i] - starts[i]))[:-1] for i in split]
+    return _tokens_between(
+        np.concatenate([starts, ends] + pieces),
+        np.concatenate(
+            [token_entries, token_entries]
+            + [np.full(len(p), token_entries[i]) for p, i in zip(pieces, split)]
+        ),
+    )
+
+
+def _change_positions(json_data: Dict) -> Tuple[Optional[List[float]], List[Tuple[float, bool]]]:
+    """_change_positions.
+    Find where make_notes_from_melody writes the meter and key changes of a song. A change triggered by a note
+    is appended after the bar line if the previous note ends on one, otherwise it is inserted before the last
+    token of the previous note.
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset, with meter or key changes
+
+    Returns:
+        Tuple[Optional[List[float]], List[Tuple[float, bool]]]: bar lines of the song if the meter changes,
+            see get_bar_lines, and (end of the previous note, flag if it is a bar line) for each change
+
+    Raises:
+        ValueError: if a change cannot be written
+    """
+    melody = json_data["annotations"]["melody"]
+    meters = U.get_meters(json_data)
+    keys = [(key["beat"], None) for key in json_data["annotations"]["keys"]]
+    # end of each note as written
+    ends = []
+    position, previous_offset = 0.0, 0
+    for note in melody:
+        position += max(note["onset"] - previous_offset, 0) + note["offset"] - note["onset"]
+        previous_offset = note["offset"]
+        ends.append(position)
+    bar_lines = get_bar_lines(melody, meters, ends[-1])
+    meter_triggers = _change_triggers(melody, meters)
+    key_triggers = _change_triggers(melody, keys)
+    if 0 in meter_triggers or 0 in key_triggers:
+        raise ValueError("Change written before the first note")
+    out = []
+    for j in sorted(set(meter_triggers) | set(key_triggers)):
+        position = ends[j - 1]
+        if j in meter_triggers:
+            # the bar line must have been written with the previous meter
+            previous = max(line for line in bar_lines if line < position)
+            bar_duration = _get_bar_duration(meters[meter_triggers[j] - 1][1])
+            out.append((position, position - previous == bar_duration))
+        else:
+            out.append((position, position in bar_lines))
+    return (bar_lines if len(meters) > 1 else None), out
+
+
+def _chord_splits(
+    data: Dict[str, Dict],
+    packed: Dict[str, np.ndarray],
+    selected: np.ndarray,
+    bar_lines: Dict[int, List[float]],
+    changes: Dict[int, List[Tuple[float, bool]]],
+) -> np.ndarray:
+    """_chord_splits.
+    Predict for each entry whether a chord starting in the middle of a melody token cannot split it in two tied
+    notes, either because the durations have no kern representation, which makes _make_tied_notes fail, or because
+    a meter or key change is written between the token and the next one, which make_harmony_list does not expect.
+
+    Args:
+        data (Dict[str, Dict]): hooktheory dataset that was packed
+        packed (Dict[str, np.ndarray]): arrays returned by pack_corpus
+        selected (np.ndarray): flag of the entries to check
+        bar_lines (Dict[int, List[float]]): bar lines of the selected entries with meter changes
+        changes (Dict[int, List[Tuple[float, bool]]]): positions of the changes of the selected entries with changes,
+            see _change_positions
+
+    Returns:
+        np.ndarray: reason code of the first chord that cannot be written for each entry, None if there is none
+    """
+    out = np.full(len(selected), None, dtype=object)
+    if not np.any(selected):
+        return out
+    starts, ends, token_entries = _token_bounds(data, packed, selected, bar_lines)
+    chord_entries = _rows(packed["song_offsets"][:, CHORDS])
+    keep = selected[chord_entries]
+    chord_entries = chord_entries[keep]
+    chords = packed["chord_times"][keep, 0]
+    change_entries = np.array([i for i, c in changes.items() for _ in c], dtype=np.int64)
+    change_ends = np.array([p for c in changes.values() for p, _ in c], dtype=np.float64)
+    on_bar_line = np.array([b for c in changes.values() for _, b in c], dtype=bool)
+    # positions are made increasing over the whole dataset to search all the chords at once
+    low = min(starts.min(), chords.min(initial=0))
+    span = max(ends.max(), chords.max(initial=0)) - low + 1
+    idx = (
+        np.searchsorted(
+            token_entries * span + (starts - low), chord_entries * span + (chords - low), side="right"
+        )
+        - 1
+    )
+    first_token = np.searchsorted(token_entries, chord_entries, side="left")
+    last_token = np.searchsorted(token_entries, chord_entries, side="right") - 1
+    # chords inside the last token are never written
+    valid = (idx >= first_token) & (idx < last_token)
+    idx = np.clip(idx, 0, len(starts) - 1)
+    token_starts = starts[idx]
+    # several chords in the same token split it one after the other
+    previous = np.concatenate([[-np.inf], chords[:-1]])
+    same_token = np.concatenate([[False], valid[1:] & valid[:-1] & (idx[1:] == idx[:-1])])
+    token_starts = np.where(same_token & (previous > token_starts), previous, token_starts)
+    splits = valid & (chords > token_starts)
+    unsplittable = ~_is_kern_duration(chords - token_starts) | ~_is_kern_duration(ends[idx] - chords)
+
+    # a change inserted before the last token of a note separates that token from the previous one
+    last_tokens = np.searchsorted(
+        token_entries * span + (ends - low), change_entries * span + (change_ends - low)
+    )
+    blocked = np.where(on_bar_line, change_ends, starts[np.clip(last_tokens, 0, len(starts) - 1)])
+    separated = np.isin(chord_entries * span + (ends[idx] - low), change_entries * span + (blocked - low))
+
+    # a change inserted before the first token is taken for a header of the spine
+    out[change_entries[~on_bar_line & (blocked == 0)]] = UNSUPPORTED_CHANGE
+
+    failing = splits & (unsplittable | separated)
+    first = _first_per_row(chord_entries, failing, len(selected))
+    entries = np.flatnonzero(first >= 0)
+    out[entries] = np.where(separated[first[entries]], UNSUPPORTED_CHANGE, UNSUPPORTED_DURATION)
+    return out
+
+
+def classify_dataset(data: Dict[str, Dict]) -> Dict[str, str]:
+    """classify_dataset.
+    Predict which entries of a dataset will fail to convert, without converting them.
+    Every check is a vectorized pass over all the notes, chords and keys of the dataset.
+
+    Args:
+        data (Dict[str, Dict]): hooktheory dataset, mapping hooktheoryids to json entries
+
+    Returns:
+        Dict[str, str]: reason code of the expected failure for every entry that should not be converted
+    """
+    if len(data) == 0:
+        return {}
+    packed = pack_corpus(data)
+    offsets = packed["song_offsets"]
+    counts = np.diff(offsets, axis=0)
+    reasons = np.full(len(data), None, dtype=object)
+
+    empty = (
+        (offsets[:-1, MELODY_FLAG] == 0)
+        | (offsets[:-1, HARMONY_FLAG] == 0)
+        | (counts[:, NOTES] == 0)
+        | (counts[:, CHORDS] == 0)
+    )
+    reasons[empty] = EMPTY
+    pending = ~empty
+
+    key_entries = _rows(offsets[:, KEYS])
+    modes = _interval_codes(packed["key_intervals"], packed["key_interval_offsets"])
+    unknown_mode = np.bincount(key_entries[~np.isin(modes, KNOWN_MODES)], minlength=len(data)) > 0
+    reasons[pending & unknown_mode] = UNKNOWN_MODE
+    pending &= ~unknown_mode
+
+    chord_entries = _rows(offsets[:, CHORDS])
+    chord_offsets = packed["chord_interval_offsets"]
+    unknown_chord = ~np.isin(_interval_codes(packed["chord_intervals"], chord_offsets), KNOWN_CHORDS)
+    # any chord tone can be in the bass
+    inversions = packed["chord_roots"][:, 1]
+    bad_inversion = (inversions < 0) | (inversions > np.diff(chord_offsets))
+    # the first chord that cannot be written gives the reason
+    first = _first_per_row(chord_entries, unknown_chord | bad_inversion, len(data))
+    bad_chord = pending & (first >= 0)
+    reasons[bad_chord] = np.where(unknown_chord[first[bad_chord]], UNKNOWN_CHORD, UNSUPPORTED_INVERSION)
+    pending &= ~bad_chord
+
+    # the songs with meter or key changes are followed one at a time
+    bar_lines, changes = {}, {}
+    keys = list(data)
+    for i in np.flatnonzero(pending & ((counts[:, METERS] > 1) | (counts[:, KEYS] > 1))).tolist():
+        try:
+            lines, changes[i] = _change_positions(data[keys[i]])
+        except ValueError:
+            reasons[i] = UNSUPPORTED_CHANGE
+            pending[i] = False
+            continue
+        if lines is not None:
+            bar_lines[i] = lines
+
+    splits = _chord_splits(data, packed, pending, bar_lines, changes)
+    reasons[pending] = splits[pending]
+
+    return {keys[i]: reasons[i] for i, reason in enumerate(reasons.tolist()) if reason is not None}
+
+
+def check_entry(json_data: Dict) -> Optional[str]:
+    """check_entry.
+    Predict whether an entry can be converted without doing the conversion, see classify_dataset
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+
+    Returns:
+        Optional[str]: reason code of the expected failure, None if the entry looks convertible
+    """
+    return classify_dataset({"entry": json_data}).get("entry")
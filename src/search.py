@@ -0,0 +1,363 @@
+"""
+Inverted n-gram index of the converted corpus, to find chord progressions and melodic figures without scanning the .krn files.
+Three sequences are indexed for each song:
+- "chord": chord tokens as written in the **text spine, e.g. "Bm" or "G/B"
+- "degree": chords relative to the tonic of the current key, e.g. "VIm", ignoring inversions
+- "interval": melodic intervals in semitones between consecutive notes, e.g. "+2" or "-5"
+A saved index is a folder with the hooktheoryids in songs.json and, for each kind, the postings, token ids,
+bar numbers and song offsets in .npy files and the gram -> postings range table in a .json file.
+A query only reads the files of its kind, the arrays are memory-mapped.
+"""
+import argparse
+import bisect
+import itertools
+import json
+import pathlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.chords import CHORD_SUFFIXES, get_chord_quality
+from src.kernfilebuilder import _get_duration_pitch_from_kern_note
+from src.util import KERN_TO_DURATION
+
+KINDS = ["chord", "degree", "interval"]
+# Longest n-gram stored in the index, longer queries are verified on the sequences
+MAX_N = 3
+DEGREE_NAMES = ["I", "bII", "II", "bIII", "III", "IV", "#IV", "V", "bVI", "VI", "bVII", "VII"]
+
+SONGS_FILE = "songs.json"
+# files of each kind in a saved index
+GRAMS_FILE = "{}.grams.json"
+POSTINGS_FILE = "{}.postings.npy"
+TOKENS_FILE = "{}.tokens.npy"
+BARS_FILE = "{}.bars.npy"
+OFFSETS_FILE = "{}.offsets.npy"
+
+# (tokens, bar number of each token) for each kind
+Sequences = Dict[str, Tuple[List[str], List[int]]]
+
+
+def kern_spines(kern: str) -> Tuple[List[str], List[str]]:
+    """kern_spines.
+    Read the melody and harmony spines of a .krn file written by src.converter.convert
+
+    Args:
+        kern (str): .krn notation
+
+    Returns:
+        Tuple[List[str], List[str]]: melody and harmony tokens
+    """
+    melody, harmony = [], []
+    for line in kern.split("\n"):
+        if line.startswith("!"):
+            continue
+        fields = line.split("\t")
+        melody.append(fields[0])
+        harmony.append(fields[1])
+    return melody, harmony
+
+
+def degree_token(chord: Dict, tonic: int) -> str:
+    """degree_token.
+    Name of a chord relative to the tonic of the key, in roman numerals with the quality of the chord
+
+    Args:
+        chord (Dict): chord json representation from hooktheory
+        tonic (int): pitch class of the tonic
+
+    Returns:
+        str: degree token, e.g. "V7" for a dominant seventh
+    """
+    degree = DEGREE_NAMES[(chord["root_pitch_class"] - tonic) % 12]
+    quality = get_chord_quality(chord["root_position_intervals"])
+    return degree + CHORD_SUFFIXES[quality]
+
+
+def interval_token(interval: int) -> str:
+    return f"{interval:+d}"
+
+
+def song_sequences(
+    json_data: Dict, melody: List[str], harmony: List[str]
+) -> Sequences:
+    """song_sequences.
+    Extract the sequences to index from the converted spines of a song
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+        melody (List[str]): tokens of the melody spine
+        harmony (List[str]): tokens of the harmony spine
+
+    Returns:
+        Sequences: (tokens, bar numbers) for each kind
+    """
+    annotations = json_data["annotations"]
+    chords, degrees, chord_bars = [], [], []
+    bar_starts, bar_numbers = [], []
+    position = 0
+    bar = 1
+    key_idx = -1
+    for note_token, chord_token in zip(melody, harmony):
+        if note_token.startswith("*k["):
+            key_idx += 1
+        elif note_token[0] == "=":
+            bar = int(note_token[1:])
+            bar_starts.append(position)
+            bar_numbers.append(bar)
+        elif note_token[0] not in ["*", "!"]:
+            if chord_token != ".":
+                # chords are written in the order of the annotations
+                chord = annotations["harmony"][len(chords)]
+                tonic = annotations["keys"][key_idx]["tonic_pitch_class"]
+                chords.append(chord_token)
+                degrees.append(degree_token(chord, tonic))
+                chord_bars.append(bar)
+            duration, _ = _get_duration_pitch_from_kern_note(note_token)
+            position += KERN_TO_DURATION[duration]
+
+    notes = annotations["melody"]
+    pitches = [12 * n["octave"] + n["pitch_class"] for n in notes]
+    note_bars = [
+        bar_numbers[bisect.bisect_right(bar_starts, n["onset"]) - 1] for n in notes
+    ]
+    intervals = [interval_token(b - a) for a, b in zip(pitches[:-1], pitches[1:])]
+    return {
+        "chord": (chords, chord_bars),
+        "degree": (degrees, list(chord_bars)),
+        "interval": (intervals, note_bars[:-1]),
+    }
+
+
+class SearchIndex:
+    """SearchIndex.
+    Postings of every n-gram up to MAX_N tokens, as flat lists of (song index, position) pairs,
+    along with the indexed sequences to check longer queries.
+    An index read by load keeps its kinds on disk until they are queried, and reads them all back
+    in memory before adding songs.
+    """
+
+    def __init__(self, content: Optional[Dict] = None):
+        """__init__.
+
+        Args:
+            content (Optional[Dict]): content of a saved index, an empty index is created if None
+        """
+        if content is None:
+            content = {
+                "songs": [],
+                "sequences": {kind: [] for kind in KINDS},
+                "bars": {kind: [] for kind in KINDS},
+                "postings": {kind: {} for kind in KINDS},
+            }
+        self.songs = content["songs"]
+        self.sequences = content["sequences"]
+        self.bars = content["bars"]
+        self.postings = content["postings"]
+        self.song_index = {k: i for i, k in enumerate(self.songs)}
+        # folder of a loaded index and the arrays of the kinds read from it
+        self.path = None
+        self._stored = {}
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "SearchIndex":
+        """load.
+        Open an index saved by save, the kinds are read when they are first queried
+
+        Args:
+            path (pathlib.Path): folder of the index
+
+        Returns:
+            SearchIndex: index whose sequences and postings are still on disk
+        """
+        path = pathlib.Path(path)
+        with open(path / SONGS_FILE, "r") as f:
+            songs = json.load(f)
+        out = cls({"songs": songs, "sequences": None, "bars": None, "postings": None})
+        out.path = path
+        return out
+
+    def _stored_kind(self, kind: str) -> Dict:
+        """Arrays of one kind of a loaded index, postings and sequences are memory-mapped"""
+        if kind not in self._stored:
+            with open(self.path / GRAMS_FILE.format(kind), "r") as f:
+                table = json.load(f)
+            self._stored[kind] = {
+                "grams": table["grams"],
+                "vocab": table["vocab"],
+                "postings": np.load(self.path / POSTINGS_FILE.format(kind), mmap_mode="r"),
+                "tokens": np.load(self.path / TOKENS_FILE.format(kind), mmap_mode="r"),
+                "bars": np.load(self.path / BARS_FILE.format(kind), mmap_mode="r"),
+                "offsets": np.load(self.path / OFFSETS_FILE.format(kind)),
+            }
+        return self._stored[kind]
+
+    def _read_all(self):
+        """Read the kinds of a loaded index back in memory, the files can then be overwritten"""
+        if self.sequences is not None:
+            return
+        self.sequences, self.bars, self.postings = {}, {}, {}
+        for kind in KINDS:
+            stored = self._stored_kind(kind)
+            vocab, offsets = stored["vocab"], stored["offsets"].tolist()
+            tokens, bars = stored["tokens"].tolist(), stored["bars"].tolist()
+            self.sequences[kind] = [
+                [vocab[t] for t in tokens[a:b]] for a, b in zip(offsets[:-1], offsets[1:])
+            ]
+            self.bars[kind] = [bars[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+            postings = stored["postings"].reshape(-1).tolist()
+            self.postings[kind] = {
+                gram: postings[2 * start : 2 * stop]
+                for gram, (start, stop) in stored["grams"].items()
+            }
+        # drop the memory maps before save writes over their files
+        self._stored = {}
+
+    def save(self, path: pathlib.Path):
+        """save.
+        Write the index in a folder, see the module docstring for the files
+
+        Args:
+            path (pathlib.Path): folder of the index, created if needed
+        """
+        path = pathlib.Path(path)
+        self._read_all()
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / SONGS_FILE, "w") as f:
+            json.dump(self.songs, f)
+        for kind in KINDS:
+            grams, start = {}, 0
+            for gram, postings in self.postings[kind].items():
+                grams[gram] = [start, start + len(postings) // 2]
+                start += len(postings) // 2
+            postings = np.fromiter(
+                itertools.chain.from_iterable(self.postings[kind].values()),
+                dtype=np.int32,
+                count=2 * start,
+            )
+            vocab = {}
+            tokens = [
+                vocab.setdefault(t, len(vocab)) for sequence in self.sequences[kind] for t in sequence
+            ]
+            offsets = np.zeros(len(self.songs) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(sequence) for sequence in self.sequences[kind]])
+            bars = list(itertools.chain.from_iterable(self.bars[kind]))
+            np.save(path / POSTINGS_FILE.format(kind), postings.reshape(-1, 2))
+            np.save(path / TOKENS_FILE.format(kind), np.array(tokens, dtype=np.int32))
+            np.save(path / BARS_FILE.format(kind), np.array(bars, dtype=np.int32))
+            np.save(path / OFFSETS_FILE.format(kind), offsets)
+            with open(path / GRAMS_FILE.format(kind), "w") as f:
+                json.dump({"vocab": list(vocab), "grams": grams}, f, separators=(",", ":"))
+
+    def __len__(self) -> int:
+        return len(self.songs)
+
+    def add(self, hooktheoryid: str, sequences: Sequences):
+        """add.
+        Index the sequences of a song, a song that is already indexed is ignored
+
+        Args:
+            hooktheoryid (str): hooktheoryid
+            sequences (Sequences): sequences returned by song_sequences
+        """
+        if hooktheoryid in self.song_index:
+            return
+        self._read_all()
+        song = len(self.songs)
+        self.songs.append(hooktheoryid)
+        self.song_index[hooktheoryid] = song
+        for kind in KINDS:
+            tokens, bars = sequences[kind]
+            self.sequences[kind].append(list(tokens))
+            self.bars[kind].append(list(bars))
+            postings = self.postings[kind]
+            for n in range(1, MAX_N + 1):
+                for position in range(len(tokens) - n + 1):
+                    gram = " ".join(tokens[position : position + n])
+                    postings.setdefault(gram, []).extend((song, position))
+
+    def _postings(self, kind: str, gram: str) -> np.ndarray:
+        """(song index, position) pairs of a gram"""
+        if self.sequences is None:
+            stored = self._stored_kind(kind)
+            start, stop = stored["grams"].get(gram, (0, 0))
+            return stored["postings"][start:stop]
+        return np.array(self.postings[kind].get(gram, []), dtype=np.int64).reshape(-1, 2)
+
+    def _tokens(self, kind: str, song: int, position: int, n: int) -> List[str]:
+        """n tokens of the sequence of a song from a position, fewer at the end of the song"""
+        if self.sequences is None:
+            stored = self._stored_kind(kind)
+            offsets = stored["offsets"]
+            start = offsets[song] + position
+            stop = min(start + n, offsets[song + 1])
+            return [stored["vocab"][t] for t in stored["tokens"][start:stop].tolist()]
+        return self.sequences[kind][song][position : position + n]
+
+    def _bar(self, kind: str, song: int, position: int) -> int:
+        if self.sequences is None:
+            stored = self._stored_kind(kind)
+            return int(stored["bars"][stored["offsets"][song] + position])
+        return self.bars[kind][song][position]
+
+    def query(self, kind: str, tokens: List[str]) -> List[Tuple[str, int]]:
+        """query.
+        Find the occurrences of a sequence of tokens
+
+        Args:
+            kind (str): one of KINDS
+            tokens (List[str]): tokens to look for, intervals may be given without their sign when positive
+
+        Returns:
+            List[Tuple[str, int]]: (hooktheoryid, bar number of the first token) of every occurrence
+        """
+        if kind == "interval":
+            tokens = [interval_token(int(t)) for t in tokens]
+        if len(tokens) == 0:
+            return []
+        # the rarest n-gram of the query gives the candidates
+        best = None
+        for offset in range(max(len(tokens) - MAX_N, 0) + 1):
+            gram = " ".join(tokens[offset : offset + MAX_N])
+            postings = self._postings(kind, gram)
+            if best is None or len(postings) < len(best[1]):
+                best = (offset, postings)
+        offset, postings = best
+        out = []
+        for song, position in postings.tolist():
+            position -= offset
+            if len(tokens) <= MAX_N or (
+                position >= 0 and self._tokens(kind, song, position, len(tokens)) == tokens
+            ):
+                out.append((self.songs[song], self._bar(kind, song, position)))
+        return out
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Search chord progressions or melodic intervals in an index built by src.batch --index."
+    )
+    parser.add_argument("index", type=pathlib.Path, help="folder of the index")
+    parser.add_argument("kind", choices=KINDS)
+    parser.add_argument(
+        "tokens",
+        nargs="+",
+        help='tokens to look for, e.g. "G D Em C" for chords, "I V VIm IV" for degrees or "2 2 -4" for intervals',
+    )
+    args = parser.parse_args(argv)
+    if args.kind == "interval":
+        for token in args.tokens:
+            try:
+                int(token)
+            except ValueError:
+                parser.error(f"interval {token!r} is not a whole number of semitones")
+
+    index = SearchIndex.load(args.index)
+    results = index.query(args.kind, args.tokens)
+    for hooktheoryid, bar in results:
+        print(f"{hooktheoryid}\tbar {bar}")
+    print(f"{len(results)} occurrences in {len({r[0] for r in results})} songs.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Deterministic sharding of the dataset for conversion runs spread over several machines.
+Every machine loads the same dataset and keeps the ids that hash to its shard, so no coordinator is needed.
+Shards can also be balanced by the predicted cost of the entries, see src.costmodel.balanced_shards.
+Each shard writes its own manifest, which are merged and checked afterwards.
+"""
+import argparse
+import hashlib
+import json
+import pathlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.costmodel import balanced_shards
+
+MANIFEST_KEYS = ["converted", "skipped", "existing", "errors", "rejected"]
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """parse_shard.
+    Parse a shard specification like '2/8'
+
+    Args:
+        shard (str): shard specification i/N with 0 <= i < N
+
+    Returns:
+        Tuple[int, int]: (shard index, number of shards)
+    """
+    try:
+        index, num_shards = (int(x) for x in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard specification {shard}, expected i/N")
+    if not 0 <= index < num_shards:
+        raise ValueError(
+            f"Invalid shard specification {shard}, expected 0 <= i < N"
+        )
+    return index, num_shards
+
+
+def shard_of(hooktheoryid: str, num_shards: int) -> int:
+    """shard_of.
+    Stable shard assignment of an id, independent of the machine and of the Python hash seed
+
+    Args:
+        hooktheoryid (str): hooktheoryid
+        num_shards (int): number of shards
+
+    Returns:
+        int: shard index
+    """
+    digest = hashlib.md5(hooktheoryid.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def select_shard(
+    data: Dict[str, Dict],
+    shard: int,
+    num_shards: int,
+    costs: Optional[Dict[str, float]] = None,
+) -> Dict[str, Dict]:
+    """select_shard.
+    Keep the entries of a shard
+
+    Args:
+        data (Dict[str, Dict]): hooktheory dataset, mapping hooktheoryids to json entries
+        shard (int): shard index
+        num_shards (int): number of shards
+        costs (Optional[Dict[str, float]]): predicted cost of every entry to balance the shards, by hash if None
+
+    Returns:
+        Dict[str, Dict]: entries of the shard
+    """
+    if costs is not None:
+        assignment = balanced_shards(costs, num_shards)
+        return {k: v for k, v in data.items() if assignment[k] == shard}
+    return {k: v for k, v in data.items() if shard_of(k, num_shards) == shard}
+
+
+def manifest_name(shard: int, num_shards: int) -> str:
+    return f"manifest-{shard}-of-{num_shards}.json"
+
+
+def write_manifest(
+    manifest: Dict, outpath: pathlib.Path, shard: int = 0, num_shards: int = 1
+) -> pathlib.Path:
+    """write_manifest.
+    Write the manifest of a batch run next to its output files
+
+    Args:
+        manifest (Dict): manifest returned by src.batch.run_batch
+        outpath (pathlib.Path): output folder of the run
+        shard (int): shard index
+        num_shards (int): number of shards
+
+    Returns:
+        pathlib.Path: path of the written manifest
+    """
+    manifest = dict(manifest, shard=shard, num_shards=num_shards)
+    path = pathlib.Path(outpath) / manifest_name(shard, num_shards)
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    return path
+
+
+def _find_manifests(paths: Iterable[pathlib.Path]) -> List[pathlib.Path]:
+    out = []
+    for path in paths:
+        path = pathlib.Path(path)
+        if path.is_dir():
+            out += sorted(path.glob("manifest-*-of-*.json"))
+        else:
+            out.append(path)
+    return out
+
+
+def merge_manifests(
+    paths: Iterable[pathlib.Path], expected_ids: Optional[Iterable[str]] = None
+) -> Tuple[Dict, List[str]]:
+    """merge_manifests.
+    Combine shard manifests and check that every id was handled exactly once
+
+    Args:
+        paths (Iterable[pathlib.Path]): manifest files, or folders containing them
+        expected_ids (Optional[Iterable[str]]): ids of the full dataset, to detect ids that no shard handled
+
+    Returns:
+        Tuple[Dict, List[str]]: (merged manifest, list of problems found, empty if the run is complete)
+    """
+    manifests = []
+    for path in _find_manifests(paths):
+        with open(path, "r") as f:
+            manifests.append(json.load(f))
+    problems = []
+    if len(manifests) == 0:
+        return {}, ["No manifest found"]
+
+    num_shards = {m["num_shards"] for m in manifests}
+    if len(num_shards) > 1:
+        problems.append(f"Manifests come from different shardings {num_shards}")
+    num_shards = max(num_shards)
+    shards = [m["shard"] for m in manifests]
+    for shard in range(num_shards):
+        count = shards.count(shard)
+        if count == 0:
+            problems.append(f"Missing manifest for shard {shard}/{num_shards}")
+        elif count > 1:
+            problems.append(f"{count} manifests for shard {shard}/{num_shards}")
+
+    merged = {
+        "num_shards": num_shards,
+        "converted": [],
+        "skipped": [],
+        "existing": [],
+        "errors": {},
+        "rejected": {},
+    }
+    # balanced shards depend on the cost model, their assignment cannot be checked here
+    balanced = any(m.get("sharding") == "balanced" for m in manifests)
+    if balanced:
+        merged["sharding"] = "balanced"
+    if any("duplicates" in m for m in manifests):
+        merged["duplicates"] = {}
+        merged["near_duplicates"] = []
+    handled = {}
+    for m in manifests:
+        if "duplicates" in m:
+            merged["duplicates"].update(m["duplicates"])
+            merged["near_duplicates"] += m["near_duplicates"]
+        for key in MANIFEST_KEYS:
+            ids = m.get(key, [])
+            for i in ids:
+                handled.setdefault(i, []).append(m["shard"])
+            if isinstance(merged[key], dict):
+                merged[key].update(ids)
+            else:
+                merged[key] += ids
+    for i, handling_shards in handled.items():
+        if len(handling_shards) > 1:
+            problems.append(f"{i} was handled {len(handling_shards)} times")
+        elif not balanced and shard_of(i, num_shards) != handling_shards[0]:
+            problems.append(f"{i} was handled by the wrong shard")
+    if expected_ids is not None:
+        missing = set(expected_ids) - set(handled)
+        for i in sorted(missing):
+            problems.append(f"{i} was not handled by any shard")
+    return merged, problems
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Merge the manifests of a sharded conversion run."
+    )
+    parser.add_argument(
+        "manifests",
+        type=pathlib.Path,
+        nargs="+",
+        help="manifest files or folders containing them",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=pathlib.Path,
+        default=pathlib.Path("manifest.json"),
+        help="path of the merged manifest",
+    )
+    parser.add_argument(
+        "--dataset",
+        type=pathlib.Path,
+        default=None,
+        help="path to the Hooktheory.json file, to check that no id was forgotten",
+    )
+    args = parser.parse_args(argv)
+
+    expected_ids = None
+    if args.dataset is not None:
+        with open(args.dataset, "r") as f:
+            expected_ids = list(json.load(f))
+    merged, problems = merge_manifests(args.manifests, expected_ids)
+    with open(args.output, "w") as f:
+        json.dump(dict(merged, problems=problems), f, indent=1)
+    if merged:
+        print(
+            f"{len(merged['converted'])} converted, {len(merged['errors'])} errors, "
+            f"{len(merged['rejected'])} rejected, {len(merged['skipped'])} skipped, "
+            f"{len(merged['existing'])} already existing."
+        )
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
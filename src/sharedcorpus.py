@@ -0,0 +1,322 @@
+"""
+Corpus packed in shared memory for the worker processes of src.batch.
+The fields read by the converters (melody, harmony, keys, meters, beat alignment and the id, artist and
+song name) are stored in flat numpy arrays with one offset table per field. Workers attach to the arrays
+once and rebuild the json entry of a song from its index, so no entry is pickled for each task.
+"""
+import multiprocessing.util
+from multiprocessing import shared_memory
+from typing import Dict, Tuple
+
+import numpy as np
+
+from src.util import get_alignment
+
+# name of each array: (dtype, number of columns)
+LAYOUT = {
+    # onset, offset
+    "note_times": (np.float64, 2),
+    # pitch_class, octave
+    "note_pitches": (np.int64, 2),
+    # onset, offset
+    "chord_times": (np.float64, 2),
+    # root_pitch_class, inversion
+    "chord_roots": (np.int64, 2),
+    "chord_intervals": (np.int64, 1),
+    "key_beats": (np.float64, 1),
+    "key_tonics": (np.int64, 1),
+    "key_intervals": (np.int64, 1),
+    "meter_beats": (np.float64, 1),
+    # beats_per_bar, beat_unit
+    "meter_values": (np.int64, 2),
+    "alignment_beats": (np.float64, 1),
+    "alignment_times": (np.float64, 1),
+    "num_beats": (np.float64, 1),
+    # utf-8 encoded key in the dataset, id, artist and song name of each entry
+    "text": (np.uint8, 1),
+    # offsets in the arrays above, one row per entry or per chord and key for the intervals
+    "song_offsets": (np.int64, 7),
+    "chord_interval_offsets": (np.int64, 1),
+    "key_interval_offsets": (np.int64, 1),
+    "text_offsets": (np.int64, 1),
+}
+# columns of song_offsets
+NOTES, CHORDS, KEYS, METERS, ALIGNMENT, MELODY_FLAG, HARMONY_FLAG = range(7)
+
+# (name of the shared memory block, shape) of each array
+Spec = Dict[str, Tuple[str, Tuple[int, ...]]]
+
+
+def pack_corpus(data: Dict[str, Dict]) -> Dict[str, np.ndarray]:
+    """pack_corpus.
+    Pack the fields needed for the conversion of every entry in flat arrays
+
+    Args:
+        data (Dict[str, Dict]): hooktheory dataset, mapping hooktheoryids to json entries
+
+    Returns:
+        Dict[str, np.ndarray]: arrays named as in LAYOUT, entries are in the order of data
+    """
+    columns = {name: [] for name in LAYOUT}
+    counts = np.zeros(7, dtype=np.int64)
+    text_offset = 0
+    columns["text_offsets"].append(0)
+    columns["chord_interval_offsets"].append(0)
+    columns["key_interval_offsets"].append(0)
+    for k, v in data.items():
+        annotations = v["annotations"]
+        melody = annotations["melody"]
+        harmony = annotations["harmony"]
+        beat_map = get_alignment(v)
+        row = counts.copy()
+        row[MELODY_FLAG] = melody is not None
+        row[HARMONY_FLAG] = harmony is not None
+        columns["song_offsets"].append(row)
+        for note in melody or []:
+            columns["note_times"].append((note["onset"], note["offset"]))
+            columns["note_pitches"].append((note["pitch_class"], note["octave"]))
+        for chord in harmony or []:
+            columns["chord_times"].append((chord["onset"], chord["offset"]))
+            columns["chord_roots"].append((chord["root_pitch_class"], chord["inversion"]))
+            columns["chord_intervals"] += chord["root_position_intervals"]
+            columns["chord_interval_offsets"].append(len(columns["chord_intervals"]))
+        for key in annotations["keys"]:
+            columns["key_beats"].append(key["beat"])
+            columns["key_tonics"].append(key["tonic_pitch_class"])
+            columns["key_intervals"] += key["scale_degree_intervals"]
+            columns["key_interval_offsets"].append(len(columns["key_intervals"]))
+        for meter in annotations["meters"]:
+            columns["meter_beats"].append(meter["beat"])
+            columns["meter_values"].append((meter["beats_per_bar"], meter["beat_unit"]))
+        if beat_map is not None:
+            columns["alignment_beats"] += beat_map["beats"]
+            columns["alignment_times"] += beat_map["times"]
+        columns["num_beats"].append(annotations.get("num_beats", 0))
+        for field in [k, v["hooktheory"]["id"], v["hooktheory"]["artist"], v["hooktheory"]["song"]]:
+            encoded = field.encode("utf-8")
+            columns["text"].append(encoded)
+            text_offset += len(encoded)
+            columns["text_offsets"].append(text_offset)
+        counts += (
+            len(melody or []),
+            len(harmony or []),
+            len(annotations["keys"]),
+            len(annotations["meters"]),
+            0 if beat_map is None else len(beat_map["beats"]),
+            0,
+            0,
+        )
+    columns["song_offsets"].append(counts)
+    columns["text"] = [np.frombuffer(b"".join(columns["text"]), dtype=np.uint8)]
+
+    out = {}
+    for name, (dtype, width) in LAYOUT.items():
+        if name == "text":
+            array = columns["text"][0]
+        else:
+            array = np.array(columns[name], dtype=dtype)
+        out[name] = array.reshape(-1, width) if width > 1 else array.reshape(-1)
+    return out
+
+
+class SharedCorpus:
+    """SharedCorpus.
+    Packed corpus in shared memory blocks, created by the parent process and attached by the workers.
+    """
+
+    def __init__(
+        self,
+        blocks: Dict[str, shared_memory.SharedMemory],
+        arrays: Dict[str, np.ndarray],
+        owner: bool,
+    ):
+        self.blocks = blocks
+        self.arrays = arrays
+        self.owner = owner
+
+    @classmethod
+    def create(cls, data: Dict[str, Dict]) -> "SharedCorpus":
+        """create.
+        Pack a dataset and copy it to new shared memory blocks, unlink must be called once the workers are done,
+        which a with block does
+
+        Args:
+            data (Dict[str, Dict]): hooktheory dataset, mapping hooktheoryids to json entries
+
+        Returns:
+            SharedCorpus: corpus owning the blocks
+        """
+        blocks, arrays = {}, {}
+        for name, packed in pack_corpus(data).items():
+            # blocks cannot be empty
+            block = shared_memory.SharedMemory(create=True, size=max(packed.nbytes, 1))
+            array = np.ndarray(packed.shape, dtype=packed.dtype, buffer=block.buf)
+            array[...] = packed
+            blocks[name] = block
+            arrays[name] = array
+        return cls(blocks, arrays, owner=True)
+
+    @classmethod
+    def attach(cls, spec: Spec) -> "SharedCorpus":
+        """attach.
+        Map the blocks of a corpus created by another process
+
+        Args:
+            spec (Spec): spec of the created corpus
+
+        Returns:
+            SharedCorpus: read-only view of the corpus
+        """
+        blocks, arrays = {}, {}
+        for name, (block_name, shape) in spec.items():
+            # pool workers share the resource tracker of the creating process, which unlinks the block
+            block = shared_memory.SharedMemory(name=block_name)
+            array = np.ndarray(shape, dtype=LAYOUT[name][0], buffer=block.buf)
+            array.flags.writeable = False
+            blocks[name] = block
+            arrays[name] = array
+        return cls(blocks, arrays, owner=False)
+
+    @classmethod
+    def attach_worker(cls, spec: Spec) -> "SharedCorpus":
+        """attach_worker.
+        Attach the corpus in a pool worker, the blocks are closed when the worker exits after the pool is closed
+
+        Args:
+            spec (Spec): spec of the created corpus
+
+        Returns:
+            SharedCorpus: read-only view of the corpus
+        """
+        corpus = cls.attach(spec)
+        multiprocessing.util.Finalize(None, corpus.__exit__, args=(None, None, None), exitpriority=0)
+        return corpus
+
+    @property
+    def spec(self) -> Spec:
+        """Names and shapes of the blocks, the only thing sent to the workers"""
+        return {
+            name: (self.blocks[name].name, array.shape)
+            for name, array in self.arrays.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.arrays["song_offsets"]) - 1
+
+    def _text(self, i: int) -> str:
+        start, end = self.arrays["text_offsets"][i : i + 2]
+        return self.arrays["text"][start:end].tobytes().decode("utf-8")
+
+    def hooktheoryid(self, i: int) -> str:
+        """Key of the entry in the packed dataset, which may differ from its hooktheory id field"""
+        return self._text(4 * i)
+
+    def entry(self, i: int) -> Dict:
+        """entry.
+        Rebuild the json entry of a song from the shared arrays
+
+        Args:
+            i (int): index of the entry, in the order of the packed dataset
+
+        Returns:
+            Dict: json_data with the fields used by the converters
+        """
+        a = self.arrays
+        start, end = a["song_offsets"][i], a["song_offsets"][i + 1]
+
+        melody = None
+        if start[MELODY_FLAG]:
+            times = a["note_times"][start[NOTES] : end[NOTES]].tolist()
+            pitches = a["note_pitches"][start[NOTES] : end[NOTES]].tolist()
+            melody = [
+                {"onset": on, "offset": off, "octave": octave, "pitch_class": pc}
+                for (on, off), (pc, octave) in zip(times, pitches)
+            ]
+        harmony = None
+        if start[HARMONY_FLAG]:
+            times = a["chord_times"][start[CHORDS] : end[CHORDS]].tolist()
+            roots = a["chord_roots"][start[CHORDS] : end[CHORDS]].tolist()
+            offsets = a["chord_interval_offsets"][start[CHORDS] : end[CHORDS] + 1].tolist()
+            intervals = a["chord_intervals"][offsets[0] : offsets[-1]].tolist()
+            base = offsets[0]
+            harmony = [
+                {
+                    "onset": on,
+                    "offset": off,
+                    "root_pitch_class": root,
+                    "root_position_intervals": intervals[s - base : e - base],
+                    "inversion": inversion,
+                }
+                for (on, off), (root, inversion), s, e in zip(
+                    times, roots, offsets[:-1], offsets[1:]
+                )
+            ]
+        offsets = a["key_interval_offsets"][start[KEYS] : end[KEYS] + 1].tolist()
+        intervals = a["key_intervals"][offsets[0] : offsets[-1]].tolist()
+        base = offsets[0]
+        keys = [
+            {
+                "beat": beat,
+                "tonic_pitch_class": tonic,
+                "scale_degree_intervals": intervals[s - base : e - base],
+            }
+            for beat, tonic, s, e in zip(
+                a["key_beats"][start[KEYS] : end[KEYS]].tolist(),
+                a["key_tonics"][start[KEYS] : end[KEYS]].tolist(),
+                offsets[:-1],
+                offsets[1:],
+            )
+        ]
+        meters = [
+            {"beat": beat, "beats_per_bar": num_beats, "beat_unit": unit}
+            for beat, (num_beats, unit) in zip(
+                a["meter_beats"][start[METERS] : end[METERS]].tolist(),
+                a["meter_values"][start[METERS] : end[METERS]].tolist(),
+            )
+        ]
+        alignment = None
+        if end[ALIGNMENT] > start[ALIGNMENT]:
+            alignment = {
+                "refined": {
+                    "beats": a["alignment_beats"][start[ALIGNMENT] : end[ALIGNMENT]].tolist(),
+                    "times": a["alignment_times"][start[ALIGNMENT] : end[ALIGNMENT]].tolist(),
+                }
+            }
+        return {
+            "hooktheory": {
+                "id": self._text(4 * i + 1),
+                "artist": self._text(4 * i + 2),
+                "song": self._text(4 * i + 3),
+            },
+            "alignment": alignment,
+            "annotations": {
+                "num_beats": float(a["num_beats"][i]),
+                "meters": meters,
+                "keys": keys,
+                "melody": melody,
+                "harmony": harmony,
+            },
+        }
+
+    def __enter__(self) -> "SharedCorpus":
+        return self
+
+    def __exit__(self, *exc):
+        # the creating process frees the blocks, the others only unmap them
+        if self.owner:
+            self.unlink()
+        else:
+            self.close()
+
+    def close(self):
+        # views on the buffers must be released before closing them
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+
+    def unlink(self):
+        """Close and free the blocks, only for the creating process"""
+        assert self.owner
+        self.close()
+        for block in self.blocks.values():
+            block.unlink()
@@ -0,0 +1,213 @@
+"""
+Tempo and timing information derived from the beat alignment of the songs with their audio.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.kernfilebuilder import _get_duration_pitch_from_kern_note
+from src.util import KERN_TO_DURATION, get_alignment
+
+# Minimum tempo variation (in bpm) before a new tempo record is written
+TEMPO_TOLERANCE = 2.0
+
+
+def get_beat_map(json_data: Dict) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """get_beat_map.
+    Get the beat to time mapping of a song, the refined alignment is preferred when available, see get_alignment
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+
+    Returns:
+        Optional[Tuple[np.ndarray, np.ndarray]]: (beats, times in seconds), None if the song has no usable alignment
+    """
+    beat_map = get_alignment(json_data)
+    if beat_map is None:
+        return None
+    beats = np.asarray(beat_map["beats"], dtype=np.float64)
+    times = np.asarray(beat_map["times"], dtype=np.float64)
+    return beats, times
+
+
+def beats_to_seconds(
+    beats: np.ndarray, beat_map: Tuple[np.ndarray, np.ndarray]
+) -> np.ndarray:
+    """beats_to_seconds.
+    Linear interpolation of the beat map, extrapolated with the first and last tempos outside of it
+
+    Args:
+        beats (np.ndarray): positions in beats
+        beat_map (Tuple[np.ndarray, np.ndarray]): (beats, times) as returned by get_beat_map
+
+    Returns:
+        np.ndarray: positions in seconds
+    """
+    map_beats, map_times = beat_map
+    beats = np.asarray(beats, dtype=np.float64)
+    out = np.interp(beats, map_beats, map_times)
+    first_slope = (map_times[1] - map_times[0]) / (map_beats[1] - map_beats[0])
+    last_slope = (map_times[-1] - map_times[-2]) / (map_beats[-1] - map_beats[-2])
+    before = beats < map_beats[0]
+    after = beats > map_beats[-1]
+    out[before] = map_times[0] + (beats[before] - map_beats[0]) * first_slope
+    out[after] = map_times[-1] + (beats[after] - map_beats[-1]) * last_slope
+    return out
+
+
+def get_segment_tempi(
+    beat_map: Tuple[np.ndarray, np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """get_segment_tempi.
+    Tempo between each pair of consecutive points of the beat map, degenerate segments are dropped
+
+    Args:
+        beat_map (Tuple[np.ndarray, np.ndarray]): (beats, times) as returned by get_beat_map
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (start beat of each segment, seconds per beat in the segment)
+    """
+    map_beats, map_times = beat_map
+    delta_beats = np.diff(map_beats)
+    delta_times = np.diff(map_times)
+    valid = (delta_beats > 0) & (delta_times > 0)
+    return map_beats[:-1][valid], delta_times[valid] / delta_beats[valid]
+
+
+def get_tempo_change_segments(
+    seconds_per_beat: np.ndarray, tolerance: float = TEMPO_TOLERANCE
+) -> List[int]:
+    """get_tempo_change_segments.
+    Segments where a new tempo is written, when the tempo drifts by more than the tolerance from the
+    last written one. Each change is found with a vectorized search over the remaining segments.
+
+    Args:
+        seconds_per_beat (np.ndarray): tempo of each segment, as returned by get_segment_tempi
+        tolerance (float): minimum tempo variation in bpm
+
+    Returns:
+        List[int]: indices of the segments, starting with the first one
+    """
+    if len(seconds_per_beat) == 0:
+        return []
+    bpms = 60 / seconds_per_beat
+    out = [0]
+    i = 0
+    while True:
+        # first segment drifting away from the tempo of the last change
+        drift = np.flatnonzero(np.abs(bpms[i + 1 :] - bpms[i]) >= tolerance)
+        if len(drift) == 0:
+            return out
+        i += 1 + int(drift[0])
+        out.append(i)
+
+
+def get_tempo_records(
+    json_data: Dict, tolerance: float = TEMPO_TOLERANCE
+) -> List[Tuple[float, str]]:
+    """get_tempo_records.
+    Prepare the kern tempo records of a song. A new record is only written when the
+    tempo drifts by more than the tolerance from the last record, to avoid one record per beat.
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+        tolerance (float): minimum tempo variation in bpm
+
+    Returns:
+        List[Tuple[float, str]]: list of (beat, tempo_token), the first one always applies from the start of the song
+    """
+    beat_map = get_beat_map(json_data)
+    if beat_map is None:
+        return []
+    starts, seconds_per_beat = get_segment_tempi(beat_map)
+    bpms = 60 / seconds_per_beat
+    out = [
+        (float(starts[i]), f"*MM{round(bpms[i])}")
+        for i in get_tempo_change_segments(seconds_per_beat, tolerance)
+    ]
+    if len(out) > 0:
+        out[0] = (0, out[0][1])
+    return out
+
+
+def get_token_onsets(tokens: List[str]) -> np.ndarray:
+    """get_token_onsets.
+    Onset in beats of each line of a kern spine, lines that are not notes or rests take the onset of the next note
+
+    Args:
+        tokens (List[str]): kern tokens of the melody spine
+
+    Returns:
+        np.ndarray: onset of each token
+    """
+    durations = np.zeros(len(tokens), dtype=np.float64)
+    for i, token in enumerate(tokens):
+        if token[0] not in ["*", "!", "="]:
+            duration, _ = _get_duration_pitch_from_kern_note(token)
+            durations[i] = KERN_TO_DURATION[duration]
+    return np.cumsum(durations) - durations
+
+
+def add_tempo_records(
+    melody: List[str], harmony: List[str], tempo_records: List[Tuple[float, str]]
+):
+    """add_tempo_records.
+    Insert tempo records in the melody spine, with null interpretations in the harmony spine.
+    The first record goes in the header, the next ones before the first event at or after their beat.
+
+    Args:
+        melody (List[str]): tokens of the melody spine, modified in place
+        harmony (List[str]): tokens of the harmony spine, modified in place
+        tempo_records (List[Tuple[float, str]]): list of (beat, tempo_token) as returned by get_tempo_records
+    """
+    if len(tempo_records) == 0:
+        return
+    onsets = get_token_onsets(melody)
+    events = np.flatnonzero(
+        [token[0] not in ["*", "!", "="] for token in melody]
+    )
+    beats = np.array([beat for beat, _ in tempo_records[1:]], dtype=np.float64)
+    positions = np.searchsorted(onsets[events], beats, side="left")
+    insertions = []
+    for position, (_, token) in zip(positions.tolist(), tempo_records[1:]):
+        if position < len(events):
+            insertions.append((int(events[position]), token))
+    # The header is made of the exclusive interpretations, clef, key and meter
+    insertions.append((4, tempo_records[0][1]))
+    # insert from the end so that earlier indices stay valid
+    for index, token in sorted(insertions, key=lambda x: x[0], reverse=True):
+        melody.insert(index, token)
+        harmony.insert(index, "*")
+
+
+def make_timing_spine(
+    melody: List[str], beat_map: Optional[Tuple[np.ndarray, np.ndarray]]
+) -> List[str]:
+    """make_timing_spine.
+    Create a spine giving the time in seconds of each event of the melody in the aligned audio
+
+    Args:
+        melody (List[str]): tokens of the melody spine
+        beat_map (Optional[Tuple[np.ndarray, np.ndarray]]): (beats, times) as returned by get_beat_map
+
+    Returns:
+        List[str]: tokens of the **time spine, null tokens if the song has no alignment
+    """
+    if beat_map is not None:
+        seconds = beats_to_seconds(get_token_onsets(melody), beat_map).tolist()
+    out = []
+    for i, token in enumerate(melody):
+        if token[0] == "=":
+            out.append(token)
+        elif token[0] == "*":
+            if token == "*-":
+                out.append(token)
+            elif token.startswith("**"):
+                out.append("**time")
+            else:
+                out.append("*")
+        elif beat_map is None:
+            out.append(".")
+        else:
+            out.append(f"{seconds[i]:.3f}")
+    return out
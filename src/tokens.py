@@ -0,0 +1,227 @@
+"""
+Export of the converted dataset as integer token sequences for model training.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import pathlib
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from src.batch import SKIP
+from src.converter import convert
+from src.sharedcorpus import SharedCorpus, Spec
+from src.util import get_artist, get_title
+
+TOKENS_FILE = "tokens.npy"
+OFFSETS_FILE = "offsets.npy"
+VOCAB_FILE = "vocab.json"
+METADATA_FILE = "metadata.json"
+
+# shared corpus of a worker process, set once by _init_worker
+_worker = {}
+
+# [tie open] duration pitch-or-rest [tie close] [beams]
+NOTE_PATTERN = re.compile(r"^(\[?)(\d+\.*)([a-gA-G]+[#-]*|r)(\]?)([LJ]*)$")
+
+
+def tokenize_note(note: str) -> List[str]:
+    """tokenize_note.
+    Split a kern note token into its tie, duration, pitch and beam components
+
+    Args:
+        note (str): krn token representing a note or a rest
+
+    Returns:
+        List[str]: vocabulary entries of the note
+    """
+    match = NOTE_PATTERN.match(note)
+    if match is None:
+        # keep unexpected tokens whole rather than losing them
+        return [f"kern:{note}"]
+    tie_open, duration, pitch, tie_close, beams = match.groups()
+    out = []
+    if tie_open:
+        out.append("tie:[")
+    out.append(f"dur:{duration}")
+    out.append(f"pitch:{pitch}")
+    if tie_close:
+        out.append("tie:]")
+    for beam in beams:
+        out.append(f"beam:{beam}")
+    return out
+
+
+def tokenize_kern(kern: str) -> List[str]:
+    """tokenize_kern.
+    Turn the output of `convert` into a list of vocabulary entries.
+    Reference records and spine headers are dropped, bar numbers are discarded
+    and each data line gives the melody tokens followed by the chord token.
+
+    Args:
+        kern (str): content of a .krn file as produced by `convert`
+
+    Returns:
+        List[str]: vocabulary entries of the song
+    """
+    out = []
+    for line in kern.split("\n"):
+        if line.startswith("!") or line.startswith("**"):
+            continue
+        melody, harmony = line.split("\t")
+        if melody[0] == "=":
+            out.append("=")
+        elif melody[0] == "*":
+            # the **text spine only holds null interpretations
+            out.append(melody)
+        else:
+            out += tokenize_note(melody)
+            out.append(f"chord:{harmony}")
+    return out
+
+
+class TokenizedCorpus:
+    """TokenizedCorpus.
+    Read-only access to an exported corpus, songs are returned as slices of the memory-mapped token array.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        path = pathlib.Path(path)
+        self.tokens = np.load(path / TOKENS_FILE, mmap_mode="r")
+        self.offsets = np.load(path / OFFSETS_FILE)
+        with open(path / VOCAB_FILE, "r") as f:
+            self.vocab = json.load(f)
+        with open(path / METADATA_FILE, "r") as f:
+            self.metadata = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self.metadata)
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        return self.tokens[self.offsets[idx] : self.offsets[idx + 1]]
+
+    def decode(self, ids: Iterable[int]) -> List[str]:
+        return [self.vocab[i] for i in ids]
+
+
+def _convert_item(item: Tuple[str, Dict]) -> Tuple[str, Optional[str], Optional[str]]:
+    """Convert one entry, the error is returned to be reported by the parent process"""
+    key, json_data = item
+    try:
+        return key, convert(json_data), None
+    except Exception as e:
+        return key, None, f"{type(e).__name__}: {e}"
+
+
+def _init_worker(spec: Spec):
+    _worker["corpus"] = SharedCorpus.attach_worker(spec)
+
+
+def _convert_shared(i: int) -> Tuple[str, Optional[str], Optional[str]]:
+    corpus = _worker["corpus"]
+    return _convert_item((corpus.hooktheoryid(i), corpus.entry(i)))
+
+
+def export_tokens(
+    data: Dict[str, Dict],
+    outpath: pathlib.Path,
+    num_workers: int = 1,
+    skip: Iterable[str] = SKIP,
+) -> TokenizedCorpus:
+    """export_tokens.
+    Convert the dataset and write it as one flat int32 token array with song offsets,
+    a vocabulary file and per-song metadata. Songs that fail or are empty are left out, the errors are printed.
+
+    Args:
+        data (Dict[str, Dict]): hooktheory dataset, mapping hooktheoryids to json entries
+        outpath (pathlib.Path): output folder
+        num_workers (int): number of processes to use for the conversion
+        skip (Iterable[str]): hooktheoryids to ignore
+
+    Returns:
+        TokenizedCorpus: the exported corpus
+    """
+    outpath = pathlib.Path(outpath)
+    outpath.mkdir(parents=True, exist_ok=True)
+    skip = set(skip)
+    items = [(k, v) for k, v in data.items() if k not in skip]
+    vocab = {}
+    sequences = []
+    metadata = []
+    with contextlib.ExitStack() as stack:
+        if num_workers > 1:
+            # workers only receive the index of the entries
+            corpus = stack.enter_context(SharedCorpus.create(dict(items)))
+            pool = stack.enter_context(
+                multiprocessing.Pool(
+                    num_workers, initializer=_init_worker, initargs=(corpus.spec,)
+                )
+            )
+            results = pool.imap(_convert_shared, range(len(items)), chunksize=16)
+        else:
+            pool = None
+            results = map(_convert_item, items)
+        for key, kern, error in tqdm(results, total=len(items)):
+            if error is not None:
+                # written above the progress bar
+                tqdm.write(f"{key}: {error}")
+            if not kern:
+                continue
+            ids = [vocab.setdefault(t, len(vocab)) for t in tokenize_kern(kern)]
+            sequences.append(np.array(ids, dtype=np.int32))
+            metadata.append(
+                {
+                    "id": key,
+                    "split": data[key].get("split"),
+                    "artist": get_artist(data[key]),
+                    "title": get_title(data[key]),
+                }
+            )
+        if pool is not None:
+            # let the workers exit and close their view of the corpus before it is unlinked
+            pool.close()
+            pool.join()
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(s) for s in sequences])
+    tokens = (
+        np.concatenate(sequences) if sequences else np.zeros(0, dtype=np.int32)
+    )
+    np.save(outpath / TOKENS_FILE, tokens)
+    np.save(outpath / OFFSETS_FILE, offsets)
+    with open(outpath / VOCAB_FILE, "w") as f:
+        json.dump(list(vocab), f)
+    with open(outpath / METADATA_FILE, "w") as f:
+        json.dump(metadata, f)
+    return TokenizedCorpus(outpath)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Export the hooktheory dataset as integer token sequences."
+    )
+    parser.add_argument(
+        "input", type=pathlib.Path, help="path to the Hooktheory.json file"
+    )
+    parser.add_argument("output", type=pathlib.Path, help="output folder")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes used for the conversion",
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.input, "r") as f:
+        data = json.load(f)
+    corpus = export_tokens(data, args.output, args.workers)
+    print(
+        f"{len(corpus)} songs, {len(corpus.tokens)} tokens, vocabulary of {len(corpus.vocab)} entries."
+    )
+
+
+if __name__ == "__main__":
+    main()
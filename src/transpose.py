@@ -0,0 +1,227 @@
+"""
+Transposition of a song to several keys while converting its rhythm only once.
+"""
+import bisect
+import copy
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import src.chords as C
+import src.kernfilebuilder as K
+import src.util as U
+from src.converter import has_annotations, make_spines
+from src.measurecache import _change_triggers
+from src.mode_formulas import PC_TO_NAMES
+
+# (tie open and duration) pitch (tie close and beams)
+NOTE_PATTERN = re.compile(r"^(\[?\d+\.*)([a-gA-G]+)([#-]?)(.*)$")
+
+NATURAL_PITCH_CLASSES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+
+
+class Skeleton(NamedTuple):
+    """Skeleton.
+    Pitch-independent result of a conversion: the token lists with the positions of
+    every element whose spelling depends on the key.
+    """
+
+    metadata: str
+    melody: List[str]
+    harmony: List[str]
+    keys: List[Dict]
+    chords: List[Dict]
+    # (token index, duration prefix, pitch number, suffix, key index)
+    notes: List[Tuple[int, str, int, str, int]]
+    # (token index, key index)
+    key_tokens: List[Tuple[int, int]]
+    # (token index, chord index, key index)
+    chord_tokens: List[Tuple[int, int, int]]
+
+
+def _kern_pitch_number(pitch: str, accidental: str) -> int:
+    """_kern_pitch_number.
+    Inverse of _note_char_from_octave, 0 is C4 and each unit is a semitone
+
+    Args:
+        pitch (str): repeated pitch letter, lowercase from C4 upwards and uppercase below
+        accidental (str): kern accidental char (- or #)
+
+    Returns:
+        int: pitch number
+    """
+    if pitch[0].islower():
+        octave = len(pitch) - 1
+    else:
+        octave = -len(pitch)
+    pitch_class = NATURAL_PITCH_CLASSES[pitch[0].upper()]
+    pitch_class += {"#": 1, "-": -1, "": 0}[accidental]
+    return 12 * octave + pitch_class
+
+
+def _note_keys(melody: List[Dict], keys: List[Dict]) -> Tuple[List[float], List[int]]:
+    """_note_keys.
+    Key in which make_notes_from_melody spells each note. A key change is written when the note that triggers
+    it is read, possibly before the last token of the previous note which keeps the spelling of the previous key.
+
+    Args:
+        melody (List[Dict]): melody annotations from hooktheory's json
+        keys (List[Dict]): key annotations from hooktheory's json
+
+    Returns:
+        Tuple[List[float], List[int]]: written start of each note and index of its key
+    """
+    triggers = _change_triggers(melody, [(key["beat"], None) for key in keys])
+    starts, note_keys = [], []
+    position, previous_offset, key_idx = 0.0, 0, 0
+    for j, note in enumerate(melody):
+        key_idx = triggers.get(j, key_idx)
+        # a note overlapping the previous one is written after it
+        position += max(note["onset"] - previous_offset, 0)
+        starts.append(position)
+        note_keys.append(key_idx)
+        position += note["offset"] - note["onset"]
+        previous_offset = note["offset"]
+    return starts, note_keys
+
+
+def make_skeleton(json_data: Dict) -> Optional[Skeleton]:
+    """make_skeleton.
+    Run the conversion once and record where pitches, key signatures and chord names appear
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+
+    Returns:
+        Optional[Skeleton]: skeleton of the song, None if the song has no melody or harmony
+    """
+    if not has_annotations(json_data):
+        return None
+    title = U.get_title(json_data)
+    artist = U.get_artist(json_data)
+    id = U.get_hooktheoryid(json_data)
+    metadata = K.make_reference_records(artist, title, id)
+    melody, harmony = make_spines(json_data)
+
+    # notes take their key from the annotations, chords and key signatures from the key tokens they follow
+    starts, note_keys = _note_keys(
+        json_data["annotations"]["melody"], json_data["annotations"]["keys"]
+    )
+    notes, key_tokens, chord_tokens = [], [], []
+    key_idx = -1
+    chord_idx = 0
+    position = 0.0
+    for i, (note_token, chord_token) in enumerate(zip(melody, harmony)):
+        if note_token.startswith("*k["):
+            key_idx += 1
+            key_tokens.append((i, key_idx))
+            continue
+        if note_token[0] in ["*", "!", "="]:
+            continue
+        match = NOTE_PATTERN.match(note_token)
+        if match is not None:
+            prefix, pitch, accidental, suffix = match.groups()
+            number = _kern_pitch_number(pitch, accidental)
+            # tolerance for the durations that are not exact binary fractions
+            note_idx = bisect.bisect_right(starts, position + 1e-9) - 1
+            notes.append((i, prefix, number, suffix, note_keys[note_idx]))
+        duration, _ = K._get_duration_pitch_from_kern_note(note_token)
+        position += U.KERN_TO_DURATION[duration]
+        if chord_token != ".":
+            chord_tokens.append((i, chord_idx, key_idx))
+            chord_idx += 1
+    return Skeleton(
+        metadata,
+        melody,
+        harmony,
+        json_data["annotations"]["keys"],
+        json_data["annotations"]["harmony"],
+        notes,
+        key_tokens,
+        chord_tokens,
+    )
+
+
+def render_transposition(skeleton: Skeleton, semitones: int) -> str:
+    """render_transposition.
+    Spell the skeleton of a song in a transposed key.
+    Notes are spelled in the key that was in effect when they were converted, chords according to the key
+    signature written before them.
+
+    Args:
+        skeleton (Skeleton): skeleton of the song
+        semitones (int): transposition interval, positive to transpose up
+
+    Returns:
+        str: output string of the correctly formatted .krn notation
+    """
+    # Key signatures and spelling flags in the new key
+    key_tokens = []
+    melody_sharps = []
+    harmony_sharps = []
+    for key in skeleton.keys:
+        tonic = (key["tonic_pitch_class"] + semitones) % 12
+        key_token = U._make_kern_key(tonic, key["scale_degree_intervals"])
+        sharps, flats = U._count_accidentals(key_token)
+        key_tokens.append(key_token)
+        # melody and harmony break ties between sharps and flats differently
+        melody_sharps.append(sharps > flats)
+        harmony_sharps.append(sharps >= flats)
+
+    melody = list(skeleton.melody)
+    for i, key_idx in skeleton.key_tokens:
+        melody[i] = key_tokens[key_idx]
+    # songs reuse few distinct pitches and chords, spell each of them once
+    note_chars = {}
+    for i, prefix, number, suffix, key_idx in skeleton.notes:
+        use_sharps = melody_sharps[key_idx]
+        note_char = note_chars.get((number, use_sharps))
+        if note_char is None:
+            octave, pitch_class = divmod(number + semitones, 12)
+            pcsharp, pcflat = PC_TO_NAMES[pitch_class]
+            pc_char = pcsharp if use_sharps else pcflat
+            accidental = pc_char[1] if len(pc_char) > 1 else ""
+            note_char = K._note_char_from_octave(pc_char[0], accidental, octave)
+            note_chars[(number, use_sharps)] = note_char
+        melody[i] = prefix + note_char + suffix
+
+    harmony = list(skeleton.harmony)
+    chord_names = {}
+    for i, chord_idx, key_idx in skeleton.chord_tokens:
+        chord = skeleton.chords[chord_idx]
+        use_sharps = harmony_sharps[key_idx]
+        signature = (
+            chord["root_pitch_class"],
+            tuple(chord["root_position_intervals"]),
+            chord["inversion"],
+            use_sharps,
+        )
+        name = chord_names.get(signature)
+        if name is None:
+            chord = copy.copy(chord)
+            chord["root_pitch_class"] = (chord["root_pitch_class"] + semitones) % 12
+            name = C.make_chord_kern(chord, use_sharps)
+            chord_names[signature] = name
+        harmony[i] = name
+
+    out_list = [melody[i] + "\t" + harmony[i] for i in range(len(melody))]
+    return skeleton.metadata + "\n".join(out_list)
+
+
+def convert_transpositions(
+    json_data: Dict, semitones: Iterable[int] = range(-5, 7)
+) -> Dict[int, str]:
+    """convert_transpositions.
+    Convert a song in several keys, the rhythm, bars and chord positions are only computed once.
+    The default covers the 12 keys while staying within a tritone of the original register.
+
+    Args:
+        json_data (Dict): json_data representing a song in the hooktheory dataset
+        semitones (Iterable[int]): transposition intervals to render
+
+    Returns:
+        Dict[int, str]: .krn notation for each transposition interval, empty strings if the song has no melody or harmony
+    """
+    skeleton = make_skeleton(json_data)
+    if skeleton is None:
+        return {t: "" for t in semitones}
+    return {t: render_transposition(skeleton, t) for t in semitones}
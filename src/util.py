@@ -1,6 +1,6 @@
 import copy
 from itertools import product
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from src.mode_formulas import get_accidentals_names, get_num_accidentals
 
@@ -105,6 +105,25 @@ def get_hooktheoryid(json_dict: Dict) -> str:
     return json_dict["hooktheory"]["id"]
 
 
+def get_alignment(json_dict: Dict) -> Optional[Dict]:
+    """get_alignment.
+    Beat map of the song, the refined alignment is preferred when it has at least two beats,
+    the user alignment is used otherwise
+
+    Args:
+        json_dict (Dict): json_data representing a song in the hooktheory dataset
+
+    Returns:
+        Optional[Dict]: {"beats": [...], "times": [...]}, None if no alignment has two beats
+    """
+    alignment = json_dict.get("alignment") or {}
+    for name in ["refined", "user"]:
+        beat_map = alignment.get(name)
+        if beat_map is not None and len(beat_map["beats"]) >= 2:
+            return beat_map
+    return None
+
+
 def get_key_signatures(json_dict: Dict) -> List:
     out = []
     keys = json_dict["annotations"]["keys"]
@@ -0,0 +1,86 @@
+"""
+Structural checks of .krn files written by src.converter.convert: spines, bar durations, ties and beams.
+"""
+from typing import List
+
+from src.kernfilebuilder import _get_bar_duration, _get_duration_pitch_from_kern_note
+from src.util import KERN_TO_DURATION
+
+
+def validate_kern(kern: str) -> List[str]:
+    """validate_kern.
+    Find the structural problems of a .krn file
+
+    Args:
+        kern (str): .krn notation
+
+    Returns:
+        List[str]: description of each problem with its line number, empty if the file is valid
+    """
+    problems = []
+    lines = kern.split("\n")
+    # a file written by a text tool, or by the convert command on the standard output, ends with a newline
+    if len(lines) > 1 and lines[-1] == "":
+        lines.pop()
+    # skip the reference records
+    first = next((i for i, line in enumerate(lines) if not line.startswith("!!!")), len(lines))
+    if first == len(lines) or not lines[first].startswith("**kern\t**text"):
+        return [f"line {first + 1}: expected **kern and **text spines"]
+    num_spines = len(lines[first].split("\t"))
+    if lines[-1].split("\t") != ["*-"] * num_spines:
+        problems.append(f"line {len(lines)}: spines are not terminated")
+
+    bar_duration = None
+    bar = None
+    # the meter of a bar is the one in effect at its first event, a meter change can be written
+    # before the last tied note of the previous bar
+    expected = None
+    position = 0
+    tie_open = False
+    beam_open = False
+    for number, line in enumerate(lines[first + 1 :], start=first + 2):
+        fields = line.split("\t")
+        if len(fields) != num_spines:
+            problems.append(f"line {number}: {len(fields)} fields instead of {num_spines}")
+            continue
+        token = fields[0]
+        if token.startswith("*M") and not token.startswith("*MM"):
+            bar_duration = _get_bar_duration(token)
+        elif token[0] == "=" or token == "*-":
+            if expected is not None and position != expected:
+                problems.append(
+                    f"line {number}: bar {bar} lasts {position:g} beats instead of {expected:g}"
+                )
+            if beam_open:
+                problems.append(f"line {number}: beam crosses the bar line")
+                beam_open = False
+            bar = token[1:]
+            expected = None
+            position = 0
+        elif token[0] not in ["*", "!"]:
+            if expected is None:
+                expected = bar_duration
+            duration, _ = _get_duration_pitch_from_kern_note(token)
+            if duration not in KERN_TO_DURATION:
+                problems.append(f"line {number}: unknown duration in {token}")
+            else:
+                position += KERN_TO_DURATION[duration]
+            if "[" in token:
+                if tie_open:
+                    problems.append(f"line {number}: tie opened twice")
+                tie_open = True
+            if "]" in token:
+                if not tie_open:
+                    problems.append(f"line {number}: tie closed without being opened")
+                tie_open = False
+            if "L" in token:
+                if beam_open:
+                    problems.append(f"line {number}: beam opened twice")
+                beam_open = True
+            if "J" in token:
+                if not beam_open:
+                    problems.append(f"line {number}: beam closed without being opened")
+                beam_open = False
+    if tie_open:
+        problems.append("tie left open at the end of the file")
+    return problems
@@ -0,0 +1,104 @@
+import pytest
+
+from src.chords import (
+    _beam_split,
+    _make_tied_notes,
+    chord_bass,
+    chord_token,
+    get_chord_quality,
+    make_chord_kern,
+    make_harmony_list,
+)
+
+
+def _chord(root, intervals, inversion=0):
+    return {
+        "root_pitch_class": root,
+        "root_position_intervals": intervals,
+        "inversion": inversion,
+    }
+
+
+def test_get_chord_quality():
+    assert get_chord_quality([4, 3]) == "major"
+    assert get_chord_quality([3, 3, 4]) == "halfdiminished"
+    with pytest.raises(ValueError):
+        get_chord_quality([1, 1])
+
+
+def test_chord_bass():
+    # G7 in 3rd inversion has F in the bass
+    assert chord_bass(7, [4, 3, 3], 3) == 5
+    # Dm9 in 4th inversion has E in the bass
+    assert chord_bass(2, [3, 4, 3, 4], 4) == 4
+    with pytest.raises(ValueError):
+        chord_bass(0, [4, 3], 3)
+
+
+def test_make_chord_kern():
+    assert make_chord_kern(_chord(11, [3, 4])) == "Bm"
+    assert make_chord_kern(_chord(10, [4, 3]), use_sharps=False) == "Bb"
+    assert make_chord_kern(_chord(10, [4, 3]), use_sharps=True) == "A#"
+    assert make_chord_kern(_chord(7, [4, 3], 1)) == "G/B"
+    assert make_chord_kern(_chord(3, [4, 3, 3], 3), use_sharps=False) == "Eb7/Db"
+    assert make_chord_kern(_chord(11, [3, 3, 4])) == "Bmin7b5"
+    assert make_chord_kern(_chord(2, [3, 4, 3, 4], 4)) == "Dmin9/E"
+    assert make_chord_kern(_chord(0, [4, 4])) == "Caug"
+
+
+def test_chord_token_cache():
+    chord_token.cache_clear()
+    for _ in range(3):
+        make_chord_kern(_chord(7, [4, 3]))
+    info = chord_token.cache_info()
+    assert info.misses == 1
+    assert info.hits == 2
+
+
+def test_make_tied_notes_beams():
+    # a note outside of a beam group is split in a new group if the tied notes can be beamed
+    assert _make_tied_notes("4c", 0.5, beam=True) == ["[8cL", "8c]J"]
+    assert _make_tied_notes("4c", 0.5) == ["[8c", "8c]"]
+    # a note inside a group keeps the marks of the group
+    assert _make_tied_notes("8cL", 0.25) == ["[16cL", "16c]"]
+    assert _make_tied_notes("8cJ", 0.25) == ["[16c", "16c]J"]
+    assert _make_tied_notes("8c", 0.25, in_beam=True) == ["[16c", "16c]"]
+
+
+def test_make_harmony_list_beams():
+    melody = ["**kern", "*clefG2", "*k[]", "*M4/4", "=1", "8cL", "8c", "8cJ", "8c", "2c", "=2"]
+    harmony = [
+        dict(_chord(0, [4, 3]), onset=0),
+        dict(_chord(7, [4, 3]), onset=0.75),
+        dict(_chord(5, [4, 3]), onset=1.75),
+    ]
+    out, melody = make_harmony_list(harmony, melody, [(0, "*k[]")])
+    assert out == ["C", ".", "G", ".", ".", "F", ".", "=2"]
+    # the split inside the group keeps its marks, the one after the group starts a new group
+    assert melody[5:11] == ["8cL", "[16c", "16c]", "8cJ", "[16cL", "16c]J"]
+
+
+def test_beam_split():
+    template = (0, 0, 0, 0, 1, 1, 1, 1)
+    assert _beam_split(template, 0, 0.5, 0.5)
+    assert not _beam_split(template, 0.5, 0.25, 0.5)
+    # quarter notes are not beamed, nor notes crossing a group
+    assert not _beam_split(template, 0, 1, 0.5)
+    assert not _beam_split(template, 0.5, 0.5, 0.5)
+    assert not _beam_split(None, 0, 0.5, 0.5)
+
+
+def test_make_harmony_list_split_quarters():
+    melody = ["**kern", "*clefG2", "*k[]", "*M4/4", "=1", "2c", "4.c", "8c", "=2"]
+    harmony = [dict(_chord(0, [4, 3]), onset=onset) for onset in [0, 1, 2.5]]
+    _, melody = make_harmony_list(harmony, melody, [(0, "*k[]")])
+    # the tied notes of a half note and of a dotted quarter are not beamed
+    assert melody[5:] == ["[4c", "4c]", "[8c", "4c]", "8c", "=2"]
+
+
+def test_make_harmony_list_split_tied_notes():
+    melody = ["**kern", "*clefG2", "*k[]", "*M4/4", "=1", "[2c", "4.c", "8c]", "=2"]
+    harmony = [dict(_chord(0, [4, 3]), onset=onset) for onset in [0, 1, 2.5, 3.25]]
+    _, melody = make_harmony_list(harmony, melody, [(0, "*k[]")])
+    # the splits continue the tie of the melody instead of closing it
+    assert melody[5:] == ["[4c", "4c", "8c", "8.c", "16c", "8c]", "=2"]
@@ -0,0 +1,107 @@
+import copy
+import json
+
+import pytest
+
+from src.converter import _bar_at, convert, make_excerpt
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+def _bars(kern):
+    """Lines of each bar of a converted song, by bar number"""
+    out = {}
+    bar = None
+    for line in kern.split("\n"):
+        if line[0] == "=":
+            bar = int(line.split("\t")[0][1:])
+            out[bar] = []
+        elif bar is not None and line[0] not in ["*", "!"]:
+            out[bar].append(line)
+    return out
+
+
+def _quarter_notes(num_beats):
+    return [
+        {"onset": b, "offset": b + 1, "octave": 0, "pitch_class": b % 12}
+        for b in range(num_beats)
+    ]
+
+
+def test_bar_at():
+    melody = _quarter_notes(20)
+    meters = [(0, "*M4/4")]
+    assert _bar_at(melody, meters, 0) == (1, 0)
+    assert _bar_at(melody, meters, 13.5) == (4, 12)
+    # a meter change in the middle of a bar completes it with the new meter
+    meters = [(0, "*M4/4"), (10, "*M3/4")]
+    assert _bar_at(melody, meters, 9) == (3, 8)
+    assert _bar_at(melody, meters, 10) == (3, 8)
+    assert _bar_at(melody, meters, 11) == (4, 11)
+    assert _bar_at(melody, meters, 13) == (4, 11)
+    assert _bar_at(melody, meters, 14) == (5, 14)
+
+
+def test_convert_window_meter_change(json_data):
+    entry = copy.deepcopy(json_data)
+    entry["annotations"]["melody"] = _quarter_notes(20)
+    entry["annotations"]["harmony"] = [
+        dict(json_data["annotations"]["harmony"][0], onset=b, offset=b + 2)
+        for b in range(0, 20, 2)
+    ]
+    entry["annotations"]["meters"].append({"beat": 10, "beats_per_bar": 3, "beat_unit": 4})
+    entry["annotations"]["num_beats"] = 20
+    full = _bars(convert(entry))
+    window = _bars(convert(entry, start_beat=13))
+    assert list(window) == [4, 5, 6, 7]
+    # the window starts on the bar line of the full song at beat 11 and keeps its bars,
+    # the chord of beat 12 is carried in at beat 13
+    assert window[4] == ["2r\t.", "4c#\tG"]
+    assert all(window[bar] == full[bar] for bar in [5, 6, 7])
+
+
+def test_make_excerpt(json_data):
+    excerpt, first_bar = make_excerpt(json_data, 13, 22.5)
+    assert first_bar == 4
+    melody = excerpt["annotations"]["melody"]
+    # the note from beat 13.5 is the first one, positions are relative to the bar line at beat 12
+    assert melody[0]["onset"] == 1.5
+    assert melody[-1]["offset"] == 10.5
+    # the chord in effect at the first note is carried in, the rest before it has no chord
+    assert excerpt["annotations"]["harmony"][0]["onset"] == 1.5
+    assert excerpt["annotations"]["harmony"][0]["root_pitch_class"] == 11
+    assert excerpt["annotations"]["keys"][0]["beat"] == 0
+    assert excerpt["annotations"]["meters"] == [
+        dict(json_data["annotations"]["meters"][0], beat=0)
+    ]
+
+
+def test_convert_window(json_data):
+    full = convert(json_data)
+    assert convert(json_data, start_beat=0) == full
+    window = convert(json_data, start_beat=12, end_beat=24)
+    bars = _bars(window)
+    # bars keep their number in the song, the song ends with a bar of rest as a whole song does
+    assert list(bars) == [4, 5, 6, 7]
+    assert bars[7] == ["1r\t."]
+    # the notes tied over the edges of the window are closed
+    assert _bars(full)[4][0] == "4f#]\tBm"
+    assert bars[4] == ["4f#\tBm"] + _bars(full)[4][1:]
+    assert _bars(full)[6][-1] == "[8dJ\t."
+    assert bars[6] == _bars(full)[6][:-1] + ["8dJ\t."]
+    assert convert(json_data, start_beat=12, end_beat=24, measure_cache=True) == window
+
+
+def test_empty_window(json_data):
+    with pytest.raises(ValueError):
+        make_excerpt(json_data, 12, 12)
+    with pytest.raises(ValueError):
+        convert(json_data, start_beat=12, end_beat=8)
+    with pytest.raises(ValueError):
+        convert(json_data, end_beat=0)
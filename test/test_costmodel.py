@@ -0,0 +1,104 @@
+import copy
+import json
+
+import pytest
+
+from src.batch import main, run_batch
+from src.costmodel import (
+    FEATURES,
+    CostModel,
+    balanced_shards,
+    features,
+    longest_first,
+    read_samples,
+)
+from src.shards import merge_manifests, select_shard, write_manifest
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+def test_features(json_data):
+    values = features(json_data)
+    assert len(values) == len(FEATURES)
+    annotations = json_data["annotations"]
+    assert values[:4] == [len(annotations["melody"]), len(annotations["harmony"]), 0, 0]
+    other = copy.deepcopy(json_data)
+    other["annotations"]["melody"][0]["offset"] += 0.3
+    assert features(other)[4] == values[4] + 1
+
+
+def test_fit():
+    weights = {"intercept": 1.0, "notes": 0.5, "chords": 0.25}
+    samples = []
+    for notes in range(10):
+        for chords in range(5):
+            f = [notes, chords, notes % 2, 0, chords % 3]
+            samples.append((f, 1.0 + 0.5 * notes + 0.25 * chords))
+    model = CostModel.fit(samples)
+    for name, weight in model.weights.items():
+        assert model.weights[name] == pytest.approx(weights.get(name, 0), abs=1e-9)
+    assert model.estimate([2, 4, 0, 0, 0]) == pytest.approx(3.0)
+
+
+def test_longest_first_and_balanced_shards():
+    costs = {"a": 1.0, "b": 8.0, "c": 3.0, "d": 3.0, "e": 2.0, "f": 1.0}
+    assert longest_first(costs) == ["b", "c", "d", "e", "a", "f"]
+    assignment = balanced_shards(costs, 2)
+    loads = [sum(c for k, c in costs.items() if assignment[k] == shard) for shard in range(2)]
+    assert loads == [9.0, 9.0]
+    assert balanced_shards(costs, 2) == assignment
+
+
+def test_run_batch_costs(json_data, tmp_path):
+    small = copy.deepcopy(json_data)
+    small["annotations"]["melody"] = small["annotations"]["melody"][:5]
+    data = {"small": small, "big": json_data}
+    model = CostModel()
+    manifest = run_batch(data, tmp_path, skip=[], cost_model=model)
+    assert set(manifest["costs"]) == {"small", "big"}
+    cost = manifest["costs"]["big"]
+    assert cost["predicted"] == model.predict(json_data)
+    assert cost["features"] == features(json_data)
+    assert cost["actual"] > 0
+    # the manifest gives the samples to fit the model again
+    path = write_manifest(manifest, tmp_path)
+    samples = read_samples([path])
+    assert sorted(f[0] for f, _ in samples) == [5, len(json_data["annotations"]["melody"])]
+
+
+def test_balanced_shards_manifests(json_data, tmp_path):
+    data = {}
+    for i in range(6):
+        entry = copy.deepcopy(json_data)
+        entry["annotations"]["melody"] = entry["annotations"]["melody"][: 10 * (i + 1)]
+        data[f"id{i}"] = entry
+    model = CostModel()
+    costs = {k: model.predict(v) for k, v in data.items()}
+    for shard in range(2):
+        manifest = run_batch(select_shard(data, shard, 2, costs), tmp_path / str(shard), skip=[])
+        manifest["sharding"] = "balanced"
+        write_manifest(manifest, tmp_path, shard, 2)
+    merged, problems = merge_manifests([tmp_path], data)
+    assert problems == []
+    assert sorted(merged["converted"]) == sorted(data)
+
+
+def test_main_scheduling_options(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        main(["data/fileExample.json", str(tmp_path), "--balanced-shards"])
+    assert "--balanced-shards requires --shard" in capsys.readouterr().err
+    # balanced shards use the model for the assignment without scheduling the run
+    main(["data/fileExample.json", str(tmp_path / "balanced"), "--balanced-shards", "--shard", "0/2"])
+    (path,) = (tmp_path / "balanced").glob("manifest*.json")
+    manifest = json.loads(path.read_text())
+    assert manifest["sharding"] == "balanced"
+    assert "costs" not in manifest
+    main(["data/fileExample.json", str(tmp_path / "scheduled"), "--schedule"])
+    (path,) = (tmp_path / "scheduled").glob("manifest*.json")
+    assert "costs" in json.loads(path.read_text())
@@ -0,0 +1,104 @@
+import copy
+import json
+
+import pytest
+
+from src.batch import run_batch
+from src.converter import convert
+from src.dedup import annotation_hash, find_duplicates, fingerprint, relabel_kern
+from src.shards import merge_manifests, write_manifest
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+def _copy(json_data, hooktheoryid, song="other-clip"):
+    out = copy.deepcopy(json_data)
+    out["hooktheory"]["id"] = hooktheoryid
+    out["hooktheory"]["song"] = song
+    return out
+
+
+def _transpose(json_data, hooktheoryid):
+    out = _copy(json_data, hooktheoryid)
+    annotations = out["annotations"]
+    for note in annotations["melody"]:
+        octave, pitch_class = divmod(note["pitch_class"] + 2, 12)
+        note["octave"] += octave
+        note["pitch_class"] = pitch_class
+        note["onset"] += 4
+        note["offset"] += 4
+    for chord in annotations["harmony"]:
+        chord["root_pitch_class"] = (chord["root_pitch_class"] + 2) % 12
+    for key in annotations["keys"]:
+        key["tonic_pitch_class"] = (key["tonic_pitch_class"] + 2) % 12
+    return out
+
+
+def test_annotation_hash(json_data):
+    other = _copy(json_data, "abc")
+    assert annotation_hash(other) == annotation_hash(json_data)
+    # integer and float positions are the same
+    other["annotations"]["melody"][0]["onset"] = float(
+        json_data["annotations"]["melody"][0]["onset"]
+    )
+    assert annotation_hash(other) == annotation_hash(json_data)
+    other["annotations"]["melody"][0]["pitch_class"] += 1
+    assert annotation_hash(other) != annotation_hash(json_data)
+    other = _copy(json_data, "abc")
+    other["alignment"] = None
+    assert annotation_hash(other) == annotation_hash(json_data)
+    assert annotation_hash(other, True) != annotation_hash(json_data, True)
+
+
+def test_fingerprint(json_data):
+    transposed = _transpose(json_data, "abc")
+    assert annotation_hash(transposed) != annotation_hash(json_data)
+    assert fingerprint(transposed) == fingerprint(json_data)
+
+
+def test_find_duplicates(json_data):
+    data = {
+        "qveoYyGGodn": json_data,
+        "bcd": _copy(json_data, "bcd"),
+        "abc": _copy(json_data, "abc"),
+        "xyz": _transpose(json_data, "xyz"),
+    }
+    exact, near = find_duplicates(data)
+    assert exact == {"abc": ["bcd", "qveoYyGGodn"]}
+    assert near == [["abc", "bcd", "qveoYyGGodn", "xyz"]]
+
+
+def test_relabel_kern(json_data):
+    other = _copy(json_data, "abc")
+    assert relabel_kern(convert(json_data), json_data, other) == convert(other)
+
+
+def test_run_batch_dedup(json_data, tmp_path):
+    data = {
+        "qveoYyGGodn": json_data,
+        "abc": _copy(json_data, "abc"),
+        "xyz": _transpose(json_data, "xyz"),
+    }
+    manifest = run_batch(data, tmp_path, dedup=True)
+    assert sorted(manifest["converted"]) == ["abc", "qveoYyGGodn", "xyz"]
+    assert manifest["duplicates"] == {"qveoYyGGodn": "abc"}
+    assert manifest["near_duplicates"] == [["abc", "qveoYyGGodn", "xyz"]]
+    for k, v in data.items():
+        assert (tmp_path / f"{k}.krn").read_text() == convert(v)
+    write_manifest(manifest, tmp_path)
+    merged, problems = merge_manifests([tmp_path])
+    assert problems == []
+    assert merged["duplicates"] == {"qveoYyGGodn": "abc"}
+
+
+def test_run_batch_dedup_midi(json_data, tmp_path):
+    data = {"qveoYyGGodn": json_data, "abc": _copy(json_data, "abc")}
+    manifest = run_batch(data, tmp_path, fmt="midi", dedup=True)
+    assert manifest["duplicates"] == {"qveoYyGGodn": "abc"}
+    assert (tmp_path / "abc.mid").read_bytes() == (tmp_path / "qveoYyGGodn.mid").read_bytes()
@@ -1,10 +1,23 @@
 from src.kernfilebuilder import (
+    _beam_template,
     _get_bar_duration,
     _get_duration_pitch_from_kern_note,
+    _kern_note,
+    _make_rest,
     _note_char_from_octave,
+    make_notes_from_melody,
 )
 
 
+def _notes(durations, start=0):
+    out = []
+    onset = start
+    for duration in durations:
+        out.append({"onset": onset, "offset": onset + duration, "pitch_class": 0, "octave": 0})
+        onset += duration
+    return out
+
+
 def test_note_char_from_octave():
     assert _note_char_from_octave("C", "", 0) == "c"
     assert _note_char_from_octave("C", "b", 0) == "c-"
@@ -17,9 +30,71 @@ def test_note_char_from_octave():
     assert _note_char_from_octave("C", "b", -3) == "CCC-"
 
 
+def test_kern_note():
+    assert _kern_note(1, 1, 1.5) == ["4.cc#"]
+    assert _kern_note(1, -1, 0.5, use_sharps=False) == ["8D-"]
+    assert _kern_note(0, 0, 2, open_tie=True) == ["[2c"]
+    assert _kern_note(0, 0, 2, open_tie=True, close_tie=True) == ["[2c]"]
+    # tokens come from a table, equal tokens are the same object
+    assert _kern_note(0, 0, 2, close_tie=True)[0] is _kern_note(0, 0, 2.0, close_tie=True)[0]
+    # durations and octaves out of the table
+    assert _kern_note(0, 0, 1.25, no_tie_constraints=True) == ["[4c", "16c]"]
+    assert _kern_note(0, 6, 1) == ["4ccccccc"]
+
+
+def test_make_rest():
+    assert _make_rest(0.75) == ["8.r"]
+    assert _make_rest(0.5)[0] is _make_rest(0.5)[0]
+    assert _make_rest(2.25) == ["2r", "16r"]
+
+
 def test_get_bar_duration():
     assert _get_bar_duration("*M4/4") == 4
 
 
 def test_get_duration_pitch_from_kern_note():
     assert _get_duration_pitch_from_kern_note("4.f#") == ("4.", "f#")
+    assert _get_duration_pitch_from_kern_note("[8cL") == ("8", "c")
+    assert _get_duration_pitch_from_kern_note("16c]J") == ("16", "c")
+
+
+def test_beam_template():
+    assert _beam_template("*M2/4") == (0, 0, 0, 0, 1, 1, 1, 1)
+    assert _beam_template("*M6/8") == (0,) * 6 + (1,) * 6
+    assert _beam_template("*M3/8") == (0,) * 6
+    assert _beam_template("*M7/8") == (0,) * 4 + (1,) * 4 + (2,) * 6
+
+
+def test_make_notes_beams_by_beat():
+    meters, keys = [(0, "*M4/4")], [(0, "*k[]")]
+    melody = _notes([0.5, 0.5, 0.25, 0.25, 0.5, 1, 0.5, 0.25, 0.25])
+    assert make_notes_from_melody(melody, meters, keys) == [
+        "8cL", "8cJ", "16cL", "16c", "8cJ", "4c", "8cL", "16c", "16cJ", "=2", "1r",
+    ]
+    # a note crossing a beat boundary is not beamed
+    melody = _notes([0.5, 0.5, 0.5, 0.5, 1, 1], start=0.5)
+    assert make_notes_from_melody(melody, meters, keys, beam=False) == [
+        "8r", "8c", "8c", "8c", "8c", "4c", "[8c", "=2", "8c]", "2..r",
+    ]
+    assert make_notes_from_melody(melody, meters, keys) == [
+        "8r", "8c", "8cL", "8cJ", "8c", "4c", "[8c", "=2", "8c]", "2..r",
+    ]
+
+
+def test_make_notes_beams_compound_meter():
+    melody = _notes([0.5] * 6)
+    assert make_notes_from_melody(melody, [(0, "*M6/8")], [(0, "*k[]")]) == [
+        "8cL", "8c", "8cJ", "8cL", "8c", "8cJ", "=2", "2.r",
+    ]
+
+
+def test_make_notes_tie_ends_on_bar_line():
+    melody = _notes([3, 5], start=0)
+    # the note ends with a full measure, which closes the tie
+    assert make_notes_from_melody(melody, [(0, "*M4/4")], [(0, "*k[]")])[:5] == [
+        "2.c",
+        "[4c",
+        "=2",
+        "1c]",
+        "=3",
+    ]
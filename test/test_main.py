@@ -0,0 +1,81 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from src.__main__ import dataset_stats, main
+from src.converter import convert
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+def test_convert_startup(json_data):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "src", "convert", "data/fileExample.json"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout == convert(json_data) + "\n"
+    imported = {line.split("|")[-1].strip() for line in result.stderr.splitlines() if "|" in line}
+    # heavy modules are only imported by the commands that need them
+    for module in ["numpy", "tqdm", "src.batch", "src.timing"]:
+        assert module not in imported
+
+
+def test_convert_stdin(json_data, tmp_path):
+    result = subprocess.run(
+        [sys.executable, "-m", "src", "convert", "--start-beat", "12", "--end-beat", "24"],
+        input=json.dumps(json_data),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout == convert(json_data, start_beat=12, end_beat=24) + "\n"
+
+
+def test_convert_validate(tmp_path):
+    # python -m src convert data/fileExample.json > song.krn; python -m src validate song.krn
+    converted = subprocess.run(
+        [sys.executable, "-m", "src", "convert", "data/fileExample.json"],
+        capture_output=True,
+        check=True,
+    )
+    (tmp_path / "song.krn").write_bytes(converted.stdout)
+    result = subprocess.run(
+        [sys.executable, "-m", "src", "validate", str(tmp_path / "song.krn")],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stdout
+    assert "0 of 1 files have problems." in result.stdout
+
+
+def test_stats(json_data):
+    stats = dataset_stats({"a": json_data})
+    assert stats["entries"] == 1
+    assert stats["notes"] == len(json_data["annotations"]["melody"])
+    assert stats["rejected"] == {}
+    assert stats["predicted_seconds"] > 0
+
+
+def test_validate(json_data, tmp_path, capsys):
+    (tmp_path / "a.krn").write_text(convert(json_data))
+    main(["validate", str(tmp_path)])
+    assert "0 of 1 files have problems." in capsys.readouterr().out
+    (tmp_path / "b.krn").write_text(convert(json_data)[:-3])
+    with pytest.raises(SystemExit):
+        main(["validate", str(tmp_path)])
+
+
+def test_convert_empty_window(capsys):
+    with pytest.raises(SystemExit):
+        main(["convert", "data/fileExample.json", "--start-beat", "12", "--end-beat", "12"])
+    assert "--end-beat must be after --start-beat" in capsys.readouterr().err
@@ -0,0 +1,90 @@
+import copy
+import json
+
+import pytest
+
+from src.converter import convert
+from src.measurecache import clear_measure_cache, get_segments, measure_cache_info
+from src.util import get_key_signatures, get_meters
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+def _repeated_song(json_data, repeats=8):
+    # a two-bar motif over two alternating chords
+    motif = [(0, 1, 0), (1, 2, 4), (2, 3, 7), (3, 4, 5), (4, 6, 4), (6, 8, 2)]
+    melody = []
+    for r in range(repeats):
+        for onset, offset, pitch_class in motif:
+            melody.append(
+                {
+                    "onset": 8 * r + onset,
+                    "offset": 8 * r + offset,
+                    "octave": 0,
+                    "pitch_class": pitch_class,
+                }
+            )
+    harmony = [
+        {
+            "onset": 4 * i,
+            "offset": 4 * i + 4,
+            "root_pitch_class": [2, 9][i % 2],
+            "root_position_intervals": [4, 3],
+            "inversion": 0,
+        }
+        for i in range(2 * repeats)
+    ]
+    out = copy.deepcopy(json_data)
+    out["annotations"]["melody"] = melody
+    out["annotations"]["harmony"] = harmony
+    return out
+
+
+def test_get_segments(json_data):
+    annotations = json_data["annotations"]
+    segments = get_segments(
+        annotations["melody"], get_meters(json_data), get_key_signatures(json_data)
+    )
+    assert segments[0].first_note == 0
+    assert segments[0].first_bar == 1
+    assert segments[-1].end is None
+    assert segments[-1].end_note == len(annotations["melody"])
+    for previous, segment in zip(segments[:-1], segments[1:]):
+        assert previous.end_note == segment.first_note
+        assert previous.end == segment.start
+        assert segment.first_bar > previous.first_bar
+
+
+def test_convert_with_cache(json_data):
+    clear_measure_cache()
+    assert convert(json_data, measure_cache=True) == convert(json_data)
+    misses = measure_cache_info().misses
+    assert convert(json_data, measure_cache=True) == convert(json_data)
+    assert measure_cache_info().misses == misses
+    assert measure_cache_info().hits >= misses
+
+
+def test_repeated_bars(json_data, capsys):
+    song = _repeated_song(json_data)
+    clear_measure_cache()
+    assert convert(song, measure_cache=True) == convert(song)
+    # the measure closing each segment is dropped without being completed by a rest
+    assert "Couldn't find duration" not in capsys.readouterr().out
+    info = measure_cache_info()
+    # both bars of the motif are converted once, plus the last bar which closes the song
+    assert info.misses == 3
+    assert info.hits == 13
+
+
+def test_key_change(json_data):
+    song = _repeated_song(json_data)
+    key = dict(song["annotations"]["keys"][0], beat=16, tonic_pitch_class=7)
+    song["annotations"]["keys"] = song["annotations"]["keys"] + [key]
+    assert convert(song, measure_cache=True) == convert(song)
+    assert "*k[f#]" in convert(song, measure_cache=True)
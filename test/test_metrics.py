@@ -0,0 +1,121 @@
+import copy
+import json
+
+import pytest
+
+from src.batch import run_batch
+from src.metrics import BatchMetrics, percentile
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 99) == 3.0
+    assert percentile([], 50) == 0.0
+
+
+def test_snapshot():
+    clock = FakeClock()
+    metrics = BatchMetrics(clock=clock)
+    metrics.record(0.1, 100)
+    metrics.record(0.3, 200)
+    metrics.record(0.2, error="KeyError: 3.75")
+    metrics.record(0.2, error="ValueError: Unknown chord nature")
+    metrics.record(0.2, error="KeyError: 1.25")
+    clock.now = 2.0
+    snapshot = metrics.snapshot()
+    assert snapshot["songs"] == 5
+    assert snapshot["converted"] == 2
+    assert snapshot["failed"] == 3
+    assert snapshot["songs_per_second"] == 2.5
+    assert snapshot["latency"] == {"p50": 0.2, "p95": 0.3, "p99": 0.3}
+    assert snapshot["failures"] == {"KeyError": 2, "ValueError": 1}
+    assert snapshot["bytes_written"] == 300
+    assert "2 converted, 3 failed" in metrics.summary()
+
+
+def test_write_interval(tmp_path):
+    clock = FakeClock()
+    path = tmp_path / "metrics.json"
+    metrics = BatchMetrics(path, interval=10, clock=clock)
+    metrics.record(0.1, 100)
+    metrics.maybe_write()
+    assert json.loads(path.read_text())["songs"] == 1
+    metrics.record(0.1, 100)
+    clock.now = 5.0
+    metrics.maybe_write()
+    assert json.loads(path.read_text())["songs"] == 1
+    clock.now = 10.0
+    metrics.maybe_write()
+    assert json.loads(path.read_text())["songs"] == 2
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_prometheus(tmp_path):
+    path = tmp_path / "batch.prom"
+    metrics = BatchMetrics(path)
+    metrics.record(0.1, 100)
+    metrics.record(0.2, error="KeyError: 3.75")
+    metrics.write()
+    lines = path.read_text().split("\n")
+    assert "hooktheory_batch_songs_total 2" in lines
+    assert 'hooktheory_batch_failures_total{type="KeyError"} 1' in lines
+    assert 'hooktheory_batch_latency_seconds{quantile="0.5"} 0.1' in lines
+    assert "hooktheory_batch_duplicates_total 0" in lines
+
+
+def test_run_batch_metrics(json_data, tmp_path):
+    path = tmp_path / "metrics.json"
+    metrics = BatchMetrics(path)
+    manifest = run_batch({"qveoYyGGodn": json_data}, tmp_path / "kern", metrics=metrics)
+    assert manifest["converted"] == ["qveoYyGGodn"]
+    snapshot = json.loads(path.read_text())
+    assert snapshot["converted"] == 1
+    assert snapshot["bytes_written"] == (tmp_path / "kern" / "qveoYyGGodn.krn").stat().st_size
+
+
+def test_duplicates_latency():
+    metrics = BatchMetrics(clock=FakeClock())
+    for elapsed in [0.1, 0.3, 0.2]:
+        metrics.record(elapsed, 100)
+    latency = metrics.snapshot()["latency"]
+    # copies are fast, or slow on a busy disk, and say nothing of the conversion time
+    metrics.record(0.001, 100, duplicate=True)
+    metrics.record(5.0, 100, duplicate=True)
+    snapshot = metrics.snapshot()
+    assert snapshot["latency"] == latency
+    assert snapshot["songs"] == 5
+    assert snapshot["converted"] == 5
+    assert snapshot["duplicates"] == 2
+    assert "2 songs copied from their duplicates." in metrics.summary()
+
+
+def test_run_batch_metrics_dedup(json_data, tmp_path):
+    data = {"qveoYyGGodn": json_data}
+    for key in ["abc", "def"]:
+        data[key] = copy.deepcopy(json_data)
+        data[key]["hooktheory"]["id"] = key
+    metrics = BatchMetrics()
+    manifest = run_batch(data, tmp_path, dedup=True, metrics=metrics)
+    assert len(manifest["duplicates"]) == 2
+    assert len(metrics.latencies) == 1
+    assert metrics.duplicates == 2
+    assert metrics.snapshot()["converted"] == 3
@@ -0,0 +1,91 @@
+import json
+import struct
+
+import pytest
+
+from src.midi import (
+    DEFAULT_TEMPO,
+    MAX_TEMPO,
+    _key_signature,
+    _vlq,
+    chord_voicing,
+    convert_to_midi,
+    get_tempo_changes,
+)
+from src.mode_formulas import MODES_INTERVALS
+from src.timing import get_tempo_records
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+def test_vlq():
+    assert _vlq(0) == b"\x00"
+    assert _vlq(0x7F) == b"\x7f"
+    assert _vlq(0x80) == b"\x81\x00"
+    assert _vlq(0x3FFF) == b"\xff\x7f"
+
+
+def test_chord_voicing():
+    # C major
+    chord = {"root_pitch_class": 0, "root_position_intervals": [4, 3], "inversion": 0}
+    assert chord_voicing(chord) == [48, 52, 55]
+    # G7 in 3rd inversion
+    chord = {"root_pitch_class": 7, "root_position_intervals": [4, 3, 3], "inversion": 3}
+    assert chord_voicing(chord) == [65, 67, 71, 74]
+
+
+def test_get_tempo_changes(json_data):
+    changes = get_tempo_changes(json_data)
+    assert changes[0][0] == 0
+    # first refined beat lasts 0.64s
+    assert changes[0][1] == 640000
+    # as sparse as the kern tempo records
+    beats = [beat for beat, _ in changes]
+    assert beats == [beat for beat, _ in get_tempo_records(json_data)]
+    json_data.pop("alignment")
+    assert get_tempo_changes(json_data) == [(0, DEFAULT_TEMPO)]
+
+
+def test_get_tempo_changes_clamped(json_data):
+    # a beat lasting 20s does not fit in the 3 bytes of a tempo event
+    json_data["alignment"]["refined"] = {"beats": [0, 1, 2], "times": [0, 20, 20.5]}
+    assert get_tempo_changes(json_data) == [(0, MAX_TEMPO), (1, 500000)]
+    assert len(convert_to_midi(json_data)) > 0
+
+
+def test_key_signature():
+    def key(tonic, mode):
+        return {"tonic_pitch_class": tonic, "scale_degree_intervals": MODES_INTERVALS[mode]}
+
+    assert _key_signature(key(7, "ionian")) == struct.pack(">bB", 1, 0)
+    assert _key_signature(key(9, "aeolian")) == struct.pack(">bB", 0, 1)
+    # D dorian and E phrygian have the key signature of C major and a minor third
+    assert _key_signature(key(2, "dorian")) == struct.pack(">bB", 0, 1)
+    assert _key_signature(key(4, "phrygian")) == struct.pack(">bB", 0, 1)
+    assert _key_signature(key(11, "locrian")) == struct.pack(">bB", 0, 1)
+    # F lydian and G mixolydian as well, with a major third
+    assert _key_signature(key(5, "lydian")) == struct.pack(">bB", 0, 0)
+    assert _key_signature(key(7, "mixolydian")) == struct.pack(">bB", 0, 0)
+    # A dorian has one sharp
+    assert _key_signature(key(9, "dorian")) == struct.pack(">bB", 1, 1)
+
+
+def test_convert_to_midi(json_data):
+    result = convert_to_midi(json_data)
+    assert result[:4] == b"MThd"
+    _, fmt, ntracks, division = struct.unpack(">IHHH", result[4:14])
+    assert (fmt, ntracks, division) == (1, 2, 480)
+    assert result.count(b"MTrk") == 2
+    assert result.endswith(b"\xff\x2f\x00")
+
+
+def test_chord_voicing_extended():
+    # Dm9 in 4th inversion, the ninth in the bass
+    chord = {"root_pitch_class": 2, "root_position_intervals": [3, 4, 3, 4], "inversion": 4}
+    assert chord_voicing(chord) == [64, 65, 69, 72, 74]
@@ -0,0 +1,136 @@
+import copy
+import json
+
+import numpy as np
+import pytest
+
+from src.batch import run_batch
+from src.converter import convert
+from src.prefilter import (
+    EMPTY,
+    UNKNOWN_CHORD,
+    UNKNOWN_MODE,
+    UNSUPPORTED_CHANGE,
+    UNSUPPORTED_DURATION,
+    UNSUPPORTED_INVERSION,
+    _token_bounds,
+    check_entry,
+    classify_dataset,
+)
+from src.sharedcorpus import pack_corpus
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+def _with_melody_and_harmony(json_data, notes, chords):
+    entry = copy.deepcopy(json_data)
+    entry["annotations"]["melody"] = [
+        {"onset": on, "offset": off, "octave": 0, "pitch_class": 0}
+        for on, off in notes
+    ]
+    entry["annotations"]["harmony"] = [
+        {
+            "onset": on,
+            "offset": on + 1,
+            "root_pitch_class": 0,
+            "root_position_intervals": [4, 3],
+            "inversion": 0,
+        }
+        for on in chords
+    ]
+    return entry
+
+
+def test_check_entry(json_data):
+    assert check_entry(json_data) is None
+    entry = copy.deepcopy(json_data)
+    entry["annotations"]["harmony"] = []
+    assert check_entry(entry) == EMPTY
+    entry = copy.deepcopy(json_data)
+    entry["annotations"]["keys"][0]["scale_degree_intervals"] = [2, 2, 2, 2, 2, 2]
+    assert check_entry(entry) == UNKNOWN_MODE
+    entry = copy.deepcopy(json_data)
+    entry["annotations"]["harmony"][3]["root_position_intervals"] = [1, 1]
+    assert check_entry(entry) == UNKNOWN_CHORD
+    entry = copy.deepcopy(json_data)
+    entry["annotations"]["harmony"][3]["inversion"] = 3
+    assert check_entry(entry) == UNSUPPORTED_INVERSION
+
+
+def test_melody_token_bounds(json_data):
+    entry = _with_melody_and_harmony(json_data, [(1, 2), (3, 6.75)], [0])
+    starts, ends, entries = _token_bounds(
+        {"entry": entry}, pack_corpus({"entry": entry}), np.ones(1, dtype=bool), {}
+    )
+    # rest, note, rest, note cut at the bar line then split in two tied notes,
+    # and a final rest of 1.25 beats split in two as well
+    assert starts.tolist() == [0, 1, 2, 3, 4, 6, 6.75, 7.75]
+    assert ends.tolist() == [1, 2, 3, 4, 6, 6.75, 7.75, 8]
+    assert entries.tolist() == [0] * 8
+
+
+def test_unsupported_duration(json_data):
+    # a chord 1.25 beats into a dotted half note cannot be written with tied notes
+    entry = _with_melody_and_harmony(json_data, [(0, 3), (3, 4)], [0, 1.25, 3])
+    assert check_entry(entry) == UNSUPPORTED_DURATION
+    entry = _with_melody_and_harmony(json_data, [(0, 3), (3, 4)], [0, 1.5, 3])
+    assert check_entry(entry) is None
+
+
+def test_prefilter_batch(json_data, tmp_path):
+    broken = copy.deepcopy(json_data)
+    broken["annotations"]["harmony"][3]["root_position_intervals"] = [1, 1]
+    data = {"good": json_data, "broken": broken}
+    assert classify_dataset(data) == {"broken": UNKNOWN_CHORD}
+    manifest = run_batch(data, tmp_path, prefilter=True)
+    assert manifest["converted"] == ["good"]
+    assert manifest["rejected"] == {"broken": UNKNOWN_CHORD}
+    assert manifest["errors"] == {}
+
+
+def _converts(entry):
+    try:
+        return convert(entry) != ""
+    except Exception:
+        return False
+
+
+def test_predictions_match_convert(json_data):
+    data = {"original": json_data}
+    # overlapping notes are cut by the converter and do not prevent the conversion
+    data["overlap"] = _with_melody_and_harmony(json_data, [(0, 2.5), (2, 4)], [0, 2])
+    data["overlap_chord"] = _with_melody_and_harmony(json_data, [(0, 3), (1, 4)], [0, 1.5])
+    data["duration"] = _with_melody_and_harmony(json_data, [(0, 3), (3, 4)], [0, 1.25, 3])
+    data["tied"] = _with_melody_and_harmony(json_data, [(0, 3), (3, 4)], [0, 1.5, 3])
+    data["chord"] = copy.deepcopy(json_data)
+    data["chord"]["annotations"]["harmony"][3]["root_position_intervals"] = [1, 1]
+    data["inversion"] = copy.deepcopy(json_data)
+    data["inversion"]["annotations"]["harmony"][3]["inversion"] = 3
+    data["mode"] = copy.deepcopy(json_data)
+    data["mode"]["annotations"]["keys"][0]["scale_degree_intervals"] = [2, 2, 2, 2, 2, 2]
+    data["empty"] = copy.deepcopy(json_data)
+    data["empty"]["annotations"]["melody"] = []
+    for beat, beats_per_bar in [(9, 3), (10, 3), (10, 6), (14, 2)]:
+        entry = copy.deepcopy(json_data)
+        entry["annotations"]["meters"].append(
+            {"beat": beat, "beats_per_bar": beats_per_bar, "beat_unit": 4}
+        )
+        data[f"meter_{beat}_{beats_per_bar}"] = entry
+    for beat in [9, 10]:
+        entry = copy.deepcopy(json_data)
+        entry["annotations"]["keys"].append(
+            {"beat": beat, "tonic_pitch_class": 7, "scale_degree_intervals": [2, 2, 1, 2, 2, 2]}
+        )
+        data[f"key_{beat}"] = entry
+    predictions = classify_dataset(data)
+    assert {k for k, v in data.items() if not _converts(v)} == set(predictions)
+    assert "overlap" not in predictions and "overlap_chord" not in predictions
+    assert predictions["duration"] == UNSUPPORTED_DURATION
+    assert predictions["empty"] == EMPTY
+    assert UNSUPPORTED_CHANGE in predictions.values()
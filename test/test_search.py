@@ -0,0 +1,129 @@
+import copy
+import json
+
+import pytest
+
+from src.batch import run_batch
+from src.converter import convert, make_spines
+from src.search import SearchIndex, degree_token, kern_spines, main, song_sequences
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+@pytest.fixture
+def index(json_data):
+    melody, harmony = make_spines(json_data)
+    out = SearchIndex()
+    out.add("qveoYyGGodn", song_sequences(json_data, melody, harmony))
+    return out
+
+
+def test_degree_token():
+    chord = {"root_pitch_class": 7, "root_position_intervals": [4, 3, 3], "inversion": 1}
+    assert degree_token(chord, 0) == "V7"
+    chord = {"root_pitch_class": 11, "root_position_intervals": [3, 4], "inversion": 0}
+    assert degree_token(chord, 2) == "VIm"
+
+
+def test_kern_spines(json_data):
+    melody, harmony = make_spines(json_data)
+    assert kern_spines(convert(json_data)) == (melody, harmony)
+
+
+def test_song_sequences(json_data):
+    melody, harmony = make_spines(json_data)
+    sequences = song_sequences(json_data, melody, harmony)
+    chords, bars = sequences["chord"]
+    assert chords[:4] == ["G", "A", "Bm", "D"]
+    assert bars[:4] == [1, 1, 2, 2]
+    assert sequences["degree"][0][:4] == ["IV", "V", "VIm", "I"]
+    intervals, bars = sequences["interval"]
+    assert len(intervals) == len(json_data["annotations"]["melody"]) - 1
+    assert intervals[:4] == ["-2", "-5", "+2", "+5"]
+
+
+def test_query(index):
+    assert index.query("chord", ["G", "A", "Bm"])[:2] == [
+        ("qveoYyGGodn", 1),
+        ("qveoYyGGodn", 3),
+    ]
+    # longer than the indexed n-grams
+    long_query = index.query("degree", ["IV", "V", "VIm", "I", "IV"])
+    assert long_query[0] == ("qveoYyGGodn", 1)
+    assert index.query("degree", ["IV", "V", "VIm", "I", "V"]) == []
+    assert index.query("interval", ["-2", "-5", "2", "5"]) == [("qveoYyGGodn", 1)]
+    assert index.query("chord", ["G", "C#"]) == []
+
+
+def test_save_load(index, tmp_path):
+    index.save(tmp_path / "index")
+    loaded = SearchIndex.load(tmp_path / "index")
+    assert len(loaded) == 1
+    assert loaded.query("chord", ["Bm", "D"]) == index.query("chord", ["Bm", "D"])
+    # only the queried kind is read
+    assert list(loaded._stored) == ["chord"]
+    long_query = ["IV", "V", "VIm", "I", "IV"]
+    assert loaded.query("degree", long_query) == index.query("degree", long_query)
+    assert loaded.query("degree", ["IV", "V", "VIm", "I", "V"]) == []
+    assert loaded.query("interval", ["-2", "-5", "2", "5"]) == [("qveoYyGGodn", 1)]
+    assert loaded.query("chord", ["G", "C#"]) == []
+
+
+def test_save_load_add(index, json_data, tmp_path):
+    index.save(tmp_path / "index")
+    loaded = SearchIndex.load(tmp_path / "index")
+    melody, harmony = make_spines(json_data)
+    loaded.add("abc", song_sequences(json_data, melody, harmony))
+    # the loaded index is overwritten in place
+    loaded.save(tmp_path / "index")
+    reloaded = SearchIndex.load(tmp_path / "index")
+    assert reloaded.songs == ["qveoYyGGodn", "abc"]
+    bars = [bar for _, bar in index.query("chord", ["G", "A", "Bm"])]
+    assert reloaded.query("chord", ["G", "A", "Bm"]) == [
+        (song, bar) for song in ["qveoYyGGodn", "abc"] for bar in bars
+    ]
+
+
+def test_main_invalid_interval(index, tmp_path, capsys):
+    index.save(tmp_path / "index")
+    with pytest.raises(SystemExit) as e:
+        main([str(tmp_path / "index"), "interval", "2", "x"])
+    assert e.value.code == 2
+    assert "'x' is not a whole number of semitones" in capsys.readouterr().err
+    main([str(tmp_path / "index"), "interval", "-2", "-5"])
+    assert "qveoYyGGodn\tbar 1" in capsys.readouterr().out
+
+
+def test_run_batch_index(json_data, tmp_path):
+    other = copy.deepcopy(json_data)
+    other["hooktheory"]["id"] = "abc"
+    index = SearchIndex()
+    run_batch({"qveoYyGGodn": json_data, "abc": other}, tmp_path, dedup=True, index=index)
+    assert sorted(index.songs) == ["abc", "qveoYyGGodn"]
+    songs = {song for song, _ in index.query("degree", ["IV", "V", "VIm", "I"])}
+    assert songs == {"abc", "qveoYyGGodn"}
+
+
+def test_run_batch_index_errors(json_data, tmp_path):
+    # a chord 1.25 beats into a dotted half note has no kern spines but converts to MIDI
+    other = copy.deepcopy(json_data)
+    other["annotations"]["melody"] = [
+        {"onset": 0, "offset": 3, "octave": 0, "pitch_class": 0},
+        {"onset": 3, "offset": 4, "octave": 0, "pitch_class": 0},
+    ]
+    other["annotations"]["harmony"] = other["annotations"]["harmony"][:3]
+    for chord, onset in zip(other["annotations"]["harmony"], [0, 1.25, 3]):
+        chord["onset"], chord["offset"] = onset, onset + 1
+    index = SearchIndex()
+    data = {"qveoYyGGodn": json_data, "abc": other}
+    manifest = run_batch(data, tmp_path, fmt="midi", index=index)
+    assert sorted(manifest["converted"]) == ["abc", "qveoYyGGodn"]
+    assert (tmp_path / "abc.mid").exists()
+    assert list(manifest["index_errors"]) == ["abc"]
+    assert index.songs == ["qveoYyGGodn"]
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from src.batch import run_batch
+from src.shards import (
+    merge_manifests,
+    parse_shard,
+    select_shard,
+    shard_of,
+    write_manifest,
+)
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    entry = j["qveoYyGGodn"]
+    return {k: entry for k in ["qveoYyGGodn", "nYAg-XWamle", "EzngRRVDgJj", "abc"]}
+
+
+def test_parse_shard():
+    assert parse_shard("0/4") == (0, 4)
+    assert parse_shard("3/4") == (3, 4)
+    with pytest.raises(ValueError):
+        parse_shard("4/4")
+    with pytest.raises(ValueError):
+        parse_shard("1-4")
+
+
+def test_shard_of():
+    assert shard_of("qveoYyGGodn", 1) == 0
+    # assignment must not depend on the interpreter, these values come from the md5 digest of the ids
+    assert [shard_of(k, 1000) for k in ["qveoYyGGodn", "nYAg-XWamle", "EzngRRVDgJj"]] == [
+        520,
+        344,
+        900,
+    ]
+    assert [shard_of(k, 7) for k in ["qveoYyGGodn", "nYAg-XWamle", "EzngRRVDgJj", "abc"]] == [
+        4,
+        4,
+        1,
+        0,
+    ]
+    assert all(0 <= shard_of(str(i), 7) < 7 for i in range(100))
+
+
+def test_merge_manifests(json_data, tmp_path):
+    for shard in range(2):
+        subset = select_shard(json_data, shard, 2)
+        manifest = run_batch(subset, tmp_path, skip=["abc"])
+        write_manifest(manifest, tmp_path, shard, 2)
+    merged, problems = merge_manifests([tmp_path], list(json_data))
+    assert problems == []
+    assert sorted(merged["converted"]) == sorted(set(json_data) - {"abc"})
+    assert merged["skipped"] == ["abc"]
+    # a missing id and a missing shard are reported
+    shard = shard_of("qveoYyGGodn", 2)
+    (tmp_path / f"manifest-{shard}-of-2.json").unlink()
+    _, problems = merge_manifests([tmp_path], list(json_data))
+    assert f"Missing manifest for shard {shard}/2" in problems
+    assert "qveoYyGGodn was not handled by any shard" in problems
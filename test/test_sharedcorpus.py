@@ -0,0 +1,107 @@
+import copy
+import json
+from multiprocessing import shared_memory
+
+import pytest
+
+from src.batch import run_batch
+from src.converter import convert
+from src.sharedcorpus import SharedCorpus
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+@pytest.fixture
+def data(json_data):
+    other = copy.deepcopy(json_data)
+    other["hooktheory"]["id"] = "abc"
+    other["hooktheory"]["song"] = "ünïcode"
+    other["annotations"]["melody"] = other["annotations"]["melody"][:10]
+    other["alignment"] = None
+    empty = copy.deepcopy(json_data)
+    empty["hooktheory"]["id"] = "empty"
+    empty["annotations"]["harmony"] = None
+    return {"qveoYyGGodn": json_data, "abc": other, "empty": empty}
+
+
+def test_entry(data):
+    corpus = SharedCorpus.create(data)
+    view = SharedCorpus.attach(corpus.spec)
+    try:
+        assert len(view) == 3
+        for i, (k, v) in enumerate(data.items()):
+            entry = view.entry(i)
+            assert view.hooktheoryid(i) == k
+            assert entry["hooktheory"]["song"] == v["hooktheory"]["song"]
+            assert entry["annotations"]["melody"] == v["annotations"]["melody"]
+            assert entry["annotations"]["harmony"] == v["annotations"]["harmony"]
+            assert entry["annotations"]["keys"] == v["annotations"]["keys"]
+            assert entry["annotations"]["meters"] == v["annotations"]["meters"]
+        entry = view.entry(0)
+        assert entry["alignment"]["refined"] == data["qveoYyGGodn"]["alignment"]["refined"]
+        assert view.entry(1)["alignment"] is None
+        assert convert(entry, tempo=True, timing=True) == convert(
+            data["qveoYyGGodn"], tempo=True, timing=True
+        )
+    finally:
+        view.close()
+        corpus.unlink()
+
+
+def test_run_batch_workers(data, tmp_path):
+    single = run_batch(data, tmp_path / "single", skip=[])
+    shared = run_batch(data, tmp_path / "shared", num_workers=2, skip=[])
+    assert sorted(shared["converted"]) == sorted(single["converted"])
+    assert shared["errors"] == single["errors"]
+    for k in single["converted"]:
+        assert (tmp_path / "shared" / f"{k}.krn").read_text() == (
+            tmp_path / "single" / f"{k}.krn"
+        ).read_text()
+
+
+def test_run_batch_workers_keys(json_data, tmp_path):
+    # the same entry under several keys, as in a dataset split in copies
+    data = {k: json_data for k in ["first", "second", "third"]}
+    manifest = run_batch(data, tmp_path, num_workers=2, skip=[])
+    assert sorted(manifest["converted"]) == ["first", "second", "third"]
+    assert all((tmp_path / f"{k}.krn").exists() for k in data)
+
+
+def test_context_manager(data):
+    with SharedCorpus.create(data) as corpus:
+        spec = corpus.spec
+        with SharedCorpus.attach(spec) as view:
+            assert view.entry(1)["hooktheory"]["id"] == "abc"
+        # closing a view leaves the blocks to the owner
+        with SharedCorpus.attach(spec) as view:
+            assert view.entry(1)["hooktheory"]["id"] == "abc"
+    for block_name, _ in spec.values():
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=block_name)
+
+
+def test_run_batch_unlinks_on_error(data, tmp_path, monkeypatch):
+    specs = []
+    create = SharedCorpus.create
+
+    def create_and_keep_spec(d):
+        corpus = create(d)
+        specs.append(corpus.spec)
+        return corpus
+
+    class FailingMetrics:
+        def record(self, *args):
+            raise RuntimeError("metrics failed")
+
+    monkeypatch.setattr(SharedCorpus, "create", create_and_keep_spec)
+    with pytest.raises(RuntimeError):
+        run_batch(data, tmp_path, num_workers=2, skip=[], metrics=FailingMetrics())
+    for block_name, _ in specs[0].values():
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=block_name)
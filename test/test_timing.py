@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+import pytest
+
+from src.converter import convert
+from src.timing import (
+    beats_to_seconds,
+    get_beat_map,
+    get_tempo_records,
+    get_token_onsets,
+)
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+def test_beats_to_seconds():
+    beat_map = (np.array([0.0, 1.0, 3.0]), np.array([10.0, 11.0, 12.0]))
+    result = beats_to_seconds(np.array([-1, 0, 0.5, 2, 3, 5]), beat_map)
+    assert np.allclose(result, [9.0, 10.0, 10.5, 11.5, 12.0, 13.0])
+
+
+def test_get_tempo_records(json_data):
+    records = get_tempo_records(json_data)
+    assert records[0] == (0, "*MM94")
+    assert records[1:] == [(25.0, "*MM97"), (26.0, "*MM90"), (27.0, "*MM92")]
+    json_data.pop("alignment")
+    assert get_tempo_records(json_data) == []
+
+
+def test_get_beat_map_fallback(json_data):
+    alignment = json_data["alignment"]
+    refined = alignment["refined"]
+    assert np.array_equal(get_beat_map(json_data)[0], refined["beats"])
+    # a refined alignment with a single beat cannot give a tempo, the user alignment is used
+    alignment["refined"] = {"beats": refined["beats"][:1], "times": refined["times"][:1]}
+    beats, times = get_beat_map(json_data)
+    assert beats.tolist() == alignment["user"]["beats"]
+    assert times.tolist() == alignment["user"]["times"]
+    assert len(get_tempo_records(json_data)) == 1
+    alignment["user"] = None
+    assert get_beat_map(json_data) is None
+
+
+def test_get_token_onsets():
+    tokens = ["**kern", "*M4/4", "=1", "4c", "8d", "[8e", "=2", "2e]", "*-"]
+    result = get_token_onsets(tokens)
+    assert result.tolist() == [0, 0, 0, 0, 1, 1.5, 2, 2, 4]
+
+
+def test_convert_with_timing(json_data):
+    lines = convert(json_data, tempo=True, timing=True).split("\n")
+    assert lines[3] == "**kern\t**text\t**time"
+    assert lines[7] == "*MM94\t*\t*"
+    assert lines[8] == "=1\t=1\t=1"
+    beat_map = get_beat_map(json_data)
+    assert lines[9] == f"4r\tG\t{beat_map[1][0]:.3f}"
+    assert lines[-1] == "*-\t*-\t*-"
@@ -0,0 +1,50 @@
+import copy
+import json
+
+import pytest
+
+from src.converter import convert
+from src.tokens import export_tokens, tokenize_kern, tokenize_note
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return j
+
+
+def test_tokenize_note():
+    assert tokenize_note("4.f#") == ["dur:4.", "pitch:f#"]
+    assert tokenize_note("8r") == ["dur:8", "pitch:r"]
+    assert tokenize_note("[16cc-L") == ["tie:[", "dur:16", "pitch:cc-", "beam:L"]
+    assert tokenize_note("8BB]J") == ["dur:8", "pitch:BB", "tie:]", "beam:J"]
+
+
+def test_tokenize_kern(json_data):
+    tokens = tokenize_kern(convert(list(json_data.values())[0]))
+    assert tokens[:4] == ["*clefG2", "*k[f#c#]", "*M4/4", "="]
+    assert tokens[4:7] == ["dur:4", "pitch:r", "chord:G"]
+    assert tokens[-1] == "*-"
+
+
+def test_export_tokens(json_data, tmp_path):
+    corpus = export_tokens(json_data, tmp_path)
+    assert len(corpus) == 1
+    assert corpus.metadata[0]["id"] == "qveoYyGGodn"
+    assert corpus.metadata[0]["split"] == "TRAIN"
+    expected = tokenize_kern(convert(json_data["qveoYyGGodn"]))
+    assert corpus.decode(corpus[0]) == expected
+
+
+def test_export_tokens_errors(json_data, tmp_path, capsys):
+    entry = json_data["qveoYyGGodn"]
+    broken = copy.deepcopy(entry)
+    broken["annotations"]["harmony"][0]["root_position_intervals"] = [1, 1]
+    broken["hooktheory"]["id"] = "broken"
+    data = {"qveoYyGGodn": entry, "broken": broken}
+    corpus = export_tokens(data, tmp_path, num_workers=2)
+    assert [m["id"] for m in corpus.metadata] == ["qveoYyGGodn"]
+    # the error of the worker is reported by the parent process
+    assert "broken: ValueError: Unknown chord nature" in capsys.readouterr().out
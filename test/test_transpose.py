@@ -0,0 +1,71 @@
+import copy
+import json
+
+import pytest
+
+from src.converter import convert
+from src.transpose import _kern_pitch_number, convert_transpositions
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+def test_kern_pitch_number():
+    assert _kern_pitch_number("c", "") == 0
+    assert _kern_pitch_number("c", "#") == 1
+    assert _kern_pitch_number("cc", "-") == 11
+    assert _kern_pitch_number("B", "") == -1
+    assert _kern_pitch_number("BB", "-") == -14
+
+
+def test_convert_transpositions(json_data):
+    result = convert_transpositions(json_data)
+    assert sorted(result) == list(range(-5, 7))
+    # no transposition gives the regular conversion
+    assert result[0] == convert(json_data)
+    # D major up a minor third is F major
+    lines = result[3].split("\n")
+    assert lines[5] == "*k[b-]\t*"
+    assert lines[8] == "4r\tBb"
+    assert lines[9] == "4dd\t."
+    # same rhythm in every key
+    assert all(len(s.split("\n")) == len(lines) for s in result.values())
+
+
+def test_convert_transpositions_octave(json_data):
+    result = convert_transpositions(json_data, [0, 12])
+    assert result[12].split("\n")[:9] == result[0].split("\n")[:9]
+    assert result[12].split("\n")[9] == "4bb\t."
+
+
+def _transposed(json_data, semitones):
+    entry = copy.deepcopy(json_data)
+    annotations = entry["annotations"]
+    for key in annotations["keys"]:
+        key["tonic_pitch_class"] = (key["tonic_pitch_class"] + semitones) % 12
+    for chord in annotations["harmony"]:
+        chord["root_pitch_class"] = (chord["root_pitch_class"] + semitones) % 12
+    for note in annotations["melody"]:
+        note["octave"], note["pitch_class"] = divmod(
+            12 * note["octave"] + note["pitch_class"] + semitones, 12
+        )
+    return entry
+
+
+def test_convert_transpositions_key_change(json_data):
+    # the key changes are triggered by notes that follow a note ending inside a bar, the key token is
+    # then written before the last token of that note, which keeps the spelling of the previous key
+    for beat in [5, 6, 9.5, 13.5]:
+        entry = copy.deepcopy(json_data)
+        entry["annotations"]["keys"].append(
+            {"beat": beat, "tonic_pitch_class": 5, "scale_degree_intervals": [2, 2, 1, 2, 2, 2]}
+        )
+        result = convert_transpositions(entry, [0, -4, 3, 6])
+        assert result[0] == convert(entry)
+        for semitones, kern in result.items():
+            assert kern == convert(_transposed(entry, semitones))
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from src.converter import convert
+from src.validate import validate_kern
+
+
+# Load the JSON file once for all tests
+@pytest.fixture
+def json_data():
+    with open("data/fileExample.json", "r") as f:
+        j = json.load(f)
+    return list(j.values())[0]
+
+
+def test_validate_converted(json_data):
+    assert validate_kern(convert(json_data)) == []
+    assert validate_kern(convert(json_data, tempo=True, timing=True)) == []
+    assert validate_kern(convert(json_data, start_beat=13, end_beat=30)) == []
+    # a single trailing newline is allowed, not an empty line after it
+    assert validate_kern(convert(json_data) + "\n") == []
+    assert validate_kern(convert(json_data) + "\n\n") != []
+
+
+def test_validate_window_chords(json_data):
+    # windows starting inside a bar, with chords starting between the bar line and the first note
+    for start_beat in [2.5, 3, 5.5, 9.25, 13.25, 18.5, 21.75]:
+        for length in [1, 2.5, 6]:
+            kern = convert(json_data, start_beat=start_beat, end_beat=start_beat + length)
+            assert validate_kern(kern) == [], (start_beat, length)
+            # the rest leading to the first note is not split by the chords before start_beat
+            tokens = [line.split("\t")[0] for line in kern.split("\n")]
+            rests = [t for t in tokens if "r" in t and t[0] not in "*!="]
+            assert not any(c in rest for rest in rests for c in "[]LJ"), (start_beat, length)
+
+
+def test_validate_problems(json_data):
+    lines = convert(json_data).split("\n")
+    assert validate_kern("\n".join(lines[:-1])) == [f"line {len(lines) - 1}: spines are not terminated"]
+    # the first eighth of the second bar becomes a quarter note
+    bar = lines.index("=2\t=2")
+    assert lines[bar + 2] == "8bL\t."
+    broken = list(lines)
+    broken[bar + 2] = "4b\t."
+    problems = validate_kern("\n".join(broken))
+    assert problems == [
+        f"line {bar + 4}: beam closed without being opened",
+        f"line {bar + 9}: bar 2 lasts 4.5 beats instead of 4",
+    ]
+    assert validate_kern("**kern\n*-") == ["line 1: expected **kern and **text spines"]